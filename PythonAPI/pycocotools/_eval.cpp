@@ -0,0 +1,67 @@
+// Python bindings of the C++ COCO evaluator (fastcocoeval/cocoeval.cpp).
+//
+//   InstanceAnnotation(id, score, area, is_crowd, ignore)
+//   COCOevalEvaluateImages(area_ranges, max_detections, iou_thresholds, ious, gts, dts)
+//       -> ImageEvaluations, the [KxAxI] per image results of COCOeval.evaluateImg()
+//   COCOevalAccumulate(params, evaluations, group_starts=[], group_sizes=[]) -> the COCOeval.eval
+//       dict, of the [KxAxI] results or of the slices group_starts / group_sizes of every (k, a)
+//   COCOevalPack(evaluations, num_iou_thresholds) -> dict of the flat arrays of PackedEvalImgs
+//
+// ImageEvaluations is an opaque vector, so the per image results stay in C++ between evaluate and
+// accumulate instead of being converted to a Python list and back. The matching runs with the
+// GIL released.
+
+#include <pybind11/numpy.h>
+#include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <pybind11/stl_bind.h>
+
+#include <vector>
+
+#include "cocoeval.h"
+
+namespace py = pybind11;
+using namespace pycocotools::COCOeval;
+
+PYBIND11_MAKE_OPAQUE(std::vector<ImageEvaluation>)
+
+PYBIND11_MODULE(_eval, m) {
+    m.doc() = "C++ implementation of COCOeval.evaluate() and COCOeval.accumulate()";
+
+    py::class_<InstanceAnnotation>(m, "InstanceAnnotation")
+        .def(py::init<uint64_t, double, double, bool, bool>(),
+             py::arg("id"),
+             py::arg("score"),
+             py::arg("area"),
+             py::arg("is_crowd"),
+             py::arg("ignore"));
+
+    py::class_<ImageEvaluation>(m, "ImageEvaluation")
+        .def(py::init<>())
+        .def_readonly("detection_matches", &ImageEvaluation::detection_matches)
+        .def_readonly("detection_scores", &ImageEvaluation::detection_scores)
+        .def_readonly("ground_truth_ignores", &ImageEvaluation::ground_truth_ignores)
+        .def_readonly("detection_ignores", &ImageEvaluation::detection_ignores)
+        .def_readonly("detection_ids", &ImageEvaluation::detection_ids)
+        .def_readonly("ground_truth_ids", &ImageEvaluation::ground_truth_ids)
+        .def_readonly("ground_truth_matches", &ImageEvaluation::ground_truth_matches);
+
+    py::bind_vector<std::vector<ImageEvaluation>>(m, "ImageEvaluations");
+
+    m.def("COCOevalEvaluateImages",
+          &EvaluateImages,
+          py::call_guard<py::gil_scoped_release>(),
+          "COCOeval::EvaluateImages");
+    m.def("COCOevalAccumulate",
+          &Accumulate,
+          py::arg("params"),
+          py::arg("evaluations"),
+          py::arg("group_starts") = std::vector<int64_t>(),
+          py::arg("group_sizes") = std::vector<int64_t>(),
+          "COCOeval::Accumulate");
+    m.def("COCOevalPack",
+          &PackEvaluations,
+          py::arg("evaluations"),
+          py::arg("num_iou_thresholds"),
+          "COCOeval::PackEvaluations");
+}
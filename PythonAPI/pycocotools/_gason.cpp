@@ -0,0 +1,676 @@
+// Python bindings of the bundled gason JSON parser (common/gason.cpp).
+//
+//   loads(data)           -> the document as Python objects, like json.loads
+//   load(path)            -> the file as Python objects, like json.load
+//   load_columnar(path)   -> (dataset without "annotations", AnnotationColumns arrays or None)
+//
+// load_columnar fills the numeric annotation columns straight from the parsed tree, following
+// the same rules as pycocotools.columnar.ColumnarBuilder, so no per-annotation Python objects are
+// created. The file is read and parsed with the GIL released.
+
+#include <pybind11/numpy.h>
+#include <pybind11/pybind11.h>
+
+#include <cerrno>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include "gason.h"
+
+namespace py = pybind11;
+
+namespace {
+
+// must match pycocotools/columnar.py
+enum : uint8_t {
+    HAS_AREA = 1,
+    HAS_ISCROWD = 2,
+    HAS_BBOX = 4,
+    HAS_SCORE = 8,
+    HAS_KEYPOINTS = 16,
+    HAS_CATEGORY = 32,
+    INT_AREA = 64,
+};
+enum : uint8_t { SEG_NONE = 0, SEG_POLYGON = 1, SEG_RLE = 2, SEG_COUNTS = 3 };
+
+struct Document {
+    std::vector<char> text;
+    JsonAllocator allocator;
+    JsonValue root;
+};
+
+// returns 0 or an errno value
+int read_file(const std::string &path, std::vector<char> &out) {
+    FILE *f = std::fopen(path.c_str(), "rb");
+    if (f == nullptr)
+        return errno ? errno : ENOENT;
+    if (std::fseek(f, 0, SEEK_END) == 0) {
+        long size = std::ftell(f);
+        if (size > 0)
+            out.reserve(size + 1);
+        std::rewind(f);
+    }
+    char buf[1 << 16];
+    size_t n;
+    while ((n = std::fread(buf, 1, sizeof(buf), f)) > 0)
+        out.insert(out.end(), buf, buf + n);
+    int error = std::ferror(f) ? EIO : 0;
+    std::fclose(f);
+    return error;
+}
+
+void read_file_or_throw(const std::string &path, std::vector<char> &out) {
+    int error;
+    {
+        py::gil_scoped_release release;
+        error = read_file(path, out);
+    }
+    if (error) {
+        errno = error;
+        PyErr_SetFromErrnoWithFilename(PyExc_OSError, path.c_str());
+        throw py::error_already_set();
+    }
+}
+
+// parse doc.text in place; returns an error message, empty on success
+std::string parse(Document &doc) {
+    size_t size = doc.text.size();
+    doc.text.push_back('\0');
+    char *begin = doc.text.data();
+    char *end = begin;
+    int status = jsonParse(begin, &end, &doc.root, doc.allocator);
+    if (status != JSON_OK)
+        return std::string(jsonStrError(status)) + " at offset " + std::to_string(end - begin);
+    while (end < begin + size && (*end == ' ' || (*end >= '\t' && *end <= '\r')))
+        ++end;
+    if (end != begin + size)
+        return "extra data at offset " + std::to_string(end - begin);
+    return std::string();
+}
+
+void parse_or_throw(Document &doc) {
+    std::string error;
+    {
+        py::gil_scoped_release release;
+        error = parse(doc);
+    }
+    if (!error.empty())
+        throw py::value_error("invalid JSON: " + error);
+}
+
+size_t length(JsonValue v) {
+    size_t n = 0;
+    for (auto node = v.toNode(); node != nullptr; node = node->next)
+        ++n;
+    return n;
+}
+
+bool is_number(JsonValue v) {
+    return v.getTag() == JSON_NUMBER || v.getTag() == JSON_INTEGER;
+}
+
+double to_double(JsonValue v) {
+    if (v.getTag() == JSON_INTEGER)
+        return std::strtod(v.toIntegerLiteral(), nullptr);
+    return v.toNumber();
+}
+
+// ------------------------------------------------------------------------------------------------
+// JsonValue -> Python objects
+// ------------------------------------------------------------------------------------------------
+class Converter {
+public:
+    ~Converter() {
+        for (auto &kv : keys_)
+            Py_DECREF(kv.second);
+    }
+
+    // new reference, or nullptr with a Python error set
+    PyObject *convert(JsonValue v) {
+        switch (v.getTag()) {
+        case JSON_NUMBER:
+            return PyFloat_FromDouble(v.toNumber());
+        case JSON_INTEGER:
+            return integer(v.toIntegerLiteral());
+        case JSON_STRING:
+            return string(v.toString());
+        case JSON_ARRAY: {
+            PyObject *list = PyList_New(length(v));
+            if (list == nullptr)
+                return nullptr;
+            Py_ssize_t i = 0;
+            for (auto node = v.toNode(); node != nullptr; node = node->next) {
+                PyObject *item = convert(node->value);
+                if (item == nullptr) {
+                    Py_DECREF(list);
+                    return nullptr;
+                }
+                PyList_SET_ITEM(list, i++, item);
+            }
+            return list;
+        }
+        case JSON_OBJECT: {
+            PyObject *dict = PyDict_New();
+            if (dict == nullptr)
+                return nullptr;
+            for (auto node = v.toNode(); node != nullptr; node = node->next) {
+                if (!set_item(dict, node->key, node->value)) {
+                    Py_DECREF(dict);
+                    return nullptr;
+                }
+            }
+            return dict;
+        }
+        case JSON_TRUE:
+            Py_RETURN_TRUE;
+        case JSON_FALSE:
+            Py_RETURN_FALSE;
+        default:
+            Py_RETURN_NONE;
+        }
+    }
+
+    bool set_item(PyObject *dict, const char *key, JsonValue value) {
+        PyObject *k = this->key(key);
+        if (k == nullptr)
+            return false;
+        PyObject *item = convert(value);
+        if (item == nullptr)
+            return false;
+        int status = PyDict_SetItem(dict, k, item);
+        Py_DECREF(item);
+        return status == 0;
+    }
+
+private:
+    // one str object per distinct key, like the memo of json.load; borrowed reference
+    PyObject *key(const char *s) {
+        auto it = keys_.find(s);
+        if (it != keys_.end())
+            return it->second;
+        PyObject *k = string(s);
+        if (k == nullptr)
+            return nullptr;
+        keys_.emplace(s, k);
+        return k;
+    }
+
+    static PyObject *integer(const char *literal) {
+        errno = 0;
+        char *end;
+        long long value = std::strtoll(literal, &end, 10);
+        if (errno != ERANGE)
+            return PyLong_FromLongLong(value);
+        std::string digits(literal, (const char *)end);
+        return PyLong_FromString(digits.c_str(), nullptr, 10);
+    }
+
+    static PyObject *string(const char *s) {
+        size_t n = std::strlen(s);
+        // gason writes \\uD83D\\uDE00 style surrogate pairs as two separate 3 byte sequences
+        bool surrogates = false;
+        for (const char *p = s; (p = (const char *)std::memchr(p, '\xED', n - (p - s))); ++p) {
+            if (p + 1 < s + n && ((unsigned char)p[1] & 0xE0) == 0xA0) {
+                surrogates = true;
+                break;
+            }
+        }
+        if (!surrogates)
+            return PyUnicode_DecodeUTF8(s, n, nullptr);
+        PyObject *raw = PyUnicode_DecodeUTF8(s, n, "surrogatepass");
+        if (raw == nullptr)
+            return nullptr;
+        PyObject *utf16 = PyUnicode_AsEncodedString(raw, "utf-16-le", "surrogatepass");
+        Py_DECREF(raw);
+        if (utf16 == nullptr)
+            return nullptr;
+        PyObject *out = PyUnicode_Decode(
+            PyBytes_AS_STRING(utf16), PyBytes_GET_SIZE(utf16), "utf-16-le", "surrogatepass");
+        Py_DECREF(utf16);
+        return out;
+    }
+
+    std::unordered_map<std::string, PyObject *> keys_;
+};
+
+// The converted documents are acyclic, so the cyclic GC has nothing to find in them, but the
+// allocations would trigger a number of (increasingly expensive) collections.
+class GCPause {
+public:
+    GCPause() {
+#if PY_VERSION_HEX >= 0x030A0000
+        enabled_ = PyGC_Disable();
+#endif
+    }
+    ~GCPause() {
+#if PY_VERSION_HEX >= 0x030A0000
+        if (enabled_)
+            PyGC_Enable();
+#endif
+    }
+
+private:
+    int enabled_ = 0;
+};
+
+py::object to_python(Converter &converter, JsonValue v) {
+    GCPause pause;
+    PyObject *obj = converter.convert(v);
+    if (obj == nullptr)
+        throw py::error_already_set();
+    return py::reinterpret_steal<py::object>(obj);
+}
+
+// ------------------------------------------------------------------------------------------------
+// JsonValue -> JSON text, for the fields that go to AnnotationColumns.extra_bytes
+// ------------------------------------------------------------------------------------------------
+void dump(JsonValue v, std::string &out) {
+    switch (v.getTag()) {
+    case JSON_NUMBER: {
+        char buf[32];
+        int n = std::snprintf(buf, sizeof(buf), "%.17g", v.toNumber());
+        out.append(buf, n);
+        // keep floats floats when read back
+        if (std::strpbrk(buf, ".eEn") == nullptr)
+            out += ".0";
+        break;
+    }
+    case JSON_INTEGER: {
+        const char *s = v.toIntegerLiteral();
+        const char *e = s + (*s == '-');
+        while (*e >= '0' && *e <= '9')
+            ++e;
+        out.append(s, e);
+        break;
+    }
+    case JSON_STRING: {
+        out += '"';
+        for (const char *s = v.toString(); *s; ++s) {
+            unsigned char c = *s;
+            if (c == 0xED && ((unsigned char)s[1] & 0xE0) == 0xA0 && s[2]) {
+                // half of a surrogate pair (see Converter::string), escape it so that the
+                // reader joins the pair again
+                int code = ((c & 0x0F) << 12) | ((s[1] & 0x3F) << 6) | (s[2] & 0x3F);
+                char buf[8];
+                std::snprintf(buf, sizeof(buf), "\\u%04x", code);
+                out += buf;
+                s += 2;
+            } else if (c == '"' || c == '\\') {
+                out += '\\';
+                out += c;
+            } else if (c < 0x20) {
+                char buf[8];
+                std::snprintf(buf, sizeof(buf), "\\u%04x", c);
+                out += buf;
+            } else {
+                out += c;
+            }
+        }
+        out += '"';
+        break;
+    }
+    case JSON_ARRAY: {
+        out += '[';
+        bool first = true;
+        for (auto node = v.toNode(); node != nullptr; node = node->next) {
+            if (!first)
+                out += ',';
+            first = false;
+            dump(node->value, out);
+        }
+        out += ']';
+        break;
+    }
+    case JSON_OBJECT: {
+        out += '{';
+        bool first = true;
+        for (auto node = v.toNode(); node != nullptr; node = node->next) {
+            if (!first)
+                out += ',';
+            first = false;
+            dump(JsonValue(JSON_STRING, node->key), out);
+            out += ':';
+            dump(node->value, out);
+        }
+        out += '}';
+        break;
+    }
+    case JSON_TRUE:
+        out += "true";
+        break;
+    case JSON_FALSE:
+        out += "false";
+        break;
+    default:
+        out += "null";
+    }
+}
+
+// ------------------------------------------------------------------------------------------------
+// annotations -> columns (mirrors pycocotools.columnar.ColumnarBuilder.append)
+// ------------------------------------------------------------------------------------------------
+struct Columns {
+    std::vector<int64_t> id, image_id, category_id;
+    std::vector<double> area, bbox, score;
+    std::vector<uint8_t> iscrowd, flags, seg_kind;
+    std::vector<int64_t> seg_size, seg_offsets{0}, part_start, part_len;
+    std::vector<double> seg_data;
+    std::vector<uint8_t> seg_bytes;
+    std::vector<int64_t> kp_offsets{0};
+    std::vector<double> kp_data;
+    std::vector<int64_t> extra_offsets{0};
+    std::vector<uint8_t> extra_bytes;
+
+    // returns an error message, empty on success
+    std::string append(JsonValue ann, size_t index) {
+        if (ann.getTag() != JSON_OBJECT)
+            return "annotation " + std::to_string(index) + " is not an object";
+        JsonValue v_id, v_image_id, v_category, v_area, v_iscrowd, v_bbox, v_score, v_segm, v_kp;
+        bool has_id = false, has_image_id = false, has_category = false, has_area = false,
+             has_iscrowd = false, has_bbox = false, has_score = false, has_segm = false,
+             has_kp = false;
+        std::vector<std::pair<const char *, JsonValue>> extra;
+        for (auto node = ann.toNode(); node != nullptr; node = node->next) {
+            const char *k = node->key;
+            JsonValue v = node->value;
+            if (!std::strcmp(k, "id"))
+                v_id = v, has_id = true;
+            else if (!std::strcmp(k, "image_id"))
+                v_image_id = v, has_image_id = true;
+            else if (!std::strcmp(k, "category_id"))
+                v_category = v, has_category = true;
+            else if (!std::strcmp(k, "area"))
+                v_area = v, has_area = true;
+            else if (!std::strcmp(k, "iscrowd"))
+                v_iscrowd = v, has_iscrowd = true;
+            else if (!std::strcmp(k, "bbox"))
+                v_bbox = v, has_bbox = true;
+            else if (!std::strcmp(k, "score"))
+                v_score = v, has_score = true;
+            else if (!std::strcmp(k, "segmentation"))
+                v_segm = v, has_segm = true;
+            else if (!std::strcmp(k, "keypoints"))
+                v_kp = v, has_kp = true;
+            else
+                extra.emplace_back(k, v);
+        }
+        std::string where = " of annotation " + std::to_string(index);
+        if (!has_id)
+            return "missing id" + where;
+        if (!has_image_id)
+            return "missing image_id" + where;
+        if (v_id.getTag() != JSON_INTEGER || v_image_id.getTag() != JSON_INTEGER)
+            return "non integer id / image_id" + where;
+        uint8_t flag = 0;
+        std::vector<std::pair<const char *, JsonValue>> front;
+
+        id.push_back(integer(v_id));
+        image_id.push_back(integer(v_image_id));
+        if (has_category) {
+            if (v_category.getTag() != JSON_INTEGER)
+                return "non integer category_id" + where;
+            flag |= HAS_CATEGORY;
+            category_id.push_back(integer(v_category));
+        } else {
+            category_id.push_back(-1);
+        }
+        if (has_area) {
+            if (!is_number(v_area))
+                return "non numeric area" + where;
+            flag |= HAS_AREA;
+            if (v_area.getTag() == JSON_INTEGER)
+                flag |= INT_AREA;
+            area.push_back(to_double(v_area));
+        } else {
+            area.push_back(NAN);
+        }
+        if (has_iscrowd) {
+            JsonTag t = v_iscrowd.getTag();
+            if (t != JSON_TRUE && t != JSON_FALSE && !is_number(v_iscrowd))
+                return "non numeric iscrowd" + where;
+            flag |= HAS_ISCROWD;
+            double c = t == JSON_TRUE ? 1 : t == JSON_FALSE ? 0 : to_double(v_iscrowd);
+            iscrowd.push_back((uint8_t)(int64_t)c);
+        } else {
+            iscrowd.push_back(0);
+        }
+        if (has_bbox && v_bbox.getTag() == JSON_ARRAY && length(v_bbox) == 4) {
+            for (auto node = v_bbox.toNode(); node != nullptr; node = node->next) {
+                if (!is_number(node->value))
+                    return "non numeric bbox" + where;
+                bbox.push_back(to_double(node->value));
+            }
+            flag |= HAS_BBOX;
+        } else {
+            // like ColumnarBuilder: a null bbox is dropped, anything else goes to extras
+            if (has_bbox && v_bbox.getTag() != JSON_NULL)
+                front.emplace_back("bbox", v_bbox);
+            bbox.insert(bbox.end(), 4, NAN);
+        }
+        if (has_score) {
+            if (!is_number(v_score))
+                return "non numeric score" + where;
+            flag |= HAS_SCORE;
+            score.push_back(to_double(v_score));
+        } else {
+            score.push_back(NAN);
+        }
+        if (has_kp) {
+            if (v_kp.getTag() != JSON_ARRAY)
+                return "keypoints is not an array" + where;
+            for (auto node = v_kp.toNode(); node != nullptr; node = node->next) {
+                if (!is_number(node->value))
+                    return "non numeric keypoints" + where;
+                kp_data.push_back(to_double(node->value));
+            }
+            flag |= HAS_KEYPOINTS;
+        }
+        kp_offsets.push_back(kp_data.size());
+        flags.push_back(flag);
+        if (!append_segmentation(has_segm, v_segm) && has_segm)
+            front.emplace_back("segmentation", v_segm);
+
+        front.insert(front.end(), extra.begin(), extra.end());
+        if (!front.empty()) {
+            std::string out = "{";
+            for (size_t i = 0; i < front.size(); ++i) {
+                if (i)
+                    out += ',';
+                dump(JsonValue(JSON_STRING, (void *)front[i].first), out);
+                out += ':';
+                dump(front[i].second, out);
+            }
+            out += '}';
+            extra_bytes.insert(extra_bytes.end(), out.begin(), out.end());
+        }
+        extra_offsets.push_back(extra_bytes.size());
+        return std::string();
+    }
+
+    static int64_t integer(JsonValue v) {
+        return std::strtoll(v.toIntegerLiteral(), nullptr, 10);
+    }
+
+    static bool numeric_array(JsonValue v) {
+        if (v.getTag() != JSON_ARRAY)
+            return false;
+        for (auto node = v.toNode(); node != nullptr; node = node->next)
+            if (!is_number(node->value))
+                return false;
+        return true;
+    }
+
+    bool append_segmentation(bool present, JsonValue segm) {
+        int64_t h = 0, w = 0;
+        uint8_t kind = SEG_NONE;
+        if (present && segm.getTag() == JSON_ARRAY) {
+            bool ok = true;
+            for (auto poly = segm.toNode(); poly != nullptr; poly = poly->next)
+                ok = ok && numeric_array(poly->value);
+            if (ok) {
+                kind = SEG_POLYGON;
+                for (auto poly = segm.toNode(); poly != nullptr; poly = poly->next) {
+                    part_start.push_back(seg_data.size());
+                    for (auto node = poly->value.toNode(); node != nullptr; node = node->next)
+                        seg_data.push_back(to_double(node->value));
+                    part_len.push_back(seg_data.size() - part_start.back());
+                }
+            }
+        } else if (present && segm.getTag() == JSON_OBJECT) {
+            JsonValue size, counts;
+            bool has_size = false, has_counts = false;
+            for (auto node = segm.toNode(); node != nullptr; node = node->next) {
+                if (!std::strcmp(node->key, "size"))
+                    size = node->value, has_size = true;
+                else if (!std::strcmp(node->key, "counts"))
+                    counts = node->value, has_counts = true;
+            }
+            bool size_ok = has_size && numeric_array(size) && length(size) == 2;
+            if (size_ok && has_counts) {
+                h = (int64_t)to_double(size.toNode()->value);
+                w = (int64_t)to_double(size.toNode()->next->value);
+                if (counts.getTag() == JSON_STRING) {
+                    const char *s = counts.toString();
+                    size_t n = std::strlen(s);
+                    kind = SEG_RLE;
+                    part_start.push_back(seg_bytes.size());
+                    part_len.push_back(n);
+                    seg_bytes.insert(seg_bytes.end(), s, s + n);
+                } else if (numeric_array(counts)) {
+                    kind = SEG_COUNTS;
+                    part_start.push_back(seg_data.size());
+                    for (auto node = counts.toNode(); node != nullptr; node = node->next)
+                        seg_data.push_back(to_double(node->value));
+                    part_len.push_back(seg_data.size() - part_start.back());
+                } else {
+                    h = w = 0;
+                }
+            }
+        }
+        seg_kind.push_back(kind);
+        seg_size.push_back(h);
+        seg_size.push_back(w);
+        seg_offsets.push_back(part_start.size());
+        return kind != SEG_NONE;
+    }
+};
+
+template <typename T>
+py::array_t<T> to_array(const std::vector<T> &v, py::ssize_t cols = 0) {
+    std::vector<py::ssize_t> shape;
+    if (cols)
+        shape = {(py::ssize_t)v.size() / cols, cols};
+    else
+        shape = {(py::ssize_t)v.size()};
+    py::array_t<T> out(shape);
+    if (!v.empty())
+        std::memcpy(out.mutable_data(), v.data(), v.size() * sizeof(T));
+    return out;
+}
+
+py::dict columns_to_dict(const Columns &c) {
+    py::dict out;
+    out["id"] = to_array(c.id);
+    out["image_id"] = to_array(c.image_id);
+    out["category_id"] = to_array(c.category_id);
+    out["area"] = to_array(c.area);
+    out["iscrowd"] = to_array(c.iscrowd);
+    out["bbox"] = to_array(c.bbox, 4);
+    out["score"] = to_array(c.score);
+    out["flags"] = to_array(c.flags);
+    out["seg_kind"] = to_array(c.seg_kind);
+    out["seg_size"] = to_array(c.seg_size, 2);
+    out["seg_offsets"] = to_array(c.seg_offsets);
+    out["part_start"] = to_array(c.part_start);
+    out["part_len"] = to_array(c.part_len);
+    out["seg_data"] = to_array(c.seg_data);
+    out["seg_bytes"] = to_array(c.seg_bytes);
+    out["kp_offsets"] = to_array(c.kp_offsets);
+    out["kp_data"] = to_array(c.kp_data);
+    out["extra_offsets"] = to_array(c.extra_offsets);
+    out["extra_bytes"] = to_array(c.extra_bytes);
+    return out;
+}
+
+py::object load(const std::string &path) {
+    Document doc;
+    read_file_or_throw(path, doc.text);
+    parse_or_throw(doc);
+    Converter converter;
+    return to_python(converter, doc.root);
+}
+
+py::object loads(py::buffer data) {
+    py::buffer_info info = data.request();
+    Document doc;
+    const char *p = static_cast<const char *>(info.ptr);
+    doc.text.assign(p, p + info.size * info.itemsize);
+    parse_or_throw(doc);
+    Converter converter;
+    return to_python(converter, doc.root);
+}
+
+py::tuple load_columnar(const std::string &path) {
+    Document doc;
+    Columns columns;
+    JsonValue annotations;
+    bool has_annotations = false;
+    std::string error, ann_error;
+    read_file_or_throw(path, doc.text);
+    {
+        py::gil_scoped_release release;
+        error = parse(doc);
+        if (error.empty() && doc.root.getTag() == JSON_OBJECT) {
+            for (auto node = doc.root.toNode(); node != nullptr; node = node->next) {
+                if (!std::strcmp(node->key, "annotations") && node->value.getTag() == JSON_ARRAY) {
+                    annotations = node->value;
+                    has_annotations = true;
+                }
+            }
+            if (has_annotations) {
+                size_t i = 0;
+                for (auto node = annotations.toNode(); node != nullptr && ann_error.empty();
+                     node = node->next)
+                    ann_error = columns.append(node->value, i++);
+            }
+        }
+    }
+    if (!error.empty())
+        throw py::value_error("invalid JSON: " + error);
+    if (!ann_error.empty())
+        throw py::value_error(ann_error);
+    Converter converter;
+    if (doc.root.getTag() != JSON_OBJECT)
+        return py::make_tuple(to_python(converter, doc.root), py::none());
+    py::dict dataset;
+    GCPause pause;
+    for (auto node = doc.root.toNode(); node != nullptr; node = node->next) {
+        if (has_annotations && !std::strcmp(node->key, "annotations"))
+            continue;
+        if (!converter.set_item(dataset.ptr(), node->key, node->value))
+            throw py::error_already_set();
+    }
+    if (!has_annotations)
+        return py::make_tuple(dataset, py::none());
+    return py::make_tuple(dataset, columns_to_dict(columns));
+}
+
+} // namespace
+
+PYBIND11_MODULE(_gason, m) {
+    m.doc() = "JSON loading with the bundled gason parser";
+    m.def("load", &load, py::arg("path"), "Parse a JSON file into Python objects.");
+    m.def("loads", &loads, py::arg("data"), "Parse JSON bytes into Python objects.");
+    m.def(
+        "load_columnar",
+        &load_columnar,
+        py::arg("path"),
+        "Parse a COCO annotation file. Returns (dataset without \"annotations\", dict of "
+        "AnnotationColumns arrays), or (document, None) if it has no annotations array.");
+}
@@ -17,7 +17,10 @@ PYTHON_VERSION = sys.version_info[0]
 # the API uses Numpy to interface C and Python
 import numpy as np
 cimport numpy as np
-from libc.stdlib cimport malloc, free
+from libc.stdlib cimport malloc, calloc, free
+from libc.string cimport memcpy, memset
+from cpython.buffer cimport PyBUF_WRITABLE
+from collections.abc import Mapping
 
 # intialized Numpy. must do.
 np.import_array()
@@ -28,7 +31,8 @@ cdef extern from "numpy/arrayobject.h":
     void PyArray_ENABLEFLAGS(np.ndarray arr, int flags)
 
 # Declare the prototype of the C functions in MaskApi.h
-cdef extern from "maskApi.h":
+# the functions don't touch Python objects, so they can run with the GIL released
+cdef extern from "maskApi.h" nogil:
     ctypedef unsigned int uint
     ctypedef unsigned long siz
     ctypedef unsigned char byte
@@ -38,35 +42,53 @@ cdef extern from "maskApi.h":
         siz w,
         siz m,
         uint* cnts,
+    void rleInit( RLE *R, siz h, siz w, siz m, uint *cnts )
     void rlesInit( RLE **R, siz n )
     void rleEncode( RLE *R, const byte *M, siz h, siz w, siz n )
     void rleDecode( const RLE *R, byte *mask, siz n )
+    void rleDecodeBox( const RLE *R, const double *bb, siz H, siz W, void *M, siz k, uint v )
     void rleMerge( const RLE *R, RLE *M, siz n, int intersect )
     void rleArea( const RLE *R, siz n, uint *a )
     void rleIou( RLE *dt, RLE *gt, siz m, siz n, byte *iscrowd, double *o )
+    void rleNms( RLE *dt, siz n, uint *keep, double thr )
+    void rleNmsSweep( RLE *dt, siz n, uint *keep, double thr )
     void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o )
+    void bbNms( BB dt, siz n, uint *keep, double thr )
+    void bbNmsSweep( BB dt, siz n, uint *keep, double thr )
     void rleToBbox( const RLE *R, BB bb, siz n )
     void rleFrBbox( RLE *R, const BB bb, siz h, siz w, siz n )
     void rleFrPoly( RLE *R, const double *xy, siz k, siz h, siz w )
     char* rleToString( const RLE *R )
+    void rleShift( const RLE *R, RLE *M, long dx, long dy, siz h, siz w )
+    void rleResize( const RLE *R, RLE *M, siz h, siz w )
+    void rleMoments( const RLE *R, siz n, double *mo )
+    void rleProject( const RLE *R, uint *rows, uint *cols )
+    siz rleToPoly( const RLE *R, double **xy, siz **k )
     void rleFrString( RLE *R, char *s, siz h, siz w )
 
 # python class to wrap RLE array in C
 # the class handles the memory allocation and deallocation
+# the counts of RLEs filled from RLEMask objects are borrowed from them and not freed here
 cdef class RLEs:
     cdef RLE *_R
     cdef siz _n
+    cdef byte *_borrowed
+    cdef list _owners
 
     def __cinit__(self, siz n =0):
         rlesInit(&self._R, n)
         self._n = n
+        self._borrowed = <byte*> calloc(n, sizeof(byte))
+        self._owners = []
 
     # free the RLE array here
     def __dealloc__(self):
         if self._R is not NULL:
             for i in range(self._n):
-                free(self._R[i].cnts)
+                if not self._borrowed[i]:
+                    free(self._R[i].cnts)
             free(self._R)
+        free(self._borrowed)
     def __getattr__(self, key):
         if key == 'n':
             return self._n
@@ -99,14 +121,141 @@ cdef class Masks:
         PyArray_ENABLEFLAGS(ndarray, np.NPY_OWNDATA)
         return ndarray
 
+# python class of a single RLE, the native counterpart of the {'size': [h, w], 'counts': bytes}
+# dict. The mask functions parse dicts on every call, but borrow the counts of RLEMask objects as
+# they are. The counts are exposed read-only through the buffer protocol (np.asarray(R) is a
+# uint32 view), and R['size'] / R['counts'] / dict(R) give the dict form for JSON I/O.
+cdef class RLEMask:
+    cdef RLE _R
+    cdef Py_ssize_t _shape[1]
+    cdef Py_ssize_t _strides[1]
+
+    def __cinit__(self):
+        self._R.h = self._R.w = self._R.m = 0
+        self._R.cnts = NULL
+
+    def __init__(self, rleObj=None):
+        # from a compressed or uncompressed (list or array counts) RLE dict, or a copy of an RLEMask
+        cdef RLEs Rs
+        if rleObj is None:
+            return
+        if type(rleObj) != RLEMask and not isinstance(rleObj['counts'], (str, bytes)):
+            rleObj = frUncompressedRLE([rleObj], rleObj['size'][0], rleObj['size'][1], True)[0]
+        Rs = _frString([rleObj])
+        rleInit(&self._R, Rs._R[0].h, Rs._R[0].w, Rs._R[0].m, Rs._R[0].cnts)
+
+    def __dealloc__(self):
+        free(self._R.cnts)
+
+    @property
+    def size(self):
+        return [self._R.h, self._R.w]
+
+    @property
+    def counts(self):
+        return np.asarray(self)
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        if flags & PyBUF_WRITABLE:
+            raise BufferError('RLEMask counts are read-only')
+        self._shape[0] = self._R.m
+        self._strides[0] = sizeof(uint)
+        buffer.buf = <void*> self._R.cnts if self._R.cnts is not NULL else <void*> &self._R
+        buffer.format = 'I'
+        buffer.internal = NULL
+        buffer.itemsize = sizeof(uint)
+        buffer.len = self._R.m * sizeof(uint)
+        buffer.ndim = 1
+        buffer.obj = self
+        buffer.readonly = 1
+        buffer.shape = self._shape
+        buffer.strides = self._strides
+        buffer.suboffsets = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+    def toDict(self):
+        cdef char* c_string
+        with nogil:
+            c_string = rleToString(&self._R)
+        cdef bytes py_string = c_string
+        free(c_string)
+        return {'size': [self._R.h, self._R.w], 'counts': py_string}
+
+    # read-only mapping of the dict form
+    def __getitem__(self, key):
+        if key == 'size':
+            return self.size
+        if key == 'counts':
+            return self.toDict()['counts']
+        raise KeyError(key)
+
+    def keys(self):
+        return ['size', 'counts']
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return 2
+
+    def __contains__(self, key):
+        return key in ('size', 'counts')
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __eq__(self, other):
+        if type(other) != RLEMask:
+            return NotImplemented
+        return self.size == other.size and np.array_equal(self.counts, other.counts)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (RLEMask, (self.toDict(),))
+
+    def __repr__(self):
+        return 'RLEMask(size=[{}, {}], m={})'.format(self._R.h, self._R.w, self._R.m)
+
+Mapping.register(RLEMask)
+
+cdef bint _isRle(obj):
+    return type(obj) == RLEMask or type(obj) == dict
+
+# internal conversion from Python RLEs object to RLEMask objects, the counts are moved unless
+# they are borrowed
+def _toRLEMask(RLEs Rs):
+    cdef RLEMask R
+    cdef siz i
+    objs = []
+    for i in range(Rs._n):
+        R = RLEMask()
+        if Rs._borrowed[i]:
+            rleInit(&R._R, Rs._R[i].h, Rs._R[i].w, Rs._R[i].m, Rs._R[i].cnts)
+        else:
+            R._R = Rs._R[i]
+            Rs._R[i].cnts = NULL
+            Rs._R[i].m = 0
+        objs.append(R)
+    return objs
+
+# RLEMask objects or compressed RLE dicts of an RLEs object
+def _output(RLEs Rs, rleMask):
+    return _toRLEMask(Rs) if rleMask else _toString(Rs)
+
 # internal conversion from Python RLEs object to compressed RLE format
 def _toString(RLEs Rs):
     cdef siz n = Rs.n
     cdef bytes py_string
     cdef char* c_string
     objs = []
+    cdef RLE* R = Rs._R
+    cdef siz i
     for i in range(n):
-        c_string = rleToString( <RLE*> &Rs._R[i] )
+        with nogil:
+            c_string = rleToString( &R[i] )
         py_string = c_string
         objs.append({
             'size': [Rs._R[i].h, Rs._R[i].w],
@@ -118,10 +267,17 @@ def _toString(RLEs Rs):
 # internal conversion from compressed RLE format to Python RLEs object
 def _frString(rleObjs):
     cdef siz n = len(rleObjs)
-    Rs = RLEs(n)
+    cdef RLEs Rs = RLEs(n)
     cdef bytes py_string
     cdef char* c_string
+    cdef RLEMask R
     for i, obj in enumerate(rleObjs):
+        if type(obj) == RLEMask:
+            R = obj
+            Rs._R[i] = R._R
+            Rs._borrowed[i] = 1
+            Rs._owners.append(R)
+            continue
         if PYTHON_VERSION == 2:
             py_string = str(obj['counts']).encode('utf8')
         elif PYTHON_VERSION == 3:
@@ -134,32 +290,70 @@ def _frString(rleObjs):
 
 # encode mask to RLEs objects
 # list of RLE string can be generated by RLEs member function
-def encode(np.ndarray[np.uint8_t, ndim=3, mode='fortran'] mask):
-    h, w, n = mask.shape[0], mask.shape[1], mask.shape[2]
+def encode(np.ndarray[np.uint8_t, ndim=3, mode='fortran'] mask, rleMask=False):
+    cdef siz h = mask.shape[0], w = mask.shape[1], n = mask.shape[2]
     cdef RLEs Rs = RLEs(n)
-    rleEncode(Rs._R,<byte*>mask.data,h,w,n)
-    objs = _toString(Rs)
-    return objs
+    cdef byte* M = <byte*> mask.data
+    with nogil:
+        rleEncode(Rs._R, M, h, w, n)
+    return _output(Rs, rleMask)
 
 # decode mask from compressed list of RLE string or RLEs object
 def decode(rleObjs):
     cdef RLEs Rs = _frString(rleObjs)
     h, w, n = Rs._R[0].h, Rs._R[0].w, Rs._n
-    masks = Masks(h, w, n)
-    rleDecode(<RLE*>Rs._R, masks._mask, n);
+    cdef Masks masks = Masks(h, w, n)
+    with nogil:
+        rleDecode(<RLE*>Rs._R, masks._mask, n)
     return np.array(masks)
 
-def merge(rleObjs, intersect=0):
+def decodeInto(rleObjs, np.ndarray out, boxes=None, labels=None):
+    # decode into out (C-contiguous): [n,H,W] with mask i in out[i], or a [H,W] label map with the
+    # pixels of mask i set to labels[i] (default i+1, later masks on top of earlier ones).
+    # Mask i is sampled on the HxW grid from its box boxes[i]=[x y w h], or from the whole mask.
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef siz i, n = Rs._n, k = out.itemsize, H, W, plane
+    cdef np.ndarray[np.uint32_t, ndim=1] v
+    cdef np.ndarray[np.double_t, ndim=2] bb
+    cdef double* _bb = NULL
+    cdef char* M = out.data
+    if not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError('out must be a writeable C-contiguous array')
+    if out.dtype.kind not in 'biu' or k not in (1, 2, 4):
+        raise ValueError('out must have an integer or bool dtype of 1, 2 or 4 bytes')
+    if (out.ndim != 3 or out.shape[0] != n) and out.ndim != 2:
+        raise ValueError('out must be [n,H,W] or a [H,W] label map for n=%d masks' % n)
+    H, W = out.shape[out.ndim-2], out.shape[out.ndim-1]
+    plane = H*W*k if out.ndim == 3 else 0
+    if labels is None:
+        v = np.arange(1, n+1, dtype=np.uint32) if plane == 0 else np.ones(n, dtype=np.uint32)
+    else:
+        v = np.ascontiguousarray(labels, dtype=np.uint32).reshape(-1)
+    if boxes is not None:
+        bb = np.ascontiguousarray(boxes, dtype=np.double).reshape((-1, 4))
+        _bb = <double*> bb.data
+    if v.shape[0] != n or (boxes is not None and bb.shape[0] != n):
+        raise ValueError('boxes and labels must have one row per mask')
+    with nogil:
+        memset(M, 0, n*plane if plane else H*W*k)
+        for i in range(n):
+            rleDecodeBox(&Rs._R[i], _bb + 4*i if _bb != NULL else NULL, H, W, M + i*plane, k, v[i])
+    return out
+
+# merge op: 0 union, 1 intersection, 2 xor, 3 difference (first mask minus the others)
+def merge(rleObjs, intersect=0, rleMask=False):
     cdef RLEs Rs = _frString(rleObjs)
     cdef RLEs R = RLEs(1)
-    rleMerge(<RLE*>Rs._R, <RLE*> R._R, <siz> Rs._n, intersect)
-    obj = _toString(R)[0]
-    return obj
+    cdef int _intersect = intersect
+    with nogil:
+        rleMerge(<RLE*>Rs._R, <RLE*> R._R, <siz> Rs._n, _intersect)
+    return _output(R, rleMask)[0]
 
 def area(rleObjs):
     cdef RLEs Rs = _frString(rleObjs)
     cdef uint* _a = <uint*> malloc(Rs._n* sizeof(uint))
-    rleArea(Rs._R, Rs._n, _a)
+    with nogil:
+        rleArea(Rs._R, Rs._n, _a)
     cdef np.npy_intp shape[1]
     shape[0] = <np.npy_intp> Rs._n
     a = np.array((Rs._n, ), dtype=np.uint8)
@@ -182,7 +376,7 @@ def iou( dt, gt, pyiscrowd ):
         elif type(objs) == list:
             # check if list is in box format and convert it to np.ndarray
             isbox = np.all(np.array([(len(obj)==4) and ((type(obj)==list) or (type(obj)==np.ndarray)) for obj in objs]))
-            isrle = np.all(np.array([type(obj) == dict for obj in objs]))
+            isrle = np.all(np.array([_isRle(obj) for obj in objs]))
             if isbox:
                 objs = np.array(objs, dtype=np.double)
                 if len(objs.shape) == 1:
@@ -195,9 +389,17 @@ def iou( dt, gt, pyiscrowd ):
             raise Exception('unrecognized type.  The following type: RLEs (rle), np.ndarray (box), and list (box) are supported.')
         return objs
     def _rleIou(RLEs dt, RLEs gt, np.ndarray[np.uint8_t, ndim=1] iscrowd, siz m, siz n, np.ndarray[np.double_t,  ndim=1] _iou):
-        rleIou( <RLE*> dt._R, <RLE*> gt._R, m, n, <byte*> iscrowd.data, <double*> _iou.data )
+        cdef byte* c = <byte*> iscrowd.data
+        cdef double* o = <double*> _iou.data
+        with nogil:
+            rleIou( dt._R, gt._R, m, n, c, o )
     def _bbIou(np.ndarray[np.double_t, ndim=2] dt, np.ndarray[np.double_t, ndim=2] gt, np.ndarray[np.uint8_t, ndim=1] iscrowd, siz m, siz n, np.ndarray[np.double_t, ndim=1] _iou):
-        bbIou( <BB> dt.data, <BB> gt.data, m, n, <byte*> iscrowd.data, <double*>_iou.data )
+        cdef BB d = <BB> dt.data
+        cdef BB g = <BB> gt.data
+        cdef byte* c = <byte*> iscrowd.data
+        cdef double* o = <double*> _iou.data
+        with nogil:
+            bbIou( d, g, m, n, c, o )
     def _len(obj):
         cdef siz N = 0
         if type(obj) == RLEs:
@@ -238,11 +440,103 @@ def iou( dt, gt, pyiscrowd ):
     _iouFun(dt, gt, iscrowd, m, n, iou)
     return iou.reshape((m,n), order='F')
 
+# batched iou computation: the dt-gt ious of many groups (e.g. the (image, category) pairs of an
+# evaluation) in one call. dt and gt hold the objects of all groups back to back, either as Nx4
+# boxes or as RLEs, and group b is dt[dtSplits[b]:dtSplits[b+1]] vs gt[gtSplits[b]:gtSplits[b+1]].
+# Returns the ious of all groups concatenated, each block m*n in the column-major order of iou(),
+# and the B+1 offsets of the blocks.
+def iouBatch( dt, gt, pyiscrowd, dtSplits, gtSplits ):
+    cdef np.ndarray[np.int64_t, ndim=1] ds = np.ascontiguousarray(dtSplits, dtype=np.int64)
+    cdef np.ndarray[np.int64_t, ndim=1] gs = np.ascontiguousarray(gtSplits, dtype=np.int64)
+    cdef np.ndarray[np.uint8_t, ndim=1] iscrowd = np.ascontiguousarray(pyiscrowd, dtype=np.uint8)
+    if ds.shape[0] == 0 or ds.shape[0] != gs.shape[0]:
+        raise Exception('dtSplits and gtSplits should be offsets of the same number of groups')
+    if ds[0] != 0 or gs[0] != 0 or np.any(np.diff(ds) < 0) or np.any(np.diff(gs) < 0):
+        raise Exception('dtSplits and gtSplits should be non-decreasing offsets starting at 0')
+    cdef np.ndarray[np.int64_t, ndim=1] offsets = np.zeros(ds.shape[0], dtype=np.int64)
+    np.cumsum(np.diff(ds) * np.diff(gs), out=offsets[1:])
+    cdef np.ndarray[np.double_t, ndim=1] iou = np.zeros(offsets[-1], dtype=np.double)
+    if offsets[-1] == 0:
+        return iou, offsets
+    cdef RLEs dtR, gtR
+    cdef np.ndarray[np.double_t, ndim=2] dtB, gtB
+    isrle = type(dt) == RLEs or (type(dt) == list and _isRle(dt[0]))
+    if isrle:
+        dtR = dt if type(dt) == RLEs else _frString(dt)
+        gtR = gt if type(gt) == RLEs else _frString(gt)
+        N, M = dtR._n, gtR._n
+    else:
+        dtB = np.ascontiguousarray(dt, dtype=np.double).reshape((-1, 4))
+        gtB = np.ascontiguousarray(gt, dtype=np.double).reshape((-1, 4))
+        N, M = dtB.shape[0], gtB.shape[0]
+    if ds[-1] != N or gs[-1] != M or iscrowd.shape[0] != M:
+        raise Exception('dtSplits and gtSplits should end at the number of dt and gt, '
+                        'and iscrowd should have one entry per gt')
+    cdef RLE* dR = NULL
+    cdef RLE* gR = NULL
+    cdef BB dB = NULL
+    cdef BB gB = NULL
+    if isrle:
+        dR, gR = dtR._R, gtR._R
+    else:
+        dB, gB = <BB> dtB.data, <BB> gtB.data
+    cdef long long* d0 = <long long*> ds.data
+    cdef long long* g0 = <long long*> gs.data
+    cdef long long* o0 = <long long*> offsets.data
+    cdef byte* c = <byte*> iscrowd.data
+    cdef double* o = <double*> iou.data
+    cdef bint rle = isrle
+    cdef siz b, m, n, B = ds.shape[0] - 1
+    with nogil:
+        for b in range(B):
+            m = d0[b + 1] - d0[b]
+            n = g0[b + 1] - g0[b]
+            if m == 0 or n == 0:
+                continue
+            if rle:
+                rleIou( &dR[d0[b]], &gR[g0[b]], m, n, &c[g0[b]], &o[o0[b]] )
+            else:
+                bbIou( &dB[4 * d0[b]], &gB[4 * g0[b]], m, n, &c[g0[b]], &o[o0[b]] )
+    return iou, offsets
+
+# greedy non-maximum suppression of boxes (Nx4) or RLEs, in the given order (by decreasing score).
+# Returns the keep flags. sweep only compares the detections that may overlap, with the same result.
+def nms( dt, double thr, bint sweep=True ):
+    cdef np.ndarray[np.uint32_t, ndim=1] keep
+    cdef RLEs Rs
+    cdef np.ndarray[np.double_t, ndim=2] bb
+    cdef BB _bb
+    cdef uint* k
+    cdef siz n
+    if type(dt) == RLEs or (type(dt) == list and len(dt) > 0 and _isRle(dt[0])):
+        Rs = dt if type(dt) == RLEs else _frString(dt)
+        n = Rs._n
+        keep = np.zeros(n, dtype=np.uint32)
+        k = <uint*> keep.data
+        with nogil:
+            if sweep:
+                rleNmsSweep(Rs._R, n, k, thr)
+            else:
+                rleNms(Rs._R, n, k, thr)
+    else:
+        bb = np.ascontiguousarray(dt, dtype=np.double).reshape((-1, 4))
+        n = bb.shape[0]
+        keep = np.zeros(n, dtype=np.uint32)
+        k = <uint*> keep.data
+        _bb = <BB> bb.data
+        with nogil:
+            if sweep:
+                bbNmsSweep(_bb, n, k, thr)
+            else:
+                bbNms(_bb, n, k, thr)
+    return keep.astype(bool)
+
 def toBbox( rleObjs ):
     cdef RLEs Rs = _frString(rleObjs)
     cdef siz n = Rs.n
     cdef BB _bb = <BB> malloc(4*n* sizeof(double))
-    rleToBbox( <const RLE*> Rs._R, _bb, n )
+    with nogil:
+        rleToBbox( <const RLE*> Rs._R, _bb, n )
     cdef np.npy_intp shape[1]
     shape[0] = <np.npy_intp> 4*n
     bb = np.array((1,4*n), dtype=np.double)
@@ -250,59 +544,116 @@ def toBbox( rleObjs ):
     PyArray_ENABLEFLAGS(bb, np.NPY_OWNDATA)
     return bb
 
-def frBbox(np.ndarray[np.double_t, ndim=2] bb, siz h, siz w ):
+def shift(rleObjs, long dx, long dy, h=None, w=None, long dh=0, long dw=0, rleMask=False):
+    # translate by (dx,dy) into masks of size h x w, or the input size plus (dh,dw)
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef siz i, n = Rs._n
+    cdef RLEs M = RLEs(n)
+    cdef long _h = -1 if h is None else h, _w = -1 if w is None else w
+    with nogil:
+        for i in range(n):
+            rleShift(&Rs._R[i], &M._R[i], dx, dy, <siz> (_h if _h >= 0 else <long> Rs._R[i].h + dh),
+                     <siz> (_w if _w >= 0 else <long> Rs._R[i].w + dw))
+    return _output(M, rleMask)
+
+def resize(rleObjs, siz h, siz w, rleMask=False):
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef siz i, n = Rs._n
+    cdef RLEs M = RLEs(n)
+    with nogil:
+        for i in range(n):
+            rleResize(&Rs._R[i], &M._R[i], h, w)
+    return _output(M, rleMask)
+
+def moments(rleObjs):
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef np.ndarray[np.double_t, ndim=2] mo = np.zeros((Rs._n, 6), dtype=np.double)
+    with nogil:
+        rleMoments(Rs._R, Rs._n, <double*> mo.data)
+    return mo
+
+def projections(rleObjs):
+    # (rows, cols) pixel counts of every mask
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef np.ndarray[np.uint32_t, ndim=1] rows, cols
+    out = []
+    for i in range(Rs._n):
+        rows = np.zeros(Rs._R[i].h, dtype=np.uint32)
+        cols = np.zeros(Rs._R[i].w, dtype=np.uint32)
+        with nogil:
+            rleProject(&Rs._R[i], <uint*> rows.data, <uint*> cols.data)
+        out.append((rows, cols))
+    return out
+
+def toPoly(rleObjs):
+    # boundaries of every mask as a list of [k,2] vertex arrays, clockwise (outer) or
+    # counter-clockwise (holes) in image coordinates
+    cdef RLEs Rs = _frString(rleObjs)
+    cdef double *xy
+    cdef siz *k
+    cdef siz i, j, n, v
+    out = []
+    for i in range(Rs._n):
+        with nogil:
+            n = rleToPoly(&Rs._R[i], &xy, &k)
+        polys, v = [], 0
+        for j in range(n):
+            polys.append(np.asarray(<double[:2*k[j]]> (xy + 2*v)).reshape((-1, 2)).copy())
+            v += k[j]
+        free(xy)
+        free(k)
+        out.append(polys)
+    return out
+
+def frBbox(np.ndarray[np.double_t, ndim=2] bb, siz h, siz w, rleMask=False ):
     cdef siz n = bb.shape[0]
-    Rs = RLEs(n)
-    rleFrBbox( <RLE*> Rs._R, <const BB> bb.data, h, w, n )
-    objs = _toString(Rs)
-    return objs
+    cdef RLEs Rs = RLEs(n)
+    cdef BB _bb = <BB> bb.data
+    with nogil:
+        rleFrBbox( <RLE*> Rs._R, _bb, h, w, n )
+    return _output(Rs, rleMask)
 
-def frPoly( poly, siz h, siz w ):
+def frPoly( poly, siz h, siz w, rleMask=False ):
     cdef np.ndarray[np.double_t, ndim=1] np_poly
+    cdef const double* xy
+    cdef siz i, k
     n = len(poly)
-    Rs = RLEs(n)
+    cdef RLEs Rs = RLEs(n)
     for i, p in enumerate(poly):
         np_poly = np.array(p, dtype=np.double, order='F')
-        rleFrPoly( <RLE*>&Rs._R[i], <const double*> np_poly.data, int(len(p)/2), h, w )
-    objs = _toString(Rs)
-    return objs
+        xy = <const double*> np_poly.data
+        k = int(len(p)/2)
+        with nogil:
+            rleFrPoly( &Rs._R[i], xy, k, h, w )
+    return _output(Rs, rleMask)
 
-def frUncompressedRLE(ucRles, siz h, siz w):
+def frUncompressedRLE(ucRles, siz h, siz w, rleMask=False):
     cdef np.ndarray[np.uint32_t, ndim=1] cnts
-    cdef RLE R
-    cdef uint *data
     n = len(ucRles)
-    objs = []
+    cdef RLEs Rs = RLEs(n)
     for i in range(n):
-        Rs = RLEs(1)
-        cnts = np.array(ucRles[i]['counts'], dtype=np.uint32)
-        # time for malloc can be saved here but it's fine
-        data = <uint*> malloc(len(cnts)* sizeof(uint))
-        for j in range(len(cnts)):
-            data[j] = <uint> cnts[j]
-        R = RLE(ucRles[i]['size'][0], ucRles[i]['size'][1], len(cnts), <uint*> data)
-        Rs._R[0] = R
-        objs.append(_toString(Rs)[0])
-    return objs
+        cnts = np.ascontiguousarray(ucRles[i]['counts'], dtype=np.uint32)
+        rleInit(&Rs._R[i], ucRles[i]['size'][0], ucRles[i]['size'][1], cnts.shape[0], <uint*> cnts.data)
+    return _output(Rs, rleMask)
 
-def frPyObjects(pyobj, h, w):
+def frPyObjects(pyobj, h, w, rleMask=False):
     # encode rle from a list of python objects
     if type(pyobj) == np.ndarray:
-        objs = frBbox(pyobj, h, w)
+        objs = frBbox(pyobj, h, w, rleMask)
     elif type(pyobj) == list and len(pyobj[0]) == 4:
-        objs = frBbox(pyobj, h, w)
+        objs = frBbox(pyobj, h, w, rleMask)
     elif type(pyobj) == list and len(pyobj[0]) > 4:
-        objs = frPoly(pyobj, h, w)
+        objs = frPoly(pyobj, h, w, rleMask)
     elif type(pyobj) == list and type(pyobj[0]) == dict \
         and 'counts' in pyobj[0] and 'size' in pyobj[0]:
-        objs = frUncompressedRLE(pyobj, h, w)
+        objs = frUncompressedRLE(pyobj, h, w, rleMask)
     # encode rle from single python object
     elif type(pyobj) == list and len(pyobj) == 4:
-        objs = frBbox([pyobj], h, w)[0]
+        objs = frBbox([pyobj], h, w, rleMask)[0]
     elif type(pyobj) == list and len(pyobj) > 4:
-        objs = frPoly([pyobj], h, w)[0]
+        objs = frPoly([pyobj], h, w, rleMask)[0]
     elif type(pyobj) == dict and 'counts' in pyobj and 'size' in pyobj:
-        objs = frUncompressedRLE([pyobj], h, w)[0]
+        objs = frUncompressedRLE([pyobj], h, w, rleMask)[0]
     else:
         raise Exception('input type is not supported.')
     return objs
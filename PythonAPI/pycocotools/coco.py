@@ -57,7 +57,7 @@ import sys
 import time
 from collections import defaultdict
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
 from urllib.request import urlretrieve
 
 import matplotlib.pyplot as plt
@@ -67,8 +67,21 @@ from matplotlib.collections import PatchCollection
 from matplotlib.patches import Polygon, Rectangle
 
 from . import mask as maskUtils
+from . import jsonio, snapshot, streaming
+from .rlecache import RLECache, file_stamp, sidecar_path, write_rles
+from .columnar import (
+    AnnotationColumns,
+    AnnotationSequence,
+    AnnotationsView,
+    CategoryImagesView,
+    ImageAnnotationsView,
+    ImageColumns,
+    ImageSequence,
+    ImagesView,
+)
+from .query import AnnotationQuery
 
-__all__ = ["COCO", "Ann", "Cat", "Image", "Ref"]
+__all__ = ["COCO", "ResultSet", "Ann", "Cat", "Image", "Ref"]
 
 # Typing aliases
 Ann = dict[str, Any]
@@ -88,6 +101,14 @@ class COCO:
         is_ref_dataset: bool = False,
         split_by: str = "unc",
         dataset_name: str = "",
+        columnar: bool = False,
+        cache: bool = False,
+        cache_dir: Optional[Union[str, Path]] = None,
+        shared: bool = False,
+        stream: bool = False,
+        drop_fields: Optional[Iterable[str]] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+        json_backend: Optional[str] = None,
     ):
         """
         Constructor of Microsoft COCO helper class for reading and visualizing annotations.
@@ -104,6 +125,43 @@ class COCO:
         :param dataset_name: Only used if is_ref_dataset=True. The name of the subdirectory within
             the `annotation_file` directory. Also used to load the correct images (an example of why
             this is needed is the image folder structure is different for refclef than the others)
+        :param columnar: Default is False. Set to True to keep annotations in a columnar, NumPy
+            backed store (see pycocotools.columnar) instead of one dict per annotation. anns,
+            imgToAnns, catToImgs and dataset["annotations"] then become read-only views that build
+            the annotation dicts on access, and getAnnIds filters are vectorized. Annotation,
+            image and category ids must be integers.
+        :param cache: Default is False. Set to True to write a binary snapshot of the parsed
+            annotation file (and, if columnar, of its index) to cache_dir, a copy of the whole
+            dataset on disk, and load it instead of the JSON while the file is unchanged (see
+            pycocotools.snapshot). Columnar snapshots are memory-mapped. Can also be disabled
+            globally by setting the environment variable PYCOCOTOOLS_CACHE=0.
+        :param cache_dir: directory for the snapshots, only used if it is owned by the current
+            user and nobody else can write to it (it is created with mode 0700). Default is
+            $PYCOCOTOOLS_CACHE_DIR, or ~/.cache/pycocotools.
+        :param shared: Default is False. Set to True to keep the whole index (annotations, images,
+            id groupings) in a memory-mapped snapshot in cache_dir, implies columnar=True. Forked
+            processes (e.g. DataLoader workers) then share its pages instead of each ending up with
+            a private copy, and pickling the COCO object only sends the snapshot location. imgs and
+            dataset["images"] become read-only views as well. Requires an annotation file; with
+            cache=False the snapshot is rebuilt instead of reused. Point cache_dir at a directory
+            in /dev/shm (e.g. /dev/shm/pycocotools-<user>, not /dev/shm itself, which everybody
+            can write to) to keep the snapshot in RAM.
+        :param stream: Default is False. Set to True to parse the annotation file incrementally
+            (see pycocotools.streaming) instead of with json.load. Images, categories and
+            annotations are decoded one at a time; with columnar=True the annotations go straight
+            into the columnar store, so the full document tree never exists in memory.
+        :param drop_fields: annotation fields to discard while parsing, e.g. ["segmentation"] when
+            only bbox evaluation is needed. Implies stream=True and skips the snapshot cache (the
+            result isn't the whole file), can't be used with shared=True.
+        :param progress: called as progress(bytes_read, total_bytes) while parsing. Implies
+            stream=True.
+        :param json_backend: JSON parser for the annotation file, one of "json", "simdjson" and
+            "gason" (see pycocotools.jsonio). Default is simdjson if installed, else json. With
+            "gason" and columnar=True the annotation columns are filled in C++.
+
+        annToRLE converts each annotation at most once and keeps the masks in rle_cache (see
+        pycocotools.rlecache). If cache is enabled, the masks written by save_rles next to the
+        annotation file are loaded while the file is unchanged.
 
         Example:
 
@@ -120,6 +178,14 @@ class COCO:
         self.is_ref_dataset: bool = is_ref_dataset and len(split_by) > 0
         self.split_by: str = split_by
         self.dataset_name: str = dataset_name
+        self.columnar: bool = columnar or shared
+        self.ann_columns: Optional[AnnotationColumns] = None
+        self.img_columns: Optional[ImageColumns] = None
+        self._snapshot_dir: Optional[Path] = None
+        self._query: Optional[AnnotationQuery] = None
+        self._query_built = False
+        self._annotation_file: Optional[Path] = None
+        self.rle_cache = RLECache()
 
         if annotation_file is None:
             return
@@ -159,29 +225,126 @@ class COCO:
             print("loading annotations into memory...")
             _annotation_file = _annotation_file.resolve()
             tic = time.time()
-            with open(_annotation_file, "r") as f:
-                dataset = json.load(f)
+            assert not (shared and drop_fields), "drop_fields can't be used with shared=True"
+            stream = stream or drop_fields is not None or progress is not None
+            use_cache = cache and snapshot.cache_enabled() and drop_fields is None
+            fingerprint, cached = None, None
+            if use_cache or shared:
+                fingerprint = snapshot.file_fingerprint(_annotation_file)
+            if use_cache:
+                cached = snapshot.load_snapshot(
+                    _annotation_file,
+                    self.columnar,
+                    cache_dir,
+                    fingerprint=fingerprint,
+                    shared=shared,
+                )
+            if cached is not None:
+                dataset, _ = cached
+            elif stream:
+                dataset = streaming.load_dataset(
+                    _annotation_file, self.columnar, drop_fields, progress
+                )
+            elif json_backend == "gason" and self.columnar:
+                dataset = jsonio.load_columnar(_annotation_file)
+            else:
+                dataset = jsonio.load(_annotation_file, json_backend)
             assert isinstance(
                 dataset, dict
             ), "annotation file format {} not supported".format(type(dataset))
+            if shared:
+                self._snapshot_dir = snapshot.snapshot_path(fingerprint, True, cache_dir, True)
+                if cached is None:
+                    # pack everything into the snapshot and attach to it, so that the index
+                    # lives in memory-mapped files instead of on the heap of this process
+                    annotations = dataset.get("annotations", [])
+                    if isinstance(annotations, AnnotationSequence):
+                        columns = annotations.columns
+                    else:
+                        columns = AnnotationColumns.from_annotations(annotations)
+                    snapshot.save_snapshot(
+                        _annotation_file,
+                        dataset,
+                        columns,
+                        cache_dir,
+                        fingerprint=fingerprint,
+                        images=ImageColumns.from_images(dataset.get("images", [])),
+                    )
+                    dataset, _ = snapshot.attach(self._snapshot_dir)
             print("Done (t={:0.2f}s)".format(time.time() - tic))
             self.dataset = dataset
+            self._annotation_file = _annotation_file
+            self.createIndex()
+            if use_cache:
+                self.rle_cache.load(sidecar_path(_annotation_file), file_stamp(_annotation_file))
+            if fingerprint is not None and cached is None and not shared:
+                try:
+                    snapshot.save_snapshot(
+                        _annotation_file,
+                        self.dataset,
+                        self.ann_columns,
+                        cache_dir,
+                        fingerprint=fingerprint,
+                    )
+                except OSError as ex:
+                    print(f"could not write annotation snapshot: {ex}")
+
+    @staticmethod
+    def invalidate_cache(
+        annotation_file: Union[str, Path], cache_dir: Optional[Union[str, Path]] = None
+    ) -> int:
+        """
+        Remove the cached snapshots of an annotation file (see the cache parameter of COCO).
+
+        :param annotation_file (str): location of the annotation file
+        :param cache_dir (str): snapshot directory, default is the one COCO uses
+        :return: number of snapshots removed
+        """
+        return snapshot.invalidate(annotation_file, cache_dir)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._snapshot_dir is not None:
+            # shared mode: the receiving process re-attaches to the snapshot instead of
+            # unpickling a copy of the index
+            for key in (
+                "dataset",
+                "anns",
+                "imgs",
+                "cats",
+                "imgToAnns",
+                "catToImgs",
+                "name_to_cat",
+                "ann_columns",
+                "img_columns",
+                "_query",
+            ):
+                state.pop(key, None)
+            state["_query_built"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "dataset" not in state:
+            self.dataset, _ = snapshot.attach(self._snapshot_dir)
+            # the masks are still those of the snapshot's annotations
+            rle_cache = self.rle_cache
             self.createIndex()
+            self.rle_cache = rle_cache
 
     def createIndex(self):
         # create index
         print("creating index...")
-        anns, cats, imgs = {}, {}, {}
+        cats, imgs = {}, {}
         name_to_cat: dict[str, Cat] = {}
-        imgToAnns: dict[int, list[Ann]] = defaultdict(list)
-        catToImgs: dict[int, list[Image]] = defaultdict(list)
 
-        if "annotations" in self.dataset:
-            for ann in self.dataset["annotations"]:
-                imgToAnns[ann["image_id"]].append(ann)
-                anns[ann["id"]] = ann
+        self.img_columns = None
+        self._index_anns()
 
-        if "images" in self.dataset:
+        if isinstance(self.dataset.get("images"), ImageSequence):
+            self.img_columns = self.dataset["images"].columns
+            imgs = ImagesView(self.img_columns)
+        elif "images" in self.dataset:
             for img in self.dataset["images"]:
                 imgs[img["id"]] = img
 
@@ -190,14 +353,7 @@ class COCO:
                 cats[cat["id"]] = cat
                 name_to_cat[cat["name"]] = cat
 
-        if "annotations" in self.dataset and "categories" in self.dataset:
-            for ann in self.dataset["annotations"]:
-                catToImgs[ann["category_id"]].append(ann["image_id"])
-
         # create class members
-        self.anns: dict[int, Ann] = anns
-        self.imgToAnns = imgToAnns
-        self.catToImgs = catToImgs
         self.imgs: dict[int, Image] = imgs
         self.cats: dict[int, Cat] = cats
         self.name_to_cat = name_to_cat
@@ -205,6 +361,66 @@ class COCO:
             self.create_index_refs()
         print("index created!")
 
+    def _index_anns(self) -> None:
+        """
+        The annotation part of createIndex: anns, imgToAnns, catToImgs (if the dataset has
+        categories) and a new rle_cache.
+        """
+        anns: dict[int, Ann] = {}
+        imgToAnns: dict[int, list[Ann]] = defaultdict(list)
+        catToImgs: dict[int, list[Image]] = defaultdict(list)
+
+        self.ann_columns = None
+        self._query, self._query_built = None, False
+        self.rle_cache = RLECache(self.rle_cache.max_bytes)
+        if self.columnar and "annotations" in self.dataset:
+            self._create_columnar_index()
+            anns = AnnotationsView(self.ann_columns)
+            imgToAnns = ImageAnnotationsView(self.ann_columns)
+            if "categories" in self.dataset:
+                catToImgs = CategoryImagesView(self.ann_columns)
+        elif "annotations" in self.dataset:
+            for ann in self.dataset["annotations"]:
+                imgToAnns[ann["image_id"]].append(ann)
+                anns[ann["id"]] = ann
+            if "categories" in self.dataset:
+                for ann in self.dataset["annotations"]:
+                    catToImgs[ann["category_id"]].append(ann["image_id"])
+
+        self.anns: dict[int, Ann] = anns
+        self.imgToAnns = imgToAnns
+        self.catToImgs = catToImgs
+
+    def _create_columnar_index(self) -> None:
+        """
+        Move dataset["annotations"] into an AnnotationColumns store and replace it with a lazy
+        view, so the per-annotation dicts can be garbage collected.
+        """
+        annotations = self.dataset["annotations"]
+        if isinstance(annotations, AnnotationSequence):
+            columns = annotations.columns
+        else:
+            columns = AnnotationColumns.from_annotations(annotations)
+        self.ann_columns = columns
+        self.dataset["annotations"] = AnnotationSequence(columns)
+
+    def _ann_query(self) -> Optional[AnnotationQuery]:
+        """
+        Sorted index arrays used to answer getAnnIds / getImgIds (see pycocotools.query). Built on
+        first use; None if the annotations can't be indexed that way (e.g. non integer ids), in
+        which case the dict based filters are used.
+        """
+        if not self._query_built:
+            self._query_built = True
+            if self.ann_columns is not None:
+                self._query = self.ann_columns.index
+            elif "annotations" in self.dataset:
+                try:
+                    self._query = AnnotationQuery.from_annotations(self.dataset["annotations"])
+                except (KeyError, TypeError, ValueError, OverflowError):
+                    self._query = None
+        return self._query
+
     def create_index_refs(self) -> None:
         """
         Similar to create_index(), but handles just the refs data (i.e., refering
@@ -319,6 +535,20 @@ class COCO:
                 self.is_ref_dataset
             ), "Can only filter by refIds if self.is_ref_dataset==True"
 
+        query = self._ann_query()
+        if query is not None:
+            try:
+                return query.ann_ids(
+                    imgIds=imgIds,
+                    catIds=catIds,
+                    areaRng=areaRng,
+                    iscrowd=iscrowd,
+                    annIds=[self.ref_to_ann[r]["id"] for r in ref_ids] if ref_ids else None,
+                )
+            except (TypeError, ValueError, OverflowError):
+                if self.ann_columns is not None:
+                    raise
+
         if len(imgIds) == len(catIds) == len(areaRng) == len(ref_ids) == 0:
             anns = self.dataset["annotations"]
         else:
@@ -403,17 +633,23 @@ class COCO:
             ), "Can only filter by refIds if self.is_ref_dataset==True"
 
         if len(imgIds) == len(catIds) == len(refIds) == 0:
-            ids = self.imgs.keys()
-        else:
-            ids = set(imgIds)
-            for i, catId in enumerate(catIds):
-                if i == 0 and len(ids) == 0:
-                    ids = set(self.catToImgs[catId])
-                else:
-                    ids &= set(self.catToImgs[catId])
-            if len(refIds) > 0:
-                ref_imgs = {self.refs[ref_id]["image_id"] for ref_id in refIds}
-                ids = ids.intersection(ref_imgs) if ids else ref_imgs
+            return list(self.imgs.keys())
+        query = self._ann_query()
+        if query is not None:
+            try:
+                ref_imgs = [self.refs[ref_id]["image_id"] for ref_id in refIds] if refIds else None
+                return list(set(query.img_ids(imgIds, catIds, ref_imgs).tolist()))
+            except (TypeError, ValueError, OverflowError):
+                pass
+        ids = set(imgIds)
+        for i, catId in enumerate(catIds):
+            if i == 0 and len(ids) == 0:
+                ids = set(self.catToImgs[catId])
+            else:
+                ids &= set(self.catToImgs[catId])
+        if len(refIds) > 0:
+            ref_imgs = {self.refs[ref_id]["image_id"] for ref_id in refIds}
+            ids = ids.intersection(ref_imgs) if ids else ref_imgs
         return list(ids)
 
     def loadAnns(self, ids=[]) -> list[Ann]:
@@ -423,6 +659,8 @@ class COCO:
         :return: anns (object array) : loaded ann objects
         """
         if _isArrayLike(ids):
+            if self.ann_columns is not None:
+                return self.ann_columns.anns(self.ann_columns.rows(ids))
             return [self.anns[id] for id in ids]
         elif type(ids) == int:
             return [self.anns[ids]]
@@ -629,17 +867,67 @@ class COCO:
             )
             ax.add_patch(box_plot)
 
-    def loadRes(self, resFile):
+    def loadRes(self, resFile, columnar=None):
         """
         Load result file and return a result api object.
-        :param   resFile (str)     : file name of result file
+        :param   resFile (str)     : file name of result file, a list of result dicts, a numpy
+            array [Nx7] (see loadNumpyAnnotations) or a dict of result arrays: image_id,
+            category_id, score ([N]) and bbox ([N,4]), segmentation (N compressed RLEs) or
+            keypoints ([N,3K])
+        :param   columnar (bool)   : keep the results in a columnar store (see COCO(columnar=True)).
+            Defaults to True for array results, which then go straight into the store without a
+            dict per result, and to False for the others
         :return: res (obj)         : result api object
         """
         res = COCO()
         res.dataset["images"] = [img for img in self.dataset["images"]]
+        categories = lambda: copy.deepcopy(self.dataset["categories"])
+        self._load_results(res, resFile, columnar, categories)
+        res.createIndex()
+        return res
+
+    def _load_results(
+        self,
+        res: "COCO",
+        resFile,
+        columnar: Optional[bool],
+        categories: Callable[[], List[Cat]],
+        img_ids: Optional[set] = None,
+    ) -> None:
+        """
+        Put the results of resFile (see loadRes) into res.dataset and set res.columnar, without
+        indexing them.
+        :param categories: the categories of res.dataset, called unless the results are captions
+        :param img_ids: the image ids of self, if already known
+        """
+        arrays = None
+        if type(resFile) == np.ndarray and columnar is not False:
+            assert resFile.ndim == 2 and resFile.shape[1] == 7
+            arrays = {
+                "image_id": resFile[:, 0],
+                "bbox": resFile[:, 1:5],
+                "score": resFile[:, 5],
+                "category_id": resFile[:, 6],
+            }
+        elif isinstance(resFile, dict):
+            arrays = resFile
+        if columnar is None:
+            columnar = arrays is not None
+        res.columnar = columnar
+        if img_ids is None:
+            img_ids = set(self.getImgIds())
 
         print("Loading and preparing results...")
         tic = time.time()
+        if arrays is not None:
+            columns = self._result_columns(arrays, img_ids)
+            res.dataset["annotations"] = (
+                AnnotationSequence(columns) if columnar else columns.anns(np.arange(len(columns)))
+            )
+            res.dataset["categories"] = categories()
+            print("DONE (t={:0.2f}s)".format(time.time() - tic))
+            return
+
         if type(resFile) == str:
             anns = json.load(open(resFile))
         elif type(resFile) == np.ndarray:
@@ -649,7 +937,7 @@ class COCO:
         assert type(anns) == list, "results in not an array of objects"
         annsImgIds = [ann["image_id"] for ann in anns]
         assert set(annsImgIds) == (
-            set(annsImgIds) & set(self.getImgIds())
+            set(annsImgIds) & img_ids
         ), "Results do not correspond to current coco set"
         if "caption" in anns[0]:
             imgIds = set([img["id"] for img in res.dataset["images"]]) & set(
@@ -661,7 +949,7 @@ class COCO:
             for id, ann in enumerate(anns):
                 ann["id"] = id + 1
         elif "bbox" in anns[0] and not anns[0]["bbox"] == []:
-            res.dataset["categories"] = copy.deepcopy(self.dataset["categories"])
+            res.dataset["categories"] = categories()
             for id, ann in enumerate(anns):
                 bb = ann["bbox"]
                 x1, x2, y1, y2 = [bb[0], bb[0] + bb[2], bb[1], bb[1] + bb[3]]
@@ -671,16 +959,20 @@ class COCO:
                 ann["id"] = id + 1
                 ann["iscrowd"] = 0
         elif "segmentation" in anns[0]:
-            res.dataset["categories"] = copy.deepcopy(self.dataset["categories"])
+            res.dataset["categories"] = categories()
+            # now only support compressed RLE format as segmentation results
+            # areas and boxes of all the results in one call each
+            segms = [ann["segmentation"] for ann in anns]
+            areas = maskUtils.area(segms)
+            boxes = maskUtils.toBbox(segms)
             for id, ann in enumerate(anns):
-                # now only support compressed RLE format as segmentation results
-                ann["area"] = maskUtils.area(ann["segmentation"])
+                ann["area"] = areas[id]
                 if "bbox" not in ann:
-                    ann["bbox"] = maskUtils.toBbox(ann["segmentation"])
+                    ann["bbox"] = boxes[id]
                 ann["id"] = id + 1
                 ann["iscrowd"] = 0
         elif "keypoints" in anns[0]:
-            res.dataset["categories"] = copy.deepcopy(self.dataset["categories"])
+            res.dataset["categories"] = categories()
             for id, ann in enumerate(anns):
                 s = ann["keypoints"]
                 x = s[0::3]
@@ -692,8 +984,52 @@ class COCO:
         print("DONE (t={:0.2f}s)".format(time.time() - tic))
 
         res.dataset["annotations"] = anns
-        res.createIndex()
-        return res
+
+    def _result_columns(self, arrays: Dict[str, Any], img_ids: set) -> AnnotationColumns:
+        """
+        The AnnotationColumns loadRes builds from result arrays, with the id, area, iscrowd (and
+        bbox) the dict results get, computed for all the results at once.
+        """
+        image_id = np.asarray(arrays["image_id"]).astype(np.int64)
+        assert img_ids.issuperset(
+            np.unique(image_id).tolist()
+        ), "Results do not correspond to current coco set"
+        columns = {
+            "image_id": image_id,
+            "category_id": np.asarray(arrays["category_id"]).astype(np.int64),
+            "score": arrays["score"],
+        }
+        bbox = arrays.get("bbox")
+        if bbox is not None:
+            bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+        if arrays.get("segmentation") is not None:
+            segms = list(arrays["segmentation"])
+            columns.update(
+                segmentation=segms,
+                area=maskUtils.area(segms) if segms else [],
+                bbox=maskUtils.toBbox(segms) if bbox is None else bbox,
+                iscrowd=np.zeros(len(image_id)),
+            )
+        elif bbox is not None:
+            columns.update(
+                bbox=bbox,
+                area=bbox[:, 2] * bbox[:, 3],
+                iscrowd=np.zeros(len(image_id)),
+                bbox_segmentation=True,
+            )
+        elif arrays.get("keypoints") is not None:
+            kps = np.asarray(arrays["keypoints"], dtype=np.float64).reshape(len(image_id), -1)
+            x, y = kps[:, 0::3], kps[:, 1::3]
+            x0, x1 = x.min(1, initial=np.inf), x.max(1, initial=-np.inf)
+            y0, y1 = y.min(1, initial=np.inf), y.max(1, initial=-np.inf)
+            columns.update(
+                keypoints=kps,
+                area=(x1 - x0) * (y1 - y0),
+                bbox=np.stack([x0, y0, x1 - x0, y1 - y0], 1),
+            )
+        else:
+            raise ValueError("Result arrays need a bbox, segmentation or keypoints")
+        return AnnotationColumns.from_arrays(**columns)
 
     def download(self, tarDir=None, imgIds=[]):
         """
@@ -735,42 +1071,88 @@ class COCO:
         assert type(data) == np.ndarray
         print(data.shape)
         assert data.shape[1] == 7
-        N = data.shape[0]
-        ann = []
-        for i in range(N):
-            if i % 1000000 == 0:
-                print("{}/{}".format(i, N))
-            ann += [
-                {
-                    "image_id": int(data[i, 0]),
-                    "bbox": [data[i, 1], data[i, 2], data[i, 3], data[i, 4]],
-                    "score": data[i, 5],
-                    "category_id": int(data[i, 6]),
-                }
-            ]
-        return ann
+        # convert whole columns at once instead of indexing the array element by element
+        img_ids = data[:, 0].astype(np.int64).tolist()
+        boxes = data[:, 1:5].tolist()
+        scores = data[:, 5].tolist()
+        cat_ids = data[:, 6].astype(np.int64).tolist()
+        return [
+            {"image_id": img_id, "bbox": bbox, "score": score, "category_id": cat_id}
+            for img_id, bbox, score, cat_id in zip(img_ids, boxes, scores, cat_ids)
+        ]
 
     def annToRLE(self, ann):
         """
-        Convert annotation which can be polygons, uncompressed RLE to RLE.
-        :return: binary mask (numpy 2D array)
+        Convert annotation which can be polygons, uncompressed RLE, or RLE to RLE. The result is
+        kept in rle_cache by annotation id, ann isn't modified.
+        :return: maskUtils.RLEMask, dict(rle) is the compressed RLE dict
         """
-        t = self.imgs[ann["image_id"]]
-        h, w = t["height"], t["width"]
         segm = ann["segmentation"]
+        if isinstance(segm, maskUtils.RLEMask):
+            return segm
+        ann_id = ann.get("id")
+        if ann_id is not None:
+            rle = self.rle_cache.get(ann_id)
+            if rle is not None:
+                return rle
+        if self.img_columns is not None:
+            h, w = self.img_columns.size(ann["image_id"])
+        else:
+            t = self.imgs[ann["image_id"]]
+            h, w = t["height"], t["width"]
         if type(segm) == list:
             # polygon -- a single object might consist of multiple parts
             # we merge all parts into one mask rle code
-            rles = maskUtils.frPyObjects(segm, h, w)
-            rle = maskUtils.merge(rles)
+            rles = maskUtils.frPyObjects(segm, h, w, rleMask=True)
+            rle = maskUtils.merge(rles, rleMask=True)
         elif type(segm["counts"]) == list:
             # uncompressed RLE
-            rle = maskUtils.frPyObjects(segm, h, w)
+            rle = maskUtils.frPyObjects(segm, h, w, rleMask=True)
         else:
             # rle
-            rle = ann["segmentation"]
+            rle = maskUtils.RLEMask(segm)
+        if ann_id is not None:
+            self.rle_cache.put(ann_id, rle)
         return rle
 
+    def _segm_anns(self, ann_ids: Optional[Iterable[int]]) -> List[Ann]:
+        anns = self.anns.values() if ann_ids is None else self.loadAnns(list(ann_ids))
+        return [ann for ann in anns if ann.get("segmentation") is not None]
+
+    def precompute_rles(self, ann_ids: Optional[Iterable[int]] = None, num_threads: int = 0):
+        """
+        Convert annotations to RLE ahead of annToRLE, on several threads.
+
+        :param ann_ids (int array): annotations to convert, default is all with a segmentation
+        :param num_threads (int): number of threads, 0 for one per CPU
+        :return: number of annotations converted
+        """
+        anns = [ann for ann in self._segm_anns(ann_ids) if ann["id"] not in self.rle_cache]
+        maskUtils._threadMap(
+            lambda i0, i1: [self.annToRLE(ann) for ann in anns[i0:i1]], len(anns), num_threads
+        )
+        return len(anns)
+
+    def save_rles(self, path: Optional[Union[str, Path]] = None, num_threads: int = 0) -> Path:
+        """
+        Convert every annotation to RLE and save the masks, COCO(annotation_file) loads them
+        from the default path while the annotation file is unchanged.
+
+        :param path (str): output file, default is <annotation file name>.rles.npz next to the
+            annotation file
+        :param num_threads (int): number of threads of the conversion, 0 for one per CPU
+        :return: path of the saved file
+        """
+        if path is None:
+            assert self._annotation_file is not None, "path is required without annotation file"
+            path = sidecar_path(self._annotation_file)
+        anns = self._segm_anns(None)
+        rles = maskUtils._threadMap(
+            lambda i0, i1: [self.annToRLE(ann) for ann in anns[i0:i1]], len(anns), num_threads
+        )
+        stamp = None if self._annotation_file is None else file_stamp(self._annotation_file)
+        return write_rles(path, zip((ann["id"] for ann in anns), rles), stamp)
+
     def annToMask(self, ann):
         """
         Convert annotation which can be polygons, uncompressed RLE, or RLE to binary mask.
@@ -779,3 +1161,98 @@ class COCO:
         rle = self.annToRLE(ann)
         m = maskUtils.decode(rle)
         return m
+
+    def anns_to_masks(
+        self,
+        anns: List[Ann],
+        out: Optional[np.ndarray] = None,
+        boxes: Optional[np.ndarray] = None,
+        label_map: bool = False,
+        num_threads: int = 1,
+    ) -> np.ndarray:
+        """
+        Decode the masks of several annotations (e.g. those of an image) in one call, into a
+        preallocated array if given (see mask.decodeInto).
+
+        :param anns (object array): annotations, as for annToMask
+        :param out (array): uint8 [n, H, W] masks or with label_map=True a [H, W] label map,
+            C-contiguous. Default is a new array of the image size, which requires anns.
+        :param boxes (array): [n, 4] crop of every mask, [x, y, w, h], resampled to H x W
+        :param label_map (bool): write annotation i as value i + 1 into a single [H, W] map
+        :param num_threads (int): number of threads decoding the masks (not for label maps)
+        :return: out
+        """
+        rles = [self.annToRLE(ann) for ann in anns]
+        if out is None:
+            assert len(rles) > 0, "out is required without annotations"
+            h, w = rles[0].size
+            if label_map:
+                # the smallest unsigned type that holds the labels 1..len(rles)
+                out = np.empty((h, w), dtype=np.min_scalar_type(len(rles)))
+            else:
+                out = np.empty((len(rles), h, w), dtype=np.uint8)
+        return maskUtils.decodeInto(rles, out, boxes, num_threads=num_threads)
+
+
+class ResultSet(COCO):
+    """
+    Result api object for evaluating many result files against the same ground truth. Unlike
+    gt.loadRes it doesn't copy the images and categories of the ground truth: dataset["images"],
+    dataset["categories"], imgs, cats and name_to_cat are those of gt (treat them as read-only),
+    and only the results are indexed. load() replaces the results with those of the next file.
+
+    Example:
+
+    >>> results = ResultSet(coco_gt)
+    >>> for path in checkpoint_results:
+    >>>     E = COCOeval(coco_gt, results.load(path), "bbox")
+    """
+
+    def __init__(self, gt: COCO, resFile=None, columnar: Optional[bool] = None):
+        """
+        :param gt (COCO): the ground truth
+        :param resFile: results to load right away (see load)
+        :param columnar (bool): as for load
+        """
+        super().__init__()
+        self.gt = gt
+        self._gt_imgs, self._img_ids = None, None
+        self.reset()
+        if resFile is not None:
+            self.load(resFile, columnar)
+
+    def reset(self) -> "ResultSet":
+        """
+        Drop the results, and pick up the images and categories of gt again (e.g. after
+        gt.createIndex()).
+        """
+        gt = self.gt
+        self.dataset = {"annotations": []}
+        for key in ("images", "categories"):
+            if key in gt.dataset:
+                self.dataset[key] = gt.dataset[key]
+        self.imgs, self.cats, self.name_to_cat = gt.imgs, gt.cats, gt.name_to_cat
+        self.img_columns = gt.img_columns
+        if self._gt_imgs is not gt.imgs:
+            self._gt_imgs, self._img_ids = gt.imgs, set(gt.getImgIds())
+        self.columnar = False
+        self._index_anns()
+        return self
+
+    def load(self, resFile, columnar: Optional[bool] = None) -> "ResultSet":
+        """
+        Replace the results with those of resFile, as gt.loadRes(resFile, columnar) would load
+        them. Annotation ids start at 1 again, the masks of the previous results are dropped.
+        :return: self
+        """
+        self.reset()
+        categories = lambda: self.gt.dataset["categories"]
+        self._load_results(self, resFile, columnar, categories, self._img_ids)
+        self.createIndex()
+        return self
+
+    def createIndex(self):
+        # the images and categories are those of gt, only index the results
+        print("creating index...")
+        self._index_anns()
+        print("index created!")
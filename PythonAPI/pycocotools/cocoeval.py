@@ -2,14 +2,28 @@ __author__ = "tsungyi"
 
 import copy
 import datetime
+import itertools
+import multiprocessing
+import os
+import sys
 import time
 from collections import defaultdict
-from typing import Dict, NamedTuple, Tuple, cast
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple, cast
 
 import numpy as np
 import numpy.typing as npt
 
 from . import mask as maskUtils
+from .evalimgs import EvalState, PackedEvalImgs, PackedEvalImgsBuilder
+
+try:
+    from . import _eval
+except ImportError:
+    _eval = None
+
+# "auto" is "native" (the C++ evaluator in pycocotools._eval) if it is built, else "python"
+ENGINES = ("auto", "native", "python")
 
 
 class StatKey(NamedTuple):
@@ -47,6 +61,182 @@ def scrub_cat_name(cat_name: str) -> str:
     return cat_name
 
 
+# the evaluator a pool worker runs its shards of images on, set by _initWorker
+_worker_eval = None
+
+
+def _initWorker(evaluator):
+    global _worker_eval
+    _worker_eval = evaluator
+
+
+def _evaluateShard(imgIds, match):
+    return _worker_eval._evaluateImages(imgIds, match)
+
+
+def _split(items: List, n: int) -> List[List]:
+    """Split items into at most n contiguous, non-empty chunks of about equal length."""
+    n = max(1, min(n, len(items)))
+    bounds = np.linspace(0, len(items), n + 1).round().astype(int)
+    return [items[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+
+
+def matchLoop(ious, iouThrs, gtIds, dtIds, iscrowd, gtIg, gtm, dtm, dtIg):
+    """
+    Greedy matching of the detections of an image to its ground truth at every IoU threshold, the
+    reference implementation of evaluateImg(). Detections are sorted by decreasing score, ground
+    truth with ignored ones last; fills gtm, dtm and dtIg (TxG, TxD, TxD) in place.
+    """
+    for tind, t in enumerate(iouThrs):
+        for dind, dId in enumerate(dtIds):
+            # information about best match so far (m=-1 -> unmatched)
+            iou = min([t, 1 - 1e-10])
+            m = -1
+            for gind in range(len(gtIds)):
+                # if this gt already matched, and not a crowd, continue
+                if gtm[tind, gind] > 0 and not iscrowd[gind]:
+                    continue
+                # if dt matched to reg gt, and on ignore gt, stop
+                if m > -1 and gtIg[m] == 0 and gtIg[gind] == 1:
+                    break
+                # continue to next gt unless better match made
+                if ious[dind, gind] < iou:
+                    continue
+                # if match successful and best so far, store appropriately
+                iou = ious[dind, gind]
+                m = gind
+            # if match made store id of match for both dt and gt
+            if m == -1:
+                continue
+            dtIg[tind, dind] = gtIg[m]
+            dtm[tind, dind] = gtIds[m]
+            gtm[tind, m] = dId
+
+
+def matchVectorized(ious, iouThrs, gtIds, dtIds, iscrowd, gtIg, gtm, dtm, dtIg):
+    """
+    Same matching as matchLoop, processing all IoU thresholds and ground truths of a detection at
+    once. Scanning the ground truth in order, the loop keeps the last one of maximal IoU among
+    those that are available (unmatched or crowd) and reach the threshold, and only considers
+    ignored ground truth if no regular one matched.
+    """
+    (T, G), D = gtm.shape, len(dtIds)
+    if G == 0 or D == 0:
+        return
+    thrs = np.minimum(np.asarray(iouThrs, dtype=np.float64), 1 - 1e-10)
+    # [DxTxG] whether a gt overlaps a dt enough at a threshold
+    reach = ious[:, None, :] >= thrs[:, None]
+    crowd = np.asarray(iscrowd, dtype=bool)
+    if G == 1:
+        # at each threshold a crowd gt matches every dt that reaches it (and keeps the last one),
+        # any other gt the first one
+        reach = reach[:, :, 0]
+        if crowd[0]:
+            matched = reach.T
+            last = (D - 1) - reach[::-1].argmax(axis=0)
+        else:
+            first = reach.argmax(axis=0)
+            matched = np.zeros((T, D), dtype=bool)
+            matched[np.arange(T), first] = reach[first, np.arange(T)]
+            last = first
+        dtIg[matched] = gtIg[0]
+        dtm[matched] = gtIds[0]
+        found = matched.any(axis=1)
+        gtm[found, 0] = np.asarray(dtIds)[last[found]]
+        return
+    avail = np.ones((T, G), dtype=bool)
+    # ignored gts are sorted last
+    G0 = int(np.count_nonzero(np.asarray(gtIg) == 0))
+    mixed = 0 < G0 < G
+    gtIds = np.asarray(gtIds)
+    tinds = np.arange(T)
+    # reversed, so that argmax finds the last maximum like the loop does
+    iousRev = ious[:, ::-1]
+    # detections that overlap no gt enough at any threshold stay unmatched
+    for dind in np.flatnonzero(reach.any(axis=(1, 2))):
+        cand = reach[dind] & avail
+        if mixed:
+            # regular gts take precedence
+            regular = cand[:, :G0].any(axis=1)
+            cand[regular, G0:] = False
+        found = cand.any(axis=1)
+        if not found.any():
+            continue
+        m = (G - 1) - np.where(cand[:, ::-1], iousRev[dind], -1.0).argmax(axis=1)
+        t, g = tinds[found], m[found]
+        dtIg[t, dind] = gtIg[g]
+        dtm[t, dind] = gtIds[g]
+        gtm[t, g] = dtIds[dind]
+        avail[t, g] = crowd[g]
+
+
+MATCHERS = {"loop": matchLoop, "vectorized": matchVectorized}
+
+
+def batchOks(dts, gts, gtBoxes, gtAreas, sigmas):
+    """
+    Object keypoint similarity of every detection with every ground truth object.
+    :param dts: [DxKx3] detected keypoints (x, y, v)
+    :param gts: [GxKx3] ground truth keypoints
+    :param gtBoxes: [Gx4] ground truth boxes (x, y, w, h)
+    :param gtAreas: [G] ground truth areas
+    :param sigmas: [K] per keypoint constants
+    :return: [DxG] oks
+    """
+    vars = (np.asarray(sigmas) * 2) ** 2
+    xd, yd = dts[:, None, :, 0], dts[:, None, :, 1]
+    xg, yg, vg = gts[None, :, :, 0], gts[None, :, :, 1], gts[:, :, 2]
+    visible = vg > 0
+    # [DxGxK] per-keypoint distance if keypoints visible
+    dx = xd - xg
+    dy = yd - yg
+    hidden = ~visible.any(axis=1)
+    if hidden.any():
+        # measure minimum distance to keypoints in (x0,y0) & (x1,y1), the gt box doubled
+        x, y, w, h = (gtBoxes[hidden, i, None] for i in range(4))
+        x0, x1, y0, y1 = x - w, x + w * 2, y - h, y + h * 2
+        dx[:, hidden] = np.maximum(0, x0 - xd) + np.maximum(0, xd - x1)
+        dy[:, hidden] = np.maximum(0, y0 - yd) + np.maximum(0, yd - y1)
+    e = (dx**2 + dy**2) / vars / (gtAreas[None, :, None] + np.spacing(1)) / 2
+    # average over the visible keypoints, or all of them if none is
+    weights = visible | hidden[:, None]
+    return (np.exp(-e) * weights).sum(axis=2) / weights.sum(axis=1)
+
+
+def _accumulateKey(p):
+    """The params accumulate() depends on, to tell if they changed since evaluate()."""
+    return (
+        p.useCats,
+        list(p.catIds) if p.useCats else None,
+        list(p.imgIds),
+        [list(a) for a in p.areaRng],
+        list(p.maxDets),
+        list(p.iouThrs),
+        list(p.recThrs),
+    )
+
+
+# the Params saved with an EvalState, imgIds aside
+STATE_PARAMS = (
+    "iouType",
+    "catIds",
+    "iouThrs",
+    "recThrs",
+    "maxDets",
+    "areaRng",
+    "areaRngLbl",
+    "useCats",
+    "summaryIous",
+    "kpt_oks_sigmas",
+    "matcher",
+)
+
+
+def _stateParams(p):
+    """The STATE_PARAMS of p as JSON types."""
+    return {key: np.asarray(getattr(p, key)).tolist() for key in STATE_PARAMS if hasattr(p, key)}
+
+
 class Params:
     """
     Params for coco evaluation api
@@ -95,6 +285,8 @@ class Params:
         self.iouType = iouType
         # useSegm is deprecated
         self.useSegm = None
+        # greedy matching of the "python" engine, see MATCHERS
+        self.matcher = "vectorized"
 
 
 class COCOeval:
@@ -149,15 +341,41 @@ class COCOeval:
     # Data, paper, and tutorials available at:  http://mscoco.org/
     # Code written by Piotr Dollar and Tsung-Yi Lin, 2015.
     # Licensed under the Simplified BSD License [see coco/license.txt]
-    def __init__(self, cocoGt=None, cocoDt=None, iouType="segm", cocoParams: Params = None):
+    def __init__(
+        self,
+        cocoGt=None,
+        cocoDt=None,
+        iouType="segm",
+        cocoParams: Params = None,
+        n_workers: int = 1,
+        engine: str = "auto",
+        sparse: bool = False,
+    ):
         """
         Initialize CocoEval using coco APIs for gt and dt
         :param cocoGt: coco object with ground truth annotations
         :param cocoDt: coco object with detection results
+        :param n_workers: number of processes evaluate() shards the images over, 0 for one per
+            CPU. The results are identical to the serial evaluation (n_workers=1).
+        :param engine: implementation of the per image matching and accumulate(), one of ENGINES.
+            "native" runs them in C++ (pycocotools._eval) and produces the same results as
+            "python"; "auto" uses it whenever the extension is built and the subclass keeps the
+            evaluateImg, computeIoU and computeOks of COCOeval.
+        :param sparse: evaluate only the (image, category) pairs with ground truth or detections,
+            instead of every pair. evalImgs is then a dict (k, a, i) -> result of the non empty
+            elements of the [KxAxI] list; the metrics are identical.
         :return: None
         """
         if not iouType:
             print("iouType not specified. use default iouType segm")
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if engine == "native" and _eval is None:
+            raise ImportError("engine 'native' needs the pycocotools._eval extension")
+        self.engine = engine
+        self._evalImgsNative = None  # per image results of the native engine
+        self._nativeGroups = None  # (pairs, starts, sizes) of a sparse native evaluate()
+        self._evalImgsPacked = None  # per image results in flat arrays, see PackedEvalImgs
         self.cocoGt = cocoGt  # ground truth COCO API
         self.cocoDt = cocoDt  # detections COCO API
         self.evalImgs = defaultdict(
@@ -178,6 +396,74 @@ class COCOeval:
             self.params.catIds = sorted(cocoGt.getCatIds())
         self.stats_dict: Dict[StatKey, float] = {}
         self.stats_dict_per_class: Dict[StatKeyPerClass, float] = {}
+        self.n_workers = n_workers
+        self.sparse = sparse
+
+    @property
+    def evalImgs(self):
+        if self._evalImgs is None:
+            # evaluate() keeps its results packed, convert them on first use
+            self._evalImgs = self.evalImgsPacked.to_eval_imgs(self._paramsEval, self.sparse)
+        return self._evalImgs
+
+    @evalImgs.setter
+    def evalImgs(self, evalImgs):
+        self._evalImgs = evalImgs
+        self._evalImgsNative = None
+        self._evalImgsPacked = None
+
+    @property
+    def evalImgsPacked(self) -> PackedEvalImgs:
+        """The results of evaluate() in flat arrays, those of evalImgs if it was assigned."""
+        if self._evalImgsPacked is not None:
+            return self._evalImgsPacked
+        p = self._paramsEval
+        if self._evalImgsNative is not None:
+            self._evalImgsPacked = self._evalImgsPackedFromNative()
+            return self._evalImgsPacked
+        return PackedEvalImgs.from_eval_imgs(
+            self._evalImgs, len(p.areaRng), len(p.imgIds), len(p.iouThrs)
+        )
+
+    def _setEvalImgsPacked(self, packed):
+        self._evalImgs = None
+        self._evalImgsNative = None
+        self._evalImgsPacked = packed
+
+    def state(self) -> EvalState:
+        """
+        The results of evaluate() as an EvalState, to save and merge with the states of the
+        evaluations of other images (e.g. shards of a dataset on other machines)
+        """
+        p = self._paramsEval
+        return EvalState.from_packed(_stateParams(p), self.evalImgsPacked, p.imgIds)
+
+    def load_state(self, state: EvalState):
+        """
+        Take the results of an EvalState (e.g. EvalState.merge() of the states of the shards of
+        a dataset) as those of evaluate(), for accumulate() and summarize(). The params are those
+        of the state, with the images it evaluated.
+        :return: None
+        """
+        p = Params(state.params["iouType"])
+        arrays = ("iouThrs", "recThrs", "kpt_oks_sigmas")
+        for key, value in state.params.items():
+            setattr(p, key, np.array(value) if key in arrays else value)
+        p.imgIds = state.imgIds.tolist()
+        self.params = p
+        self._paramsEval = copy.deepcopy(p)
+        self._setEvalImgsPacked(state.packed(p.imgIds))
+        self.eval = {}
+
+    def _useNative(self):
+        if self.engine != "auto":
+            return self.engine == "native"
+        # the native engine would bypass the per image methods a subclass overrides
+        overridden = any(
+            getattr(type(self), name) is not getattr(COCOeval, name)
+            for name in ("evaluateImg", "computeIoU", "computeOks")
+        )
+        return _eval is not None and not overridden
 
     def _prepare(self):
         """
@@ -185,39 +471,64 @@ class COCOeval:
         :return: None
         """
 
-        def _toMask(anns, coco):
-            # modify ann['segmentation'] by reference
-            for ann in anns:
-                rle = coco.annToRLE(ann)
-                ann["segmentation"] = rle
-
         p = self.params
-        if p.useCats:
-            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
-            dts = self.cocoDt.loadAnns(self.cocoDt.getAnnIds(imgIds=p.imgIds, catIds=p.catIds))
-        else:
-            gts = self.cocoGt.loadAnns(self.cocoGt.getAnnIds(imgIds=p.imgIds))
-            dts = self.cocoDt.loadAnns(self.cocoDt.getAnnIds(imgIds=p.imgIds))
-
-        # convert ground truth to mask if iouType == 'segm'
-        if p.iouType == "segm":
-            _toMask(gts, self.cocoGt)
-            _toMask(dts, self.cocoDt)
-        # set ignore flag
-        for gt in gts:
-            gt["ignore"] = gt["ignore"] if "ignore" in gt else 0
-            gt["ignore"] = "iscrowd" in gt and gt["iscrowd"]
-            if p.iouType == "keypoints":
-                gt["ignore"] = (gt["num_keypoints"] == 0) or gt["ignore"]
-        self._gts = defaultdict(list)  # gt for evaluation
-        self._dts = defaultdict(list)  # dt for evaluation
-        for gt in gts:
-            self._gts[gt["image_id"], gt["category_id"]].append(gt)
-        for dt in dts:
-            self._dts[dt["image_id"], dt["category_id"]].append(dt)
+        catIds = p.catIds if p.useCats else []
+        self._gts = self._prepareGts(p.imgIds)  # gt for evaluation
+        self._dts = self._groupAnns(self.cocoDt, catIds)  # dt for evaluation
         self.evalImgs = defaultdict(list)  # per-image per-category evaluation results
         self.eval = {}  # accumulated evaluation results
 
+    def _prepareGts(self, imgIds):
+        """
+        The ground truth of the given images grouped by (image, category), with their ignore flag
+        :return: defaultdict (imgId, catId) -> list of annotations
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else []
+        # set ignore flag, on copies so that the annotations of cocoGt are left as is
+        gts = self._groupAnns(self.cocoGt, catIds, copyAnns=True, imgIds=imgIds)
+        for group in gts.values():
+            for gt in group:
+                gt["ignore"] = gt["ignore"] if "ignore" in gt else 0
+                gt["ignore"] = "iscrowd" in gt and gt["iscrowd"]
+                if p.iouType == "keypoints":
+                    gt["ignore"] = (gt["num_keypoints"] == 0) or gt["ignore"]
+        return gts
+
+    def _groupAnns(self, coco, catIds, copyAnns=False, imgIds=None):
+        """
+        The annotations of coco in params.imgIds (and catIds) grouped by (image, category).
+        Annotations in a columnar store are read straight from its columns into new dicts, without
+        the segmentations unless iouType is segm, and grouped with one sort.
+        :param copyAnns: copy the annotation dicts of a dict based coco
+        :param imgIds: the images to group the annotations of, params.imgIds by default
+        :return: defaultdict (imgId, catId) -> list of annotations
+        """
+        p = self.params
+        imgIds = p.imgIds if imgIds is None else imgIds
+        groups = defaultdict(list)
+        columns = coco.ann_columns
+        if columns is None:
+            anns = coco.loadAnns(coco.getAnnIds(imgIds=imgIds, catIds=catIds))
+            for ann in anns:
+                groups[ann["image_id"], ann["category_id"]].append(dict(ann) if copyAnns else ann)
+            return groups
+
+        rows = columns.index.select(imgIds=imgIds, catIds=catIds)
+        if len(rows) == 0:
+            return groups
+        # stable, so every group keeps the order of getAnnIds
+        rows = rows[np.lexsort((columns.category_id[rows], columns.image_id[rows]))]
+        anns = columns.anns(rows, segmentation=p.iouType == "segm")
+        img, cat = columns.image_id[rows], columns.category_id[rows]
+        starts = np.flatnonzero(np.r_[True, (img[1:] != img[:-1]) | (cat[1:] != cat[:-1])])
+        ends = np.r_[starts[1:], len(rows)].tolist()
+        for imgId, catId, start, end in zip(
+            img[starts].tolist(), cat[starts].tolist(), starts.tolist(), ends
+        ):
+            groups[imgId, catId] = anns[start:end]
+        return groups
+
     def evaluate(self):
         """
         Run per image evaluation on given images and store results (a list of dict) in self.evalImgs
@@ -238,28 +549,246 @@ class COCOeval:
         self.params = p
 
         self._prepare()
-        # loop through images, area range, max detection number
         catIds = p.catIds if p.useCats else [-1]
+        native = self._useNative()
 
-        if p.iouType == "segm" or p.iouType == "bbox":
-            computeIoU = self.computeIoU
-        elif p.iouType == "keypoints":
-            computeIoU = self.computeOks
-        self.ious = {
-            (imgId, catId): computeIoU(imgId, catId) for imgId in p.imgIds for catId in catIds
-        }
+        n_workers = self.n_workers if self.n_workers > 0 else os.cpu_count() or 1
+        n_workers = min(n_workers, len(p.imgIds))
+        if n_workers > 1:
+            # several shards per worker even out images of different cost; the shards are
+            # contiguous so that concatenating them keeps the image order of the serial loop
+            shards = _split(p.imgIds, 4 * n_workers)
+            # forked workers inherit the evaluator instead of unpickling a copy of it
+            context = multiprocessing.get_context("fork") if sys.platform == "linux" else None
+            with ProcessPoolExecutor(
+                n_workers, mp_context=context, initializer=_initWorker, initargs=(self,)
+            ) as pool:
+                results = list(pool.map(_evaluateShard, shards, itertools.repeat(not native)))
+        else:
+            results = [self._evaluateImages(p.imgIds, not native)]
 
-        evaluateImg = self.evaluateImg
+        self.ious = {}
+        for ious, _ in results:
+            self.ious.update(ious)
+        if native:
+            self._evaluateNative()
+        elif isinstance(results[0][1], PackedEvalImgs):
+            packed = PackedEvalImgs.concatenate([E for _, E in results])
+            self._setEvalImgsPacked(packed.sorted())
+        elif self.sparse:
+            A = len(p.areaRng)
+            self.evalImgs = {
+                (*divmod(ka, A), i): e
+                for ka in range(len(catIds) * A)
+                for _, E in results
+                for i, e in E[ka]
+            }
+        else:
+            # [KxAxI] with the images of every (category, area range) in shard order
+            self.evalImgs = [
+                e
+                for ka in range(len(catIds) * len(p.areaRng))
+                for _, E in results
+                for _, e in E[ka]
+            ]
+        self._paramsEval = copy.deepcopy(self.params)
+        toc = time.time()
+        print("DONE (t={:0.2f}s).".format(toc - tic))
+
+    def _evaluateImages(self, imgIds, match=True):
+        """
+        Compute the ious and per image evaluation of the given images
+        :param imgIds: images to evaluate, a subset of params.imgIds
+        :param match: run evaluateImg, otherwise only compute the ious
+        :return: (ious, evalImgs) - ious as in self.ious, evalImgs the PackedEvalImgs of imgIds,
+            None if not match. With a subclass' evaluateImg, a list of K*A lists (category major)
+            of (i, result) for the images i (index in params.imgIds) of imgIds, or of
+            _sparsePairs if sparse.
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        if self.sparse:
+            pairs = self._sparsePairs(imgIds)
+            keys = [(imgId, catId) for catId in catIds for _, imgId in pairs[catId]]
+        else:
+            keys = [(imgId, catId) for imgId in imgIds for catId in catIds]
+
+        # convert ground truth and detections to RLE if iouType == 'segm'
+        if p.iouType == "segm":
+            imgSet = set(imgIds)
+            for anns, coco in ((self._gts, self.cocoGt), (self._dts, self.cocoDt)):
+                for (imgId, _), group in anns.items():
+                    if imgId in imgSet:
+                        # copies with the RLE, the annotations of cocoGt and cocoDt are left as is
+                        group[:] = [dict(ann, segmentation=coco.annToRLE(ann)) for ann in group]
+
+        if p.iouType == "keypoints":
+            ious = {(imgId, catId): self.computeOks(imgId, catId) for imgId, catId in keys}
+        elif type(self).computeIoU is COCOeval.computeIoU:
+            ious = self.computeIoUs(imgIds, keys)
+        else:
+            # subclasses with their own computeIoU keep calling it per (image, category)
+            ious = {(imgId, catId): self.computeIoU(imgId, catId) for imgId, catId in keys}
+        # evaluateImg reads the ious of the image from self.ious
+        self.ious = ious
+        if not match:
+            return ious, None
+
+        # loop through images, area range, max detection number
         maxDet = p.maxDets[-1]
-        self.evalImgs = [
-            evaluateImg(imgId, catId, areaRng, maxDet)
+        if not self.sparse:
+            imgIndex = self._imageIndex()
+            imgs = [(imgIndex[imgId], imgId) for imgId in imgIds]
+            pairs = {catId: imgs for catId in catIds}
+        if type(self).evaluateImg is COCOeval.evaluateImg:
+            # the results go straight into flat arrays, without the dicts of evaluateImg()
+            # and each (image, category) is evaluated for all the area ranges at once
+            evaluateImgAreas = self._evaluateImgAreas
+            builder = PackedEvalImgsBuilder(len(p.iouThrs))
+            for k, catId in enumerate(catIds):
+                byArea = [[] for _ in p.areaRng]
+                for i, imgId in pairs[catId]:
+                    results = evaluateImgAreas(imgId, catId, p.areaRng, maxDet)
+                    if results is not None:
+                        for a, result in enumerate(results):
+                            byArea[a].append((i, result))
+                for a, entries in enumerate(byArea):
+                    for i, result in entries:
+                        builder.append(k, a, i, *result)
+            return ious, builder.finish()
+        evaluateImg = self.evaluateImg
+        evalImgs = [
+            [(i, evaluateImg(imgId, catId, areaRng, maxDet)) for i, imgId in pairs[catId]]
             for catId in catIds
             for areaRng in p.areaRng
-            for imgId in p.imgIds
         ]
-        self._paramsEval = copy.deepcopy(self.params)
-        toc = time.time()
-        print("DONE (t={:0.2f}s).".format(toc - tic))
+        return ious, evalImgs
+
+    def _imageIndex(self):
+        """dict imgId -> index in params.imgIds"""
+        return {imgId: i for i, imgId in enumerate(self.params.imgIds)}
+
+    def _sparsePairs(self, imgIds):
+        """
+        The (image, category) pairs of the given images that have ground truth or detections, the
+        only ones a sparse evaluate() visits
+        :param imgIds: images to evaluate, a subset of params.imgIds
+        :return: dict catId -> [(i, imgId)] in image order, i the index of imgId in params.imgIds,
+            for every catId of evaluate() (-1 if not useCats)
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        imgIndex = self._imageIndex()
+        imgSet = set(imgIds)
+        catSet = set(p.catIds)
+        present = set()
+        for anns in (self._gts, self._dts):
+            for (imgId, catId), group in anns.items():
+                # (empty groups are the defaultdict entries of earlier lookups)
+                if group and imgId in imgSet and catId in catSet:
+                    present.add((imgId, catId if p.useCats else -1))
+        pairs = {catId: [] for catId in catIds}
+        for imgId, catId in present:
+            pairs[catId].append((imgIndex[imgId], imgId))
+        for imgs in pairs.values():
+            imgs.sort()
+        return pairs
+
+    def _evaluateNative(self):
+        """
+        evaluateImg() of all images, categories and area ranges in C++. The results stay in C++ for
+        accumulate(), self.evalImgs converts them on first access.
+        Adapted from COCOeval_opt of detectron2 (see LICENSE_for_fast_eval_api.txt).
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+
+        def toCpp(anns, isDet=False):
+            return [
+                _eval.InstanceAnnotation(
+                    int(ann["id"]),
+                    ann["score"] if isDet else ann.get("score", 0.0),
+                    ann["area"],
+                    bool(ann.get("iscrowd", 0)),
+                    bool(ann.get("ignore", 0)),
+                )
+                for ann in anns
+            ]
+
+        if self.sparse:
+            self._evaluateNativeSparse(toCpp)
+            return
+        gts = [[toCpp(self._gts[imgId, catId]) for catId in p.catIds] for imgId in p.imgIds]
+        dts = [[toCpp(self._dts[imgId, catId], True) for catId in p.catIds] for imgId in p.imgIds]
+        # nested lists convert to std::vector much faster than arrays
+        ious = [
+            [np.asarray(self.ious[imgId, catId]).tolist() for catId in catIds] for imgId in p.imgIds
+        ]
+        if not p.useCats:
+            # concatenate the categories of every image, as computeIoU does
+            gts = [[[o for c in i for o in c]] for i in gts]
+            dts = [[[o for c in i for o in c]] for i in dts]
+
+        self._evalImgsNative = _eval.COCOevalEvaluateImages(
+            p.areaRng, p.maxDets[-1], p.iouThrs, ious, gts, dts
+        )
+        self._nativeGroups = None
+        self._evalImgs = None
+        self._evalImgsPacked = None
+
+    def _evaluateNativeSparse(self, toCpp):
+        """
+        _evaluateNative() of the _sparsePairs only. Every pair is passed as an image with a single
+        category, so the results are [AxP] for the P pairs in category major order, and those of
+        (category k, area range a) the slice of _nativeGroups for accumulate().
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        pairs = self._sparsePairs(p.imgIds)
+        keys = [(k, i, imgId, catId) for k, catId in enumerate(catIds) for i, imgId in pairs[catId]]
+        if p.useCats:
+            gts = [[toCpp(self._gts[imgId, catId])] for _, _, imgId, catId in keys]
+            dts = [[toCpp(self._dts[imgId, catId], True)] for _, _, imgId, catId in keys]
+        else:
+            gts = [[toCpp([o for c in p.catIds for o in self._gts[key[2], c]])] for key in keys]
+            dts = [
+                [toCpp([o for c in p.catIds for o in self._dts[key[2], c]], True)] for key in keys
+            ]
+        ious = [[np.asarray(self.ious[imgId, catId]).tolist()] for _, _, imgId, catId in keys]
+
+        counts = np.array([len(pairs[catId]) for catId in catIds], dtype=np.int64)
+        P, A = len(keys), len(p.areaRng)
+        starts = (np.arange(A) * P + (np.cumsum(counts) - counts)[:, None]).ravel()
+        sizes = np.repeat(counts, A)
+        self._evalImgsNative = _eval.COCOevalEvaluateImages(
+            p.areaRng, p.maxDets[-1], p.iouThrs, ious, gts, dts
+        )
+        self._nativeGroups = (keys, starts.tolist(), sizes.tolist())
+        self._evalImgs = None
+        self._evalImgsPacked = None
+
+    def _evalImgsPackedFromNative(self):
+        """The results of _evaluateNative() as PackedEvalImgs."""
+        p = self._paramsEval
+        K = len(p.catIds) if p.useCats else 1
+        A, I = len(p.areaRng), len(p.imgIds)
+        arrays = _eval.COCOevalPack(self._evalImgsNative, len(p.iouThrs))
+        if self._nativeGroups is None:
+            # [KxAxI]
+            keys = np.stack(np.unravel_index(np.arange(K * A * I), (K, A, I)), axis=1)
+        else:
+            # [AxP] of the P pairs (k, i)
+            pairs = np.array([key[:2] for key in self._nativeGroups[0]], dtype=np.int64)
+            pairs = pairs.reshape(-1, 2)
+            keys = np.stack(
+                [
+                    np.tile(pairs[:, 0], A),
+                    np.repeat(np.arange(A), len(pairs)),
+                    np.tile(pairs[:, 1], A),
+                ],
+                axis=1,
+            )
+        return PackedEvalImgs.from_native(arrays, keys)
 
     def computeIoU(self, imgId, catId):
         p = self.params
@@ -290,6 +819,49 @@ class COCOeval:
         ious = maskUtils.iou(d, g, iscrowd)
         return ious
 
+    def computeIoUs(self, imgIds, keys=None):
+        """
+        computeIoU() of all categories of the given images, with a single maskUtils.iouBatch call
+        instead of one maskUtils.iou call per (image, category)
+        :param imgIds: images to compute the ious of, a subset of params.imgIds
+        :param keys: the (imgId, catId) pairs of imgIds to compute the ious of, all by default
+        :return: dict (imgId, catId) -> ious, as in self.ious
+        """
+        p = self.params
+        catIds = p.catIds if p.useCats else [-1]
+        if keys is None:
+            keys = [(imgId, catId) for imgId in imgIds for catId in catIds]
+        if p.useCats:
+            gts = [self._gts[key] for key in keys]
+            dts = [self._dts[key] for key in keys]
+        else:
+            gts = [[_ for cId in p.catIds for _ in self._gts[imgId, cId]] for imgId, _ in keys]
+            dts = [[_ for cId in p.catIds for _ in self._dts[imgId, cId]] for imgId, _ in keys]
+        if p.iouType == "segm":
+            field = "segmentation"
+        elif p.iouType == "bbox":
+            field = "bbox"
+        else:
+            raise Exception("unknown iouType for iou computation")
+
+        # sort the detections of every group by score (stable, as computeIoU) and keep maxDets[-1]
+        dt = [d for group in dts for d in group]
+        nDt = np.array([len(group) for group in dts], dtype=np.int64)
+        order = np.argsort([-d["score"] for d in dt], kind="mergesort").astype(np.int64)
+        order = order[np.argsort(np.repeat(np.arange(len(dts)), nDt)[order], kind="mergesort")]
+        starts = np.cumsum(nDt) - nDt
+        keep = np.arange(len(dt)) - np.repeat(starts, nDt) < p.maxDets[-1]
+        dtSplits = np.concatenate([[0], np.cumsum(np.minimum(nDt, p.maxDets[-1]))])
+        gtSplits = np.concatenate([[0], np.cumsum([len(group) for group in gts])])
+
+        d = [dt[i][field] for i in order[keep]]
+        g = [o[field] for group in gts for o in group]
+        if p.iouType == "bbox":
+            d = np.array(d, dtype=np.float64).reshape(-1, 4)
+            g = np.array(g, dtype=np.float64).reshape(-1, 4)
+        iscrowd = [int(o["iscrowd"]) for group in gts for o in group]
+        return dict(zip(keys, maskUtils.iouBatch(d, g, iscrowd, dtSplits, gtSplits)))
+
     def computeOks(self, imgId, catId):
         p = self.params
         # dimention here should be Nxm
@@ -302,47 +874,48 @@ class COCOeval:
         # if len(gts) == 0 and len(dts) == 0:
         if len(gts) == 0 or len(dts) == 0:
             return []
-        ious = np.zeros((len(dts), len(gts)))
-        sigmas = p.kpt_oks_sigmas
-        vars = (sigmas * 2) ** 2
-        k = len(sigmas)
-        # compute oks between each detection and ground truth object
-        for j, gt in enumerate(gts):
-            # create bounds for ignore regions(double the gt bbox)
-            g = np.array(gt["keypoints"])
-            xg = g[0::3]
-            yg = g[1::3]
-            vg = g[2::3]
-            k1 = np.count_nonzero(vg > 0)
-            bb = gt["bbox"]
-            x0 = bb[0] - bb[2]
-            x1 = bb[0] + bb[2] * 2
-            y0 = bb[1] - bb[3]
-            y1 = bb[1] + bb[3] * 2
-            for i, dt in enumerate(dts):
-                d = np.array(dt["keypoints"])
-                xd = d[0::3]
-                yd = d[1::3]
-                if k1 > 0:
-                    # measure the per-keypoint distance if keypoints visible
-                    dx = xd - xg
-                    dy = yd - yg
-                else:
-                    # measure minimum distance to keypoints in (x0,y0) & (x1,y1)
-                    z = np.zeros((k))
-                    dx = np.max((z, x0 - xd), axis=0) + np.max((z, xd - x1), axis=0)
-                    dy = np.max((z, y0 - yd), axis=0) + np.max((z, yd - y1), axis=0)
-                e = (dx**2 + dy**2) / vars / (gt["area"] + np.spacing(1)) / 2
-                if k1 > 0:
-                    e = e[vg > 0]
-                ious[i, j] = np.sum(np.exp(-e)) / e.shape[0]
-        return ious
+        k = len(p.kpt_oks_sigmas)
+        return batchOks(
+            np.array([d["keypoints"] for d in dts], dtype=np.float64).reshape(len(dts), k, 3),
+            np.array([g["keypoints"] for g in gts], dtype=np.float64).reshape(len(gts), k, 3),
+            np.array([g["bbox"] for g in gts], dtype=np.float64).reshape(len(gts), 4),
+            np.array([g["area"] for g in gts], dtype=np.float64),
+            p.kpt_oks_sigmas,
+        )
 
     def evaluateImg(self, imgId, catId, aRng, maxDet):
         """
         perform evaluation for single category and image
         :return: dict (single image results)
         """
+        results = self._evaluateImgAreas(imgId, catId, [aRng], maxDet)
+        if results is None:
+            return None
+        dtIds, dtScores, gtIds, gtIg, dtm, gtm, dtIg = results[0]
+        # store results for given image and category
+        return {
+            "image_id": imgId,
+            "category_id": catId,
+            "aRng": aRng,
+            "maxDet": maxDet,
+            "dtIds": dtIds,
+            "gtIds": gtIds,
+            "dtMatches": dtm,
+            "gtMatches": gtm,
+            "dtScores": dtScores,
+            "gtIgnore": gtIg,
+            "dtIgnore": dtIg,
+        }
+
+    def _evaluateImgAreas(self, imgId, catId, areaRngs, maxDet):
+        """
+        evaluateImg() without the dict, for all the area ranges of an image and category at once.
+        The detections are sorted and the ground truth gathered once; area ranges with the same
+        ground truth ignore flags share the matching, since only the ignore flags of the unmatched
+        detections depend on the area range then.
+        :return: list of (dtIds, dtScores, gtIds, gtIgnore, dtMatches, gtMatches, dtIgnore) per
+            area range, or None
+        """
         p = self.params
         if p.useCats:
             gt = self._gts[imgId, catId]
@@ -353,74 +926,62 @@ class COCOeval:
         if len(gt) == 0 and len(dt) == 0:
             return None
 
-        for g in gt:
-            if g["ignore"] or (g["area"] < aRng[0] or g["area"] > aRng[1]):
-                g["_ignore"] = 1
-            else:
-                g["_ignore"] = 0
-
-        # sort dt highest score first, sort gt ignore last
-        gtind = np.argsort([g["_ignore"] for g in gt], kind="mergesort")
-        gt = [gt[i] for i in gtind]
+        # sort dt highest score first
         dtind = np.argsort([-d["score"] for d in dt], kind="mergesort")
         dt = [dt[i] for i in dtind[0:maxDet]]
+        dtIds = [d["id"] for d in dt]
+        dtScores = [d["score"] for d in dt]
+        dtArea = np.array([d["area"] for d in dt], dtype=np.float64)
+        gtIds = [g["id"] for g in gt]
+        gtArea = np.array([g["area"] for g in gt], dtype=np.float64)
+        gtIgnore = np.array([bool(g["ignore"]) for g in gt], dtype=bool)
         iscrowd = [int(o["iscrowd"]) for o in gt]
-        # load computed ious
-        ious = (
-            self.ious[imgId, catId][:, gtind]
-            if len(self.ious[imgId, catId]) > 0
-            else self.ious[imgId, catId]
-        )
+        ious = self.ious[imgId, catId]
 
         T = len(p.iouThrs)
         G = len(gt)
         D = len(dt)
-        gtm = np.zeros((T, G))
-        dtm = np.zeros((T, D))
-        gtIg = np.array([g["_ignore"] for g in gt])
-        dtIg = np.zeros((T, D))
-        if not len(ious) == 0:
-            for tind, t in enumerate(p.iouThrs):
-                for dind, d in enumerate(dt):
-                    # information about best match so far (m=-1 -> unmatched)
-                    iou = min([t, 1 - 1e-10])
-                    m = -1
-                    for gind, g in enumerate(gt):
-                        # if this gt already matched, and not a crowd, continue
-                        if gtm[tind, gind] > 0 and not iscrowd[gind]:
-                            continue
-                        # if dt matched to reg gt, and on ignore gt, stop
-                        if m > -1 and gtIg[m] == 0 and gtIg[gind] == 1:
-                            break
-                        # continue to next gt unless better match made
-                        if ious[dind, gind] < iou:
-                            continue
-                        # if match successful and best so far, store appropriately
-                        iou = ious[dind, gind]
-                        m = gind
-                    # if match made store id of match for both dt and gt
-                    if m == -1:
-                        continue
-                    dtIg[tind, dind] = gtIg[m]
-                    dtm[tind, dind] = gt[m]["id"]
-                    gtm[tind, m] = d["id"]
-        # set unmatched detections outside of area range to ignore
-        a = np.array([d["area"] < aRng[0] or d["area"] > aRng[1] for d in dt]).reshape((1, len(dt)))
-        dtIg = np.logical_or(dtIg, np.logical_and(dtm == 0, np.repeat(a, T, 0)))
-        # store results for given image and category
-        return {
-            "image_id": imgId,
-            "category_id": catId,
-            "aRng": aRng,
-            "maxDet": maxDet,
-            "dtIds": [d["id"] for d in dt],
-            "gtIds": [g["id"] for g in gt],
-            "dtMatches": dtm,
-            "gtMatches": gtm,
-            "dtScores": [d["score"] for d in dt],
-            "gtIgnore": gtIg,
-            "dtIgnore": dtIg,
-        }
+        match = MATCHERS[p.matcher]
+        matched = {}
+        results = []
+        for aRng in areaRngs:
+            ignore = gtIgnore | (gtArea < aRng[0]) | (gtArea > aRng[1])
+            key = ignore.tobytes()
+            if key not in matched:
+                # sort gt ignore last
+                gtind = np.argsort(ignore, kind="mergesort")
+                gtIg = ignore[gtind].astype(np.int64) if G else np.array([])
+                gtm = np.zeros((T, G))
+                dtm = np.zeros((T, D))
+                dtIg = np.zeros((T, D))
+                if not len(ious) == 0:
+                    match(
+                        ious[:, gtind],
+                        p.iouThrs,
+                        [gtIds[i] for i in gtind],
+                        dtIds,
+                        [iscrowd[i] for i in gtind],
+                        gtIg,
+                        gtm,
+                        dtm,
+                        dtIg,
+                    )
+                matched[key] = ([gtIds[i] for i in gtind], gtIg, dtm, gtm, dtIg)
+            sortedGtIds, gtIg, dtm, gtm, dtIg = matched[key]
+            # set unmatched detections outside of area range to ignore
+            a = ((dtArea < aRng[0]) | (dtArea > aRng[1])).reshape((1, D))
+            results.append(
+                (
+                    dtIds,
+                    dtScores,
+                    sortedGtIds,
+                    gtIg,
+                    dtm,
+                    gtm,
+                    np.logical_or(dtIg, np.logical_and(dtm == 0, a)),
+                )
+            )
+        return results
 
     def accumulate(self, p=None):
         """
@@ -430,7 +991,12 @@ class COCOeval:
         """
         print("Accumulating evaluation results...")
         tic = time.time()
-        if not self.evalImgs:
+        if self._evalImgsNative is not None and (p is None or p is self.params):
+            if _accumulateKey(self.params) == _accumulateKey(self._paramsEval):
+                self._accumulateNative()
+                print("DONE (t={:0.2f}s).".format(time.time() - tic))
+                return
+        if self._evalImgsPacked is None and self._evalImgsNative is None and not self._evalImgs:
             print("Please run evaluate() first")
         # allows input customized parameters
         if p is None:
@@ -459,66 +1025,86 @@ class COCOeval:
         i_list = [n for n, i in enumerate(p.imgIds) if i in setI]
         I0 = len(_pe.imgIds)
         A0 = len(_pe.areaRng)
-        # retrieve E at each category, area range, and max number of detections
+        recThrs = np.asarray(p.recThrs, dtype=np.float64)
+        tinds = np.arange(T)
+        packed = self.evalImgsPacked
+        bounds = packed.group_bounds(len(catIds), A0)
+        dtOffsets, gtOffsets = packed.dt_offsets, packed.gt_offsets
+        allImages = i_list == list(range(I0))
+        # retrieve E at each category and area range, the max numbers of detections select from it
         for k, k0 in enumerate(k_list):
-            Nk = k0 * A0 * I0
             for a, a0 in enumerate(a_list):
-                Na = a0 * I0
+                # the evaluations of (k0, a0), and their detections and ground truth, are slices
+                es, ee = bounds[k0 * A0 + a0], bounds[k0 * A0 + a0 + 1]
+                counts = np.diff(dtOffsets[es : ee + 1])
+                ds, de = dtOffsets[es], dtOffsets[ee]
+                dtScoresAll = packed.dt_scores[ds:de]
+                dtmAll = packed.dt_matches[:, ds:de]
+                dtIgAll = packed.dt_ignore[:, ds:de]
+                gtIg = packed.gt_ignore[gtOffsets[es] : gtOffsets[ee]]
+                if not allImages:
+                    selected = np.isin(packed.keys[es:ee, 2], i_list)
+                    dtKeep = np.repeat(selected, counts)
+                    dtScoresAll, dtmAll, dtIgAll = (
+                        dtScoresAll[dtKeep],
+                        dtmAll[:, dtKeep],
+                        dtIgAll[:, dtKeep],
+                    )
+                    gtIg = gtIg[np.repeat(selected, np.diff(gtOffsets[es : ee + 1]))]
+                    counts = counts[selected]
+                if len(counts) == 0:
+                    continue
+                npig = np.count_nonzero(~gtIg)
+                if npig == 0:
+                    continue
+                # rank of every detection within its image,
+                # [0:maxDet] of each image is rank < maxDet
+                rank = np.arange(len(dtScoresAll)) - np.repeat(np.cumsum(counts) - counts, counts)
+
                 for m, maxDet in enumerate(m_list):
-                    E = [self.evalImgs[Nk + Na + i] for i in i_list]
-                    E = [e for e in E if not e is None]
-                    if len(E) == 0:
-                        continue
-                    dtScores = np.concatenate([e["dtScores"][0:maxDet] for e in E])
+                    if counts.max() > maxDet:
+                        keep = rank < maxDet
+                        dtScores, dtm, dtIg = dtScoresAll[keep], dtmAll[:, keep], dtIgAll[:, keep]
+                    else:
+                        dtScores, dtm, dtIg = dtScoresAll, dtmAll, dtIgAll
 
                     # different sorting method generates slightly different results.
                     # mergesort is used to be consistent as Matlab implementation.
                     inds = np.argsort(-dtScores, kind="mergesort")
                     dtScoresSorted = dtScores[inds]
+                    dtm = dtm[:, inds]
+                    dtIg = dtIg[:, inds]
 
-                    dtm = np.concatenate([e["dtMatches"][:, 0:maxDet] for e in E], axis=1)[:, inds]
-                    dtIg = np.concatenate([e["dtIgnore"][:, 0:maxDet] for e in E], axis=1)[:, inds]
-                    gtIg = np.concatenate([e["gtIgnore"] for e in E])
-                    npig = np.count_nonzero(gtIg == 0)
-                    if npig == 0:
-                        continue
                     tps = np.logical_and(dtm, np.logical_not(dtIg))
                     fps = np.logical_and(np.logical_not(dtm), np.logical_not(dtIg))
 
-                    tp_sum = np.cumsum(tps, axis=1).astype(dtype=np.float)
-                    fp_sum = np.cumsum(fps, axis=1).astype(dtype=np.float)
-                    for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
-                        tp = np.array(tp)
-                        fp = np.array(fp)
-                        nd = len(tp)
-                        rc = tp / npig
-                        pr = tp / (fp + tp + np.spacing(1))
-                        q = np.zeros((R,))
-                        ss = np.zeros((R,))
-
-                        if nd:
-                            recall[t, k, a, m] = rc[-1]
-                        else:
-                            recall[t, k, a, m] = 0
-
-                        # numpy is slow without cython optimization for accessing elements
-                        # use python array gets significant speed improvement
-                        pr = pr.tolist()
-                        q = q.tolist()
-
-                        for i in range(nd - 1, 0, -1):
-                            if pr[i] > pr[i - 1]:
-                                pr[i - 1] = pr[i]
-
-                        inds = np.searchsorted(rc, p.recThrs, side="left")
-                        try:
-                            for ri, pi in enumerate(inds):
-                                q[ri] = pr[pi]
-                                ss[ri] = dtScoresSorted[pi]
-                        except:
-                            pass
-                        precision[t, :, k, a, m] = np.array(q)
-                        scores[t, :, k, a, m] = np.array(ss)
+                    # [TxD] for all iou thresholds at once
+                    tp_sum = np.cumsum(tps, axis=1).astype(dtype=np.float64)
+                    fp_sum = np.cumsum(fps, axis=1).astype(dtype=np.float64)
+                    nd = tp_sum.shape[1]
+                    rc = tp_sum / npig
+                    pr = tp_sum / (fp_sum + tp_sum + np.spacing(1))
+                    recall[:, k, a, m] = rc[:, -1] if nd else 0
+
+                    # precision envelope: the max over the detections from each one onwards
+                    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+
+                    # np.searchsorted(rc[t], recThrs, side="left") for every t in one call: the
+                    # complex keys t + 1j * recall sort by threshold first, then by recall
+                    keys = (tinds[:, None] + 1j * rc).ravel()
+                    queries = (tinds[:, None] + 1j * recThrs).ravel()
+                    inds = np.searchsorted(keys, queries, side="left").reshape(T, R) - (
+                        tinds[:, None] * nd
+                    )
+                    # recall thresholds beyond the max recall get precision 0
+                    valid = inds < nd
+                    q = np.zeros((T, R))
+                    ss = np.zeros((T, R))
+                    t, r = np.nonzero(valid)
+                    q[t, r] = pr[t, inds[t, r]]
+                    ss[t, r] = dtScoresSorted[inds[t, r]]
+                    precision[:, :, k, a, m] = q
+                    scores[:, :, k, a, m] = ss
         self.eval = {
             "params": p,
             "counts": [T, R, K, A, M],
@@ -530,6 +1116,19 @@ class COCOeval:
         toc = time.time()
         print("DONE (t={:0.2f}s).".format(toc - tic))
 
+    def _accumulateNative(self):
+        """accumulate() of the native evaluate() results with unchanged params, in C++."""
+        p = self.params
+        p.catIds = p.catIds if p.useCats == 1 else [-1]
+        if self._nativeGroups is not None:
+            _, starts, sizes = self._nativeGroups
+            self.eval = _eval.COCOevalAccumulate(
+                self._paramsEval, self._evalImgsNative, starts, sizes
+            )
+        else:
+            self.eval = _eval.COCOevalAccumulate(self._paramsEval, self._evalImgsNative)
+        self.eval["params"] = p
+
     def summarize(self):
         """
         Compute and display summary metrics for evaluation results.
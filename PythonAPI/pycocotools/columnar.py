@@ -0,0 +1,724 @@
+"""
+Columnar (struct-of-arrays) storage for COCO annotations.
+
+The default COCO index keeps one Python dict per annotation, plus the lists in imgToAnns and
+catToImgs that point at them. For datasets with millions of annotations that costs several
+hundred bytes per annotation and a lot of time spent in the interpreter. AnnotationColumns keeps
+the same information in a handful of flat NumPy arrays instead:
+
+    id, image_id, category_id   - [N] int64
+    area, score                 - [N] float64 (NaN where the field is missing, INT_AREA flags the
+                                  integer areas)
+    iscrowd, flags, seg_kind    - [N] uint8
+    bbox                        - [N,4] float64
+    seg_kind                    - SEG_NONE / POLYGON / RLE / COUNTS / BBOX
+    seg_size                    - [N,2] int64 (h, w) for RLE segmentations
+    seg_offsets                 - [N+1] int64 offsets into the segmentation "parts" tables
+    part_start, part_len        - [P] int64, one entry per polygon / RLE payload
+    seg_data                    - float64 payload for polygon coordinates and uncompressed counts
+    seg_bytes                   - uint8 payload for compressed RLE counts strings
+    kp_offsets, kp_data         - [N+1] int64 / float64 ragged keypoints
+    extra_offsets, extra_bytes  - [N+1] int64 / uint8 JSON-encoded remaining fields
+
+Annotation dicts are only built when somebody asks for them (see AnnotationsView and friends),
+so code that goes through COCO.loadAnns / COCO.imgToAnns keeps working unchanged.
+AnnotationColumns.from_arrays fills the columns straight from arrays (COCO.loadRes of [N,7]
+detection arrays), without any per-annotation Python object.
+
+ImageColumns does the same for the image records (used by COCO(shared=True)): the id, height and
+width of every image as arrays plus the JSON-encoded image dicts in one packed byte buffer.
+"""
+
+import json
+import operator
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .query import AnnotationQuery
+
+__all__ = [
+    "AnnotationColumns",
+    "ColumnarBuilder",
+    "AnnotationsView",
+    "ImageAnnotationsView",
+    "CategoryImagesView",
+    "AnnotationSequence",
+    "ImageColumns",
+    "ImagesView",
+    "ImageSequence",
+]
+
+# Bits in AnnotationColumns.flags that record which optional fields an annotation had.
+HAS_AREA = 1
+HAS_ISCROWD = 2
+HAS_BBOX = 4
+HAS_SCORE = 8
+HAS_KEYPOINTS = 16
+HAS_CATEGORY = 32
+# the area was an int (the column is float64 either way), the dicts get it back as an int
+INT_AREA = 64
+
+# Values of AnnotationColumns.seg_kind
+SEG_NONE = 0
+SEG_POLYGON = 1
+SEG_RLE = 2
+SEG_COUNTS = 3
+# the rectangle polygon of the bbox (box results of COCO.loadRes), nothing stored
+SEG_BBOX = 4
+
+_COLUMN_KEYS = frozenset(
+    [
+        "id",
+        "image_id",
+        "category_id",
+        "area",
+        "iscrowd",
+        "bbox",
+        "score",
+        "segmentation",
+        "keypoints",
+    ]
+)
+
+
+def _json_default(obj):
+    # numpy scalars / arrays sneak into in-memory result lists
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ColumnarBuilder:
+    """
+    Accumulates annotation dicts one at a time into growable buffers. Call finish() to get the
+    AnnotationColumns.
+    """
+
+    def __init__(self):
+        self._id = array("q")
+        self._image_id = array("q")
+        self._category_id = array("q")
+        self._area = array("d")
+        self._iscrowd = array("B")
+        self._bbox = array("d")
+        self._score = array("d")
+        self._flags = array("B")
+        self._seg_kind = array("B")
+        self._seg_size = array("q")
+        self._seg_offsets = array("q", [0])
+        self._part_start = array("q")
+        self._part_len = array("q")
+        self._seg_data = array("d")
+        self._seg_bytes = bytearray()
+        self._kp_offsets = array("q", [0])
+        self._kp_data = array("d")
+        self._extra_offsets = array("q", [0])
+        self._extra_bytes = bytearray()
+
+    def __len__(self):
+        return len(self._id)
+
+    def extend(self, anns: Iterable[Dict[str, Any]]) -> "ColumnarBuilder":
+        for ann in anns:
+            self.append(ann)
+        return self
+
+    def append(self, ann: Dict[str, Any]) -> None:
+        flags = 0
+        extra = {}
+        # the same errors as the gason loader, before any column grows
+        try:
+            ann_id, image_id = operator.index(ann["id"]), operator.index(ann["image_id"])
+        except TypeError:
+            raise ValueError(f"non integer id / image_id of annotation {len(self)}") from None
+        try:
+            category_id = operator.index(ann["category_id"]) if "category_id" in ann else -1
+        except TypeError:
+            raise ValueError(f"non integer category_id of annotation {len(self)}") from None
+        self._id.append(ann_id)
+        self._image_id.append(image_id)
+        self._category_id.append(category_id)
+        if "category_id" in ann:
+            flags |= HAS_CATEGORY
+        if "area" in ann:
+            flags |= HAS_AREA
+            if isinstance(ann["area"], (int, np.integer)):
+                flags |= INT_AREA
+            self._area.append(ann["area"])
+        else:
+            self._area.append(np.nan)
+        if "iscrowd" in ann:
+            flags |= HAS_ISCROWD
+            self._iscrowd.append(int(ann["iscrowd"]))
+        else:
+            self._iscrowd.append(0)
+        bbox = ann.get("bbox")
+        if bbox is not None and len(bbox) == 4:
+            flags |= HAS_BBOX
+            self._bbox.extend(bbox)
+        else:
+            if bbox is not None:
+                extra["bbox"] = bbox
+            self._bbox.extend((np.nan, np.nan, np.nan, np.nan))
+        if "score" in ann:
+            flags |= HAS_SCORE
+            self._score.append(ann["score"])
+        else:
+            self._score.append(np.nan)
+        if "keypoints" in ann:
+            flags |= HAS_KEYPOINTS
+            self._kp_data.extend(ann["keypoints"])
+        self._kp_offsets.append(len(self._kp_data))
+        self._flags.append(flags)
+        segm = ann.get("segmentation")
+        if not self._append_segmentation(segm) and "segmentation" in ann:
+            extra["segmentation"] = segm
+
+        extra.update((k, v) for k, v in ann.items() if k not in _COLUMN_KEYS)
+        if extra:
+            self._extra_bytes += json.dumps(extra, default=_json_default).encode("utf-8")
+        self._extra_offsets.append(len(self._extra_bytes))
+
+    def _append_part(self, start, length):
+        self._part_start.append(start)
+        self._part_len.append(length)
+
+    def _append_segmentation(self, segm) -> bool:
+        """Store segm in the segmentation tables. Returns False if it has to go to extras."""
+        h = w = 0
+        if segm is None:
+            kind = SEG_NONE
+        elif isinstance(segm, list):
+            # polygon -- a single object might consist of multiple parts
+            kind = SEG_POLYGON
+            for poly in segm:
+                self._append_part(len(self._seg_data), len(poly))
+                self._seg_data.extend(poly)
+        elif isinstance(segm, Mapping) and "size" in segm and "counts" in segm:
+            h, w = segm["size"]
+            counts = segm["counts"]
+            if isinstance(counts, (str, bytes)):
+                kind = SEG_RLE
+                if isinstance(counts, str):
+                    counts = counts.encode("ascii")
+                self._append_part(len(self._seg_bytes), len(counts))
+                self._seg_bytes += counts
+            else:
+                kind = SEG_COUNTS
+                self._append_part(len(self._seg_data), len(counts))
+                self._seg_data.extend(counts)
+        else:
+            kind = SEG_NONE
+        self._seg_kind.append(kind)
+        self._seg_size.extend((h, w))
+        self._seg_offsets.append(len(self._part_start))
+        return kind != SEG_NONE
+
+    def finish(self) -> "AnnotationColumns":
+        def _np(buf, dtype):
+            return np.frombuffer(buf, dtype=dtype).copy() if len(buf) else np.zeros(0, dtype)
+
+        return AnnotationColumns(
+            id=_np(self._id, np.int64),
+            image_id=_np(self._image_id, np.int64),
+            category_id=_np(self._category_id, np.int64),
+            area=_np(self._area, np.float64),
+            iscrowd=_np(self._iscrowd, np.uint8),
+            bbox=_np(self._bbox, np.float64).reshape((-1, 4)),
+            score=_np(self._score, np.float64),
+            flags=_np(self._flags, np.uint8),
+            seg_kind=_np(self._seg_kind, np.uint8),
+            seg_size=_np(self._seg_size, np.int64).reshape((-1, 2)),
+            seg_offsets=_np(self._seg_offsets, np.int64),
+            part_start=_np(self._part_start, np.int64),
+            part_len=_np(self._part_len, np.int64),
+            seg_data=_np(self._seg_data, np.float64),
+            seg_bytes=_np(self._seg_bytes, np.uint8),
+            kp_offsets=_np(self._kp_offsets, np.int64),
+            kp_data=_np(self._kp_data, np.float64),
+            extra_offsets=_np(self._extra_offsets, np.int64),
+            extra_bytes=_np(self._extra_bytes, np.uint8),
+        )
+
+
+class AnnotationColumns:
+    """
+    Struct-of-arrays annotation store. See the module docstring for the column layout. The
+    id / image / category groupings live in ``index`` (a pycocotools.query.AnnotationQuery).
+    """
+
+    ARRAYS = (
+        "id",
+        "image_id",
+        "category_id",
+        "area",
+        "iscrowd",
+        "bbox",
+        "score",
+        "flags",
+        "seg_kind",
+        "seg_size",
+        "seg_offsets",
+        "part_start",
+        "part_len",
+        "seg_data",
+        "seg_bytes",
+        "kp_offsets",
+        "kp_data",
+        "extra_offsets",
+        "extra_bytes",
+    )
+
+    def __init__(self, index_arrays: Optional[Dict[str, np.ndarray]] = None, **arrays: np.ndarray):
+        """
+        :param index_arrays: precomputed AnnotationQuery.index_arrays() for these columns
+        :param arrays: one array per name in ARRAYS
+        """
+        missing = set(self.ARRAYS) - set(arrays)
+        if missing:
+            raise ValueError(f"Missing annotation columns: {sorted(missing)}")
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.index = AnnotationQuery(
+            self.id, self.image_id, self.category_id, self.area, self.iscrowd, index_arrays
+        )
+
+    @classmethod
+    def from_annotations(cls, anns: Iterable[Dict[str, Any]]) -> "AnnotationColumns":
+        return ColumnarBuilder().extend(anns).finish()
+
+    @classmethod
+    def from_arrays(
+        cls,
+        image_id,
+        category_id=None,
+        score=None,
+        bbox=None,
+        area=None,
+        iscrowd=None,
+        id=None,
+        segmentation: Optional[Sequence[Dict[str, Any]]] = None,
+        keypoints=None,
+        bbox_segmentation: bool = False,
+    ) -> "AnnotationColumns":
+        """
+        Build the columns of N annotations from arrays. A field that is None is missing from every
+        annotation (as in the dicts anns() builds), except id which defaults to 1..N.
+
+        :param segmentation: N compressed RLEs ({"size": [h, w], "counts": str or bytes})
+        :param keypoints: [N, 3*K] array
+        :param bbox_segmentation: without segmentation, every annotation has the rectangle
+            polygon of its bbox as segmentation (see SEG_BBOX)
+        """
+        image_id = np.asarray(image_id, dtype=np.int64).reshape(-1)
+        n = len(image_id)
+
+        def column(values, dtype, flag, fill, shape=(-1,)):
+            if values is None:
+                return np.full(n * int(np.prod(shape[1:])), fill, dtype).reshape(shape), 0
+            values = np.asarray(values, dtype=dtype).reshape(shape)
+            if len(values) != n:
+                raise ValueError(f"Expected {n} rows, got {len(values)}")
+            return values, flag
+
+        flags = 0
+        id, _ = column(np.arange(1, n + 1) if id is None else id, np.int64, 0, 0)
+        category_id, f = column(category_id, np.int64, HAS_CATEGORY, -1)
+        flags |= f
+        if area is not None and np.asarray(area).dtype.kind in "iu":
+            flags |= INT_AREA
+        area, f = column(area, np.float64, HAS_AREA, np.nan)
+        flags |= f
+        iscrowd, f = column(iscrowd, np.uint8, HAS_ISCROWD, 0)
+        flags |= f
+        bbox, f = column(bbox, np.float64, HAS_BBOX, np.nan, (-1, 4))
+        flags |= f
+        score, f = column(score, np.float64, HAS_SCORE, np.nan)
+        flags |= f
+        if keypoints is not None:
+            keypoints = np.asarray(keypoints, dtype=np.float64).reshape(n, -1)
+            flags |= HAS_KEYPOINTS
+            kp_data = keypoints.reshape(-1)
+            kp_offsets = np.arange(n + 1, dtype=np.int64) * keypoints.shape[1]
+        else:
+            kp_data, kp_offsets = np.zeros(0), np.zeros(n + 1, np.int64)
+
+        seg_size = np.zeros((n, 2), np.int64)
+        seg_bytes = np.zeros(0, np.uint8)
+        part_start = part_len = np.zeros(0, np.int64)
+        seg_offsets = np.zeros(n + 1, np.int64)
+        if segmentation is not None:
+            if len(segmentation) != n:
+                raise ValueError(f"Expected {n} segmentations, got {len(segmentation)}")
+            counts = [segm["counts"] for segm in segmentation]
+            if not all(isinstance(c, (str, bytes)) for c in counts):
+                raise ValueError("from_arrays only takes compressed RLE segmentations")
+            counts = [c.encode("ascii") if isinstance(c, str) else c for c in counts]
+            seg_kind = np.full(n, SEG_RLE, np.uint8)
+            seg_size[:] = [segm["size"] for segm in segmentation]
+            part_len = np.fromiter(map(len, counts), np.int64, n)
+            part_start = np.cumsum(part_len) - part_len
+            seg_bytes = np.frombuffer(b"".join(counts), np.uint8).copy()
+            seg_offsets = np.arange(n + 1, dtype=np.int64)
+        else:
+            seg_kind = np.full(n, SEG_BBOX if bbox_segmentation else SEG_NONE, np.uint8)
+
+        return cls(
+            id=id,
+            image_id=image_id,
+            category_id=category_id,
+            area=area,
+            iscrowd=iscrowd,
+            bbox=bbox,
+            score=score,
+            flags=np.full(n, flags, np.uint8),
+            seg_kind=seg_kind,
+            seg_size=seg_size,
+            seg_offsets=seg_offsets,
+            part_start=part_start,
+            part_len=part_len,
+            seg_data=np.zeros(0),
+            seg_bytes=seg_bytes,
+            kp_offsets=kp_offsets,
+            kp_data=kp_data,
+            extra_offsets=np.zeros(n + 1, np.int64),
+            extra_bytes=np.zeros(0, np.uint8),
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def rows(self, ids) -> np.ndarray:
+        """Vectorized annotation id -> row lookup (see AnnotationQuery.rows)."""
+        return self.index.rows(ids)
+
+    def row(self, ann_id) -> int:
+        return int(self.index.rows([ann_id])[0])
+
+    def has_id(self, ann_id) -> bool:
+        return self.index.has_id(ann_id)
+
+    # ------------------------------------------------------------------------------------------
+    # materialization
+    # ------------------------------------------------------------------------------------------
+    def segmentation(self, row: int):
+        kind = self.seg_kind[row]
+        if kind == SEG_NONE:
+            return None
+        if kind == SEG_BBOX:
+            x1, y1, w, h = self.bbox[row].tolist()
+            x2, y2 = x1 + w, y1 + h
+            return [[x1, y1, x1, y2, x2, y2, x2, y1]]
+        p0, p1 = self.seg_offsets[row : row + 2].tolist()
+        starts, lens = self.part_start[p0:p1].tolist(), self.part_len[p0:p1].tolist()
+        if kind == SEG_POLYGON:
+            return [self.seg_data[s : s + n].tolist() for s, n in zip(starts, lens)]
+        h, w = self.seg_size[row].tolist()
+        s, n = starts[0], lens[0]
+        if kind == SEG_RLE:
+            counts = self.seg_bytes[s : s + n].tobytes().decode("ascii")
+        else:
+            counts = self.seg_data[s : s + n].astype(np.int64).tolist()
+        return {"size": [h, w], "counts": counts}
+
+    def keypoints(self, row: int) -> Optional[List[float]]:
+        if not self.flags[row] & HAS_KEYPOINTS:
+            return None
+        return self.kp_data[self.kp_offsets[row] : self.kp_offsets[row + 1]].tolist()
+
+    def ann(self, row: int) -> Dict[str, Any]:
+        """Build the annotation dict stored at the given row."""
+        return self.anns([row])[0]
+
+    def anns(self, rows: Iterable[int], segmentation: bool = True) -> List[Dict[str, Any]]:
+        """
+        Build the annotation dicts stored at the given rows.
+
+        :param segmentation: False leaves out the segmentations, e.g. for bbox evaluation
+        """
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        # gather every fixed size column at once, so the loop below only touches python objects
+        ids, img_ids = self.id[rows].tolist(), self.image_id[rows].tolist()
+        cat_ids, flags = self.category_id[rows].tolist(), self.flags[rows].tolist()
+        area, iscrowd = self.area[rows].tolist(), self.iscrowd[rows].tolist()
+        bbox, score = self.bbox[rows].tolist(), self.score[rows].tolist()
+        seg_kind = self.seg_kind[rows].tolist()
+        kp0, kp1 = self.kp_offsets[rows].tolist(), self.kp_offsets[rows + 1].tolist()
+        e0, e1 = self.extra_offsets[rows].tolist(), self.extra_offsets[rows + 1].tolist()
+        out = []
+        for i, row in enumerate(rows.tolist()):
+            f = flags[i]
+            ann = {"id": ids[i], "image_id": img_ids[i]}
+            if f & HAS_CATEGORY:
+                ann["category_id"] = cat_ids[i]
+            if segmentation and seg_kind[i] != SEG_NONE:
+                ann["segmentation"] = self.segmentation(row)
+            if f & HAS_AREA:
+                ann["area"] = int(area[i]) if f & INT_AREA else area[i]
+            if f & HAS_ISCROWD:
+                ann["iscrowd"] = iscrowd[i]
+            if f & HAS_BBOX:
+                ann["bbox"] = bbox[i]
+            if f & HAS_SCORE:
+                ann["score"] = score[i]
+            if f & HAS_KEYPOINTS:
+                ann["keypoints"] = self.kp_data[kp0[i] : kp1[i]].tolist()
+            if e1[i] > e0[i]:
+                ann.update(json.loads(self.extra_bytes[e0[i] : e1[i]].tobytes()))
+            out.append(ann)
+        return out
+
+
+class AnnotationsView(Mapping):
+    """Read-only ``{ann_id: ann}`` mapping over AnnotationColumns (stand-in for COCO.anns)."""
+
+    def __init__(self, columns: AnnotationColumns):
+        self._columns = columns
+        self._keys = None
+
+    def _key_order(self) -> np.ndarray:
+        # dict key order: first appearance of every id, a duplicated id counts once
+        if self._keys is None:
+            ids = self._columns.id
+            _, first = np.unique(ids, return_index=True)
+            self._keys = ids[np.sort(first)]
+        return self._keys
+
+    def __getitem__(self, ann_id):
+        if not self._columns.has_id(ann_id):
+            raise KeyError(ann_id)
+        return self._columns.ann(self._columns.row(ann_id))
+
+    def __contains__(self, ann_id):
+        return self._columns.has_id(ann_id)
+
+    def __iter__(self):
+        return iter(self._key_order().tolist())
+
+    def __len__(self):
+        return len(self._key_order())
+
+
+class _GroupedView(Mapping):
+    """
+    Shared code for the ``{key: [...]}`` views. Missing keys return an empty list, like the
+    defaultdicts they replace (but without inserting the key).
+    """
+
+    def __init__(self, columns: AnnotationColumns, keys, key_order, offsets, rows):
+        self._columns = columns
+        self._keys = keys
+        self._key_order = key_order
+        self._offsets = offsets
+        self._rows = rows
+
+    def _slice(self, key) -> Optional[np.ndarray]:
+        if len(self._keys) == 0:
+            return None
+        try:
+            pos = int(np.searchsorted(self._keys, key))
+        except TypeError:
+            return None
+        if pos >= len(self._keys) or self._keys[pos] != key:
+            return None
+        return self._rows[self._offsets[pos] : self._offsets[pos + 1]]
+
+    def _values(self, rows: np.ndarray) -> list:
+        raise NotImplementedError()
+
+    def __getitem__(self, key):
+        rows = self._slice(key)
+        return [] if rows is None else self._values(rows)
+
+    def __contains__(self, key):
+        return self._slice(key) is not None
+
+    def __iter__(self):
+        return iter(self._key_order.tolist())
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class ImageAnnotationsView(_GroupedView):
+    """Read-only ``{image_id: [ann, ...]}`` mapping (stand-in for COCO.imgToAnns)."""
+
+    def __init__(self, columns: AnnotationColumns):
+        index = columns.index
+        super().__init__(
+            columns, index.img_keys, index.img_key_order, index.img_offsets, index.img_rows
+        )
+
+    def _values(self, rows):
+        return self._columns.anns(rows)
+
+
+class CategoryImagesView(_GroupedView):
+    """Read-only ``{category_id: [image_id, ...]}`` mapping (stand-in for COCO.catToImgs)."""
+
+    def __init__(self, columns: AnnotationColumns):
+        index = columns.index
+        super().__init__(
+            columns, index.cat_keys, index.cat_key_order, index.cat_offsets, index.cat_rows
+        )
+
+    def _values(self, rows):
+        return self._columns.image_id[rows].tolist()
+
+
+class AnnotationSequence(Sequence):
+    """Read-only list of annotation dicts (stand-in for COCO.dataset["annotations"])."""
+
+    def __init__(self, columns: AnnotationColumns):
+        self._columns = columns
+
+    @property
+    def columns(self) -> AnnotationColumns:
+        return self._columns
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._columns.anns(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("annotation index out of range")
+        return self._columns.ann(index)
+
+    def __iter__(self):
+        columns = self._columns
+        for row in range(len(columns)):
+            yield columns.ann(row)
+
+    def __len__(self):
+        return len(self._columns)
+
+
+class ImageColumns:
+    """
+    Packed image records: id / height / width arrays (-1 where missing) plus every image dict
+    JSON-encoded into one byte buffer (data[offsets[i]:offsets[i+1]] is image i).
+    """
+
+    ARRAYS = ("id", "height", "width", "offsets", "data", "id_order", "sorted_ids")
+
+    def __init__(self, **arrays: np.ndarray):
+        missing = set(self.ARRAYS) - set(arrays)
+        if missing:
+            raise ValueError(f"Missing image columns: {sorted(missing)}")
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_images(cls, images: Iterable[Dict[str, Any]]) -> "ImageColumns":
+        images = list(images)
+        n = len(images)
+        ids = np.fromiter((img["id"] for img in images), dtype=np.int64, count=n)
+        data = bytearray()
+        offsets = array("q", [0])
+        for img in images:
+            data += json.dumps(img, default=_json_default).encode("utf-8")
+            offsets.append(len(data))
+        id_order = np.argsort(ids, kind="stable")
+        return cls(
+            id=ids,
+            height=np.fromiter((img.get("height", -1) for img in images), np.int64, count=n),
+            width=np.fromiter((img.get("width", -1) for img in images), np.int64, count=n),
+            offsets=np.frombuffer(offsets, dtype=np.int64).copy(),
+            data=np.frombuffer(data, dtype=np.uint8).copy() if data else np.zeros(0, np.uint8),
+            id_order=id_order,
+            sorted_ids=ids[id_order],
+        )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def find(self, img_id) -> Optional[int]:
+        """Row of the given image id (the last one for duplicated ids), None if missing."""
+        try:
+            pos = int(np.searchsorted(self.sorted_ids, img_id, side="right")) - 1
+        except TypeError:
+            return None
+        if pos < 0 or self.sorted_ids[pos] != img_id:
+            return None
+        return int(self.id_order[pos])
+
+    def row(self, img_id) -> int:
+        row = self.find(img_id)
+        if row is None:
+            raise KeyError(img_id)
+        return row
+
+    def size(self, img_id) -> tuple:
+        """(height, width) of the given image without building its dict."""
+        row = self.row(img_id)
+        return int(self.height[row]), int(self.width[row])
+
+    def image(self, row: int) -> Dict[str, Any]:
+        """Build the image dict stored at the given row."""
+        return json.loads(self.data[self.offsets[row] : self.offsets[row + 1]].tobytes())
+
+
+class ImagesView(Mapping):
+    """Read-only ``{image_id: image}`` mapping over ImageColumns (stand-in for COCO.imgs)."""
+
+    def __init__(self, columns: ImageColumns):
+        self._columns = columns
+        self._keys = None
+
+    def _key_order(self) -> np.ndarray:
+        # dict key order: first appearance of every id
+        if self._keys is None:
+            ids = self._columns.id
+            _, first = np.unique(ids, return_index=True)
+            self._keys = ids[np.sort(first)]
+        return self._keys
+
+    def __getitem__(self, img_id):
+        return self._columns.image(self._columns.row(img_id))
+
+    def __contains__(self, img_id):
+        return self._columns.find(img_id) is not None
+
+    def __iter__(self):
+        return iter(self._key_order().tolist())
+
+    def __len__(self):
+        return len(self._key_order())
+
+
+class ImageSequence(Sequence):
+    """Read-only list of image dicts (stand-in for COCO.dataset["images"])."""
+
+    def __init__(self, columns: ImageColumns):
+        self._columns = columns
+
+    @property
+    def columns(self) -> ImageColumns:
+        return self._columns
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._columns.image(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("image index out of range")
+        return self._columns.image(index)
+
+    def __iter__(self):
+        columns = self._columns
+        for row in range(len(columns)):
+            yield columns.image(row)
+
+    def __len__(self):
+        return len(self._columns)
@@ -0,0 +1,416 @@
+"""
+Packed (struct-of-arrays) storage for the per image results of COCOeval.evaluate().
+
+COCOeval.evaluateImg() returns one dict per (category, area range, image) with Python lists of
+ids and scores and a few small arrays, so the evalImgs of a large evaluation are tens of millions
+of small objects. PackedEvalImgs keeps the same information in flat NumPy arrays, with the
+detections and ground truth of all E non-empty evaluations concatenated:
+
+    keys                        - [E,3] int64 (k, a, i), the indices into params.catIds, areaRng
+                                  and imgIds of every evaluation, sorted
+    dt_offsets, gt_offsets      - [E+1] int64, evaluation e has the detections
+                                  dt_offsets[e]:dt_offsets[e+1] and the ground truth
+                                  gt_offsets[e]:gt_offsets[e+1]
+    dt_ids, dt_scores           - [D] int64 / float64, by decreasing score within an evaluation
+    dt_matches, dt_ignore       - [T,D] int64 / bool, id of the matched ground truth (0 if
+                                  unmatched) and ignore flag at every IoU threshold
+    gt_ids, gt_ignore           - [G] int64 / bool, ignored ground truth last within an evaluation
+    gt_matches                  - [T,G] int64, id of the matched detection or 0
+
+Since the keys are sorted, the evaluations of a (category, area range) are a contiguous range,
+and so are their detections: COCOeval.accumulate() reads them as slices of the flat arrays.
+to_eval_imgs() converts back to the evaluateImg() dicts for code that reads COCOeval.evalImgs.
+
+EvalState is the PackedEvalImgs of an evaluation keyed by category and image ids instead of
+indices, with the params it ran with: the states of evaluations of disjoint sets of images (e.g.
+shards on different machines) save(), load() and merge() into the state of the evaluation of all
+of them, for COCOeval.load_state() and accumulate().
+"""
+
+import hashlib
+import itertools
+import json
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+__all__ = ["EvalState", "PackedEvalImgs", "PackedEvalImgsBuilder"]
+
+
+def _ranges(offsets: np.ndarray, entries: np.ndarray) -> np.ndarray:
+    """The concatenated index ranges offsets[e]:offsets[e + 1] of the given entries."""
+    starts = offsets[entries]
+    counts = offsets[entries + 1] - starts
+    total = int(counts.sum())
+    shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return np.arange(total, dtype=np.int64) + shift
+
+
+class PackedEvalImgsBuilder:
+    """
+    Accumulates the results of evaluateImg() one (category, area range, image) at a time. Call
+    finish() to get the PackedEvalImgs.
+    """
+
+    def __init__(self, num_iou_thresholds: int):
+        self._T = num_iou_thresholds
+        self._keys = array("q")
+        self._dt_offsets = array("q", [0])
+        self._gt_offsets = array("q", [0])
+        self._dt_ids = array("q")
+        self._dt_scores = array("d")
+        self._gt_ids = array("q")
+        self._gt_ignore = array("B")
+        # [TxD] and [TxG] blocks, concatenated once in finish()
+        self._dt_matches: List[np.ndarray] = []
+        self._dt_ignore: List[np.ndarray] = []
+        self._gt_matches: List[np.ndarray] = []
+
+    def __len__(self):
+        return len(self._dt_offsets) - 1
+
+    def append(
+        self, k, a, i, dt_ids, dt_scores, gt_ids, gt_ignore, dt_matches, gt_matches, dt_ignore
+    ):
+        """Add the results of an evaluation, keys (k, a, i) appended in sorted order."""
+        self._keys.extend((k, a, i))
+        self._dt_ids.extend(dt_ids)
+        self._dt_scores.extend(dt_scores)
+        self._gt_ids.extend(gt_ids)
+        self._gt_ignore.extend(np.asarray(gt_ignore, dtype=np.uint8).tolist())
+        self._dt_offsets.append(len(self._dt_ids))
+        self._gt_offsets.append(len(self._gt_ids))
+        self._dt_matches.append(dt_matches)
+        self._dt_ignore.append(dt_ignore)
+        self._gt_matches.append(gt_matches)
+
+    def finish(self) -> "PackedEvalImgs":
+        def _np(buf, dtype):
+            return np.frombuffer(buf, dtype=dtype).copy() if len(buf) else np.zeros(0, dtype)
+
+        def _concat(blocks, dtype):
+            if not blocks:
+                return np.zeros((self._T, 0), dtype)
+            return np.concatenate(blocks, axis=1).astype(dtype, copy=False)
+
+        return PackedEvalImgs(
+            keys=_np(self._keys, np.int64).reshape((-1, 3)),
+            dt_offsets=_np(self._dt_offsets, np.int64),
+            gt_offsets=_np(self._gt_offsets, np.int64),
+            dt_ids=_np(self._dt_ids, np.int64),
+            dt_scores=_np(self._dt_scores, np.float64),
+            dt_matches=_concat(self._dt_matches, np.int64),
+            dt_ignore=_concat(self._dt_ignore, bool),
+            gt_ids=_np(self._gt_ids, np.int64),
+            gt_ignore=_np(self._gt_ignore, np.uint8).astype(bool),
+            gt_matches=_concat(self._gt_matches, np.int64),
+        )
+
+
+class PackedEvalImgs:
+    """
+    The per image results of COCOeval.evaluate() in flat arrays. See the module docstring for the
+    layout.
+    """
+
+    ARRAYS = (
+        "keys",
+        "dt_offsets",
+        "gt_offsets",
+        "dt_ids",
+        "dt_scores",
+        "dt_matches",
+        "dt_ignore",
+        "gt_ids",
+        "gt_ignore",
+        "gt_matches",
+    )
+
+    def __init__(self, **arrays: np.ndarray):
+        """
+        :param arrays: one array per name in ARRAYS
+        """
+        missing = set(self.ARRAYS) - set(arrays)
+        if missing:
+            raise ValueError(f"Missing evalImgs arrays: {sorted(missing)}")
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def num_iou_thresholds(self) -> int:
+        return self.dt_matches.shape[0]
+
+    @classmethod
+    def empty(cls, num_iou_thresholds: int) -> "PackedEvalImgs":
+        return PackedEvalImgsBuilder(num_iou_thresholds).finish()
+
+    @classmethod
+    def concatenate(
+        cls, parts: Sequence["PackedEvalImgs"], num_iou_thresholds: Optional[int] = None
+    ) -> "PackedEvalImgs":
+        """The evaluations of all parts, in this order (see sorted())."""
+        if not parts:
+            return cls.empty(num_iou_thresholds or 0)
+        if len(parts) == 1:
+            return parts[0]
+
+        def offsets(name):
+            shifted, shift = [np.zeros(1, np.int64)], 0
+            for part in parts:
+                part_offsets = getattr(part, name)
+                shifted.append(part_offsets[1:] + shift)
+                shift += part_offsets[-1]
+            return np.concatenate(shifted)
+
+        arrays = {name: offsets(name) for name in ("dt_offsets", "gt_offsets")}
+        for name in cls.ARRAYS:
+            if name not in arrays:
+                # the [TxD] and [TxG] arrays concatenate along the detections / ground truth
+                axis = 1 if name in ("dt_matches", "dt_ignore", "gt_matches") else 0
+                arrays[name] = np.concatenate([getattr(part, name) for part in parts], axis=axis)
+        return cls(**arrays)
+
+    def with_keys(self, keys: np.ndarray) -> "PackedEvalImgs":
+        """The same evaluations with other keys (not sorted)."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays["keys"] = np.asarray(keys, dtype=np.int64).reshape((-1, 3))
+        return PackedEvalImgs(**arrays)
+
+    def take(self, entries: np.ndarray) -> "PackedEvalImgs":
+        """The given evaluations (indices into keys), in this order."""
+        entries = np.asarray(entries, dtype=np.int64)
+        dt = _ranges(self.dt_offsets, entries)
+        gt = _ranges(self.gt_offsets, entries)
+        dt_counts = self.dt_offsets[entries + 1] - self.dt_offsets[entries]
+        gt_counts = self.gt_offsets[entries + 1] - self.gt_offsets[entries]
+        return PackedEvalImgs(
+            keys=self.keys[entries],
+            dt_offsets=np.concatenate([[0], np.cumsum(dt_counts)]).astype(np.int64),
+            gt_offsets=np.concatenate([[0], np.cumsum(gt_counts)]).astype(np.int64),
+            dt_ids=self.dt_ids[dt],
+            dt_scores=self.dt_scores[dt],
+            dt_matches=self.dt_matches[:, dt],
+            dt_ignore=self.dt_ignore[:, dt],
+            gt_ids=self.gt_ids[gt],
+            gt_ignore=self.gt_ignore[gt],
+            gt_matches=self.gt_matches[:, gt],
+        )
+
+    def sorted(self) -> "PackedEvalImgs":
+        """The evaluations sorted by (k, a, i), self if they already are."""
+        k, a, i = self.keys.T
+        order = np.lexsort((i, a, k))
+        if np.array_equal(order, np.arange(len(order))):
+            return self
+        return self.take(order)
+
+    def group_bounds(self, num_categories: int, num_area_ranges: int) -> np.ndarray:
+        """
+        [K*A+1] the evaluations of category k and area range a are those from
+        bounds[k * A + a] to bounds[k * A + a + 1].
+        """
+        groups = self.keys[:, 0] * num_area_ranges + self.keys[:, 1]
+        return np.searchsorted(groups, np.arange(num_categories * num_area_ranges + 1))
+
+    @classmethod
+    def from_native(cls, arrays: Dict[str, np.ndarray], keys: np.ndarray) -> "PackedEvalImgs":
+        """
+        The non-empty evaluations of _eval.COCOevalPack(), sorted
+        :param arrays: COCOevalPack() of the ImageEvaluations of COCOevalEvaluateImages()
+        :param keys: [Nx3] (k, a, i) of each of the N ImageEvaluations
+        """
+        packed = cls(keys=np.asarray(keys, dtype=np.int64).reshape((-1, 3)), **arrays)
+        nonempty = (np.diff(packed.dt_offsets) > 0) | (np.diff(packed.gt_offsets) > 0)
+        return packed.take(np.flatnonzero(nonempty)).sorted()
+
+    @classmethod
+    def from_eval_imgs(
+        cls,
+        evalImgs: Union[List[Optional[dict]], Dict[tuple, dict]],
+        num_area_ranges: int,
+        num_images: int,
+        num_iou_thresholds: int,
+    ) -> "PackedEvalImgs":
+        """
+        Pack evaluateImg() results: the [KxAxI] list of COCOeval.evalImgs (None for empty
+        evaluations) or the dict (k, a, i) -> result of a sparse evaluate().
+        """
+        if isinstance(evalImgs, dict):
+            items = evalImgs.items()
+        else:
+            A, I = num_area_ranges, num_images
+            K = len(evalImgs) // (A * I) if A * I else 0
+            items = zip(itertools.product(range(K), range(A), range(I)), evalImgs)
+        builder = PackedEvalImgsBuilder(num_iou_thresholds)
+        for (k, a, i), e in items:
+            if e is None:
+                continue
+            builder.append(
+                k,
+                a,
+                i,
+                e["dtIds"],
+                e["dtScores"],
+                e["gtIds"],
+                e["gtIgnore"],
+                e["dtMatches"],
+                e["gtMatches"],
+                e["dtIgnore"],
+            )
+        return builder.finish().sorted()
+
+    def to_eval_imgs(self, params, sparse: bool = False) -> Union[List[Optional[dict]], dict]:
+        """
+        The evaluateImg() dicts of the evaluations
+        :param params: the Params of evaluate()
+        :param sparse: return the dict (k, a, i) -> result of the evaluations instead of the
+            [KxAxI] list with None for the empty ones
+        """
+        catIds = params.catIds if params.useCats else [-1]
+        A, I = len(params.areaRng), len(params.imgIds)
+        maxDet = params.maxDets[-1]
+        dt_offsets, gt_offsets = self.dt_offsets.tolist(), self.gt_offsets.tolist()
+        evalImgs = {} if sparse else [None] * (len(catIds) * A * I)
+        for n, (k, a, i) in enumerate(self.keys.tolist()):
+            ds, de = dt_offsets[n], dt_offsets[n + 1]
+            gs, ge = gt_offsets[n], gt_offsets[n + 1]
+            e = {
+                "image_id": params.imgIds[i],
+                "category_id": catIds[k],
+                "aRng": params.areaRng[a],
+                "maxDet": maxDet,
+                "dtIds": self.dt_ids[ds:de].tolist(),
+                "gtIds": self.gt_ids[gs:ge].tolist(),
+                "dtMatches": self.dt_matches[:, ds:de].astype(np.float64),
+                "gtMatches": self.gt_matches[:, gs:ge].astype(np.float64),
+                "dtScores": self.dt_scores[ds:de].tolist(),
+                # (np.array([]) of evaluateImg without ground truth is float)
+                "gtIgnore": self.gt_ignore[gs:ge].astype(np.int64) if ge > gs else np.array([]),
+                "dtIgnore": self.dt_ignore[:, ds:de].copy(),
+            }
+            if sparse:
+                evalImgs[k, a, i] = e
+            else:
+                evalImgs[(k * A + a) * I + i] = e
+        return evalImgs
+
+
+def _positions(ids: np.ndarray, values: np.ndarray, what: str) -> np.ndarray:
+    """The index of every value in ids, ValueError if one is missing."""
+    ids, values = np.asarray(ids, dtype=np.int64), np.asarray(values, dtype=np.int64)
+    sorter = np.argsort(ids, kind="stable")
+    pos = np.minimum(np.searchsorted(ids, values, sorter=sorter), max(len(ids) - 1, 0))
+    if len(values) and (len(ids) == 0 or np.any(ids[sorter[pos]] != values)):
+        raise ValueError(f"The evaluation has {what} that are not in the params")
+    return sorter[pos]
+
+
+class EvalState:
+    """
+    The results of COCOeval.evaluate() on some images: the PackedEvalImgs with (catId, a, imgId)
+    keys, the images evaluated and the params (as a JSON dict, see COCOeval.state()). States of
+    disjoint images with the same params, i.e. the same fingerprint, merge() into the state of
+    the evaluation of all the images.
+
+    Example:
+
+    >>> # on every node, params.imgIds its shard of the images
+    >>> E.evaluate()
+    >>> E.state().save(f"shard{rank}.npz")
+    >>> # then
+    >>> state = EvalState.merge([EvalState.load(path) for path in paths])
+    >>> E = COCOeval(coco_gt, iouType="bbox")
+    >>> E.load_state(state)
+    >>> E.accumulate()
+    >>> E.summarize()
+    """
+
+    def __init__(self, params: Dict[str, Any], imgIds: Sequence[int], evalImgs: PackedEvalImgs):
+        """
+        :param params: the params of the evaluation except imgIds, JSON types only
+        :param imgIds: the images evaluated
+        :param evalImgs: their results, with the category and image ids in keys[:, 0] and [:, 2]
+        """
+        self.params = params
+        self.imgIds = np.asarray(imgIds, dtype=np.int64)
+        self.evalImgs = evalImgs
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the params that the results depend on."""
+        # the matcher only changes how the same matches are computed
+        params = {key: value for key, value in self.params.items() if key != "matcher"}
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def _catIds(self) -> List[int]:
+        return self.params["catIds"] if self.params["useCats"] else [-1]
+
+    @classmethod
+    def from_packed(
+        cls,
+        params: Dict[str, Any],
+        packed: PackedEvalImgs,
+        imgIds: Sequence[int],
+        evaluated: Optional[Sequence[int]] = None,
+    ) -> "EvalState":
+        """
+        :param packed: results with (k, a, i) keys, indices into the catIds of params and imgIds
+        :param evaluated: the images evaluated, imgIds by default
+        """
+        catIds = np.asarray(params["catIds"] if params["useCats"] else [-1], dtype=np.int64)
+        k, a, i = packed.keys.T
+        keys = np.stack([catIds[k], a, np.asarray(imgIds, dtype=np.int64)[i]], axis=1)
+        return cls(params, imgIds if evaluated is None else evaluated, packed.with_keys(keys))
+
+    def packed(self, imgIds: Sequence[int]) -> PackedEvalImgs:
+        """
+        The results with (k, a, i) keys, sorted
+        :param imgIds: the params.imgIds the image indices i refer to, a superset of self.imgIds
+        """
+        _positions(imgIds, self.imgIds, "images")
+        catId, a, imgId = self.evalImgs.keys.T
+        k = _positions(self._catIds(), catId, "categories")
+        i = _positions(imgIds, imgId, "images")
+        return self.evalImgs.with_keys(np.stack([k, a, i], axis=1)).sorted()
+
+    @classmethod
+    def merge(cls, states: Sequence["EvalState"]) -> "EvalState":
+        """The state of the evaluation of the images of all the states, with the same params."""
+        if not states:
+            raise ValueError("No evaluation states to merge")
+        fingerprint = states[0].fingerprint
+        for state in states[1:]:
+            if state.fingerprint != fingerprint:
+                changed = sorted(
+                    key
+                    for key in set(state.params) | set(states[0].params)
+                    if key != "matcher" and state.params.get(key) != states[0].params.get(key)
+                )
+                raise ValueError(f"Cannot merge evaluations with different params: {changed}")
+        imgIds = np.concatenate([state.imgIds for state in states])
+        if len(np.unique(imgIds)) != len(imgIds):
+            raise ValueError("Cannot merge evaluations of the same images")
+        evalImgs = PackedEvalImgs.concatenate(
+            [state.evalImgs for state in states], states[0].evalImgs.num_iou_thresholds
+        )
+        return cls(states[0].params, np.sort(imgIds), evalImgs)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Write the state to a compressed .npz file (the match arrays are mostly zeros)."""
+        arrays = {name: getattr(self.evalImgs, name) for name in PackedEvalImgs.ARRAYS}
+        params = np.frombuffer(json.dumps(self.params).encode(), dtype=np.uint8)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, params=params, imgIds=self.imgIds, **arrays)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "EvalState":
+        """Read a state written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            params = json.loads(data["params"].tobytes().decode())
+            evalImgs = PackedEvalImgs(**{name: data[name] for name in PackedEvalImgs.ARRAYS})
+            return cls(params, data["imgIds"], evalImgs)
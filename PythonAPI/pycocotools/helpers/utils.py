@@ -3,19 +3,21 @@ try:
 except:  # noqa: E722
     import json
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
+from .. import jsonio
 
-def load_json(json_path: Path) -> Dict[str, Any]:
+
+def load_json(json_path: Path, backend: Optional[str] = None) -> Dict[str, Any]:
     """
     Args:
         json_path: Path to json file
+        backend: JSON parser, one of "json", "simdjson" and "gason" (see pycocotools.jsonio).
+            Default is simdjson if installed, else json.
 
     Returns: json dictionary
     """
-    with open(json_path, encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+    return jsonio.load(json_path, backend)
 
 
 def save_json(json_path: Path, data: Dict, indent: int = 4, sort_keys: bool = True) -> None:
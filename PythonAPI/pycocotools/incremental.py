@@ -0,0 +1,187 @@
+"""
+COCOeval that takes the detections image by image instead of all at once through cocoDt.
+"""
+
+import contextlib
+import copy
+import io
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+
+from .coco import COCO, ResultSet
+from .cocoeval import COCOeval, Params, _accumulateKey, _stateParams
+from .evalimgs import EvalState, PackedEvalImgs
+
+__all__ = ["IncrementalCOCOeval"]
+
+# per image results are concatenated into one PackedEvalImgs every CHUNK_IMAGES images
+CHUNK_IMAGES = 256
+
+
+class IncrementalCOCOeval(COCOeval):
+    """
+    COCOeval for detections that arrive image by image, e.g. from a validation loop. update()
+    computes the ious and matches of an image right away and keeps only its packed per image
+    results (see PackedEvalImgs), not the detections or their masks. compute() accumulates and
+    summarizes them, with the same stats_dict as evaluate(), accumulate() and summarize() of all
+    the detections at once.
+
+    Evaluators of disjoint sets of images (e.g. one per process, with the same ground truth and
+    params) combine with merge(other.state()), see EvalState.
+
+    Example:
+
+    >>> E = IncrementalCOCOeval(coco_gt, "bbox")
+    >>> for image_id, detections in predictions:
+    >>>     E.update(image_id, detections)
+    >>> stats = E.compute()
+    """
+
+    def __init__(
+        self, cocoGt: COCO, iouType="segm", cocoParams: Params = None, sparse: bool = True
+    ):
+        """
+        :param cocoGt: coco object with ground truth annotations
+        :param sparse: as for COCOeval, evalImgs is a dict (k, a, i) -> result by default. The
+            metrics are the same either way.
+        """
+        super().__init__(cocoGt, None, iouType, cocoParams, engine="python", sparse=sparse)
+        self._results = ResultSet(cocoGt)
+        self._imgIndex = None  # params.imgIds -> index, set by the first update()
+        self._updated = set()  # images evaluated so far
+        self._numDets = 0  # detections so far, the next detection id is _numDets + 1
+        self._parts: List[PackedEvalImgs] = []  # results of the images of the current chunk
+        self._chunks: List[PackedEvalImgs] = []
+
+    def _start(self):
+        """Fix the params (as evaluate() does) on the first update() or merge()."""
+        if self._imgIndex is not None:
+            if _accumulateKey(self.params) != _accumulateKey(self._paramsEval):
+                raise ValueError("params changed since the first update()")
+            return
+        p = self.params
+        p.imgIds = list(np.unique(p.imgIds))
+        if p.useCats:
+            p.catIds = list(np.unique(p.catIds))
+        p.maxDets = sorted(p.maxDets)
+        self._paramsEval = copy.deepcopy(p)
+        self._imgIndex = {imgId: i for i, imgId in enumerate(p.imgIds)}
+
+    def _imageIndex(self):
+        return self._imgIndex
+
+    def update(self, image_id, detections):
+        """
+        Evaluate the detections of an image
+        :param image_id: an image of params.imgIds, each image is updated at most once
+        :param detections: all the results of the image, in any format of COCO.loadRes (a list of
+            result dicts, a dict of result arrays or an [Nx7] array); their image ids are set to
+            image_id
+        :return: None
+        """
+        self._start()
+        if image_id not in self._imgIndex:
+            raise ValueError(f"Image {image_id} is not in params.imgIds")
+        if image_id in self._updated:
+            raise ValueError(f"Image {image_id} was already updated")
+
+        if isinstance(detections, dict):
+            n = len(detections["score"])
+            detections = dict(detections, image_id=np.full(n, image_id, dtype=np.int64))
+        elif isinstance(detections, np.ndarray):
+            n = len(detections)
+            detections = detections.copy()
+            detections[:, 0] = image_id
+        else:
+            # copies, loadRes adds the id, area, ... to the result dicts
+            n = len(detections)
+            detections = [dict(d, image_id=image_id) for d in detections]
+        if n == 0:
+            self.cocoDt = self._results.reset()
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.cocoDt = self._results.load(detections)
+
+        p = self.params
+        catIds = p.catIds if p.useCats else []
+        self._gts = self._prepareGts([image_id])
+        self._dts = self._groupAnns(self.cocoDt, catIds, imgIds=[image_id])
+        _, packed = self._evaluateImages([image_id])
+        self._updated.add(image_id)
+        self._addResults(packed, n)
+
+        self._gts, self._dts, self.ious = defaultdict(list), defaultdict(list), {}
+        self.cocoDt = self._results.reset()
+
+    def _addResults(self, packed: PackedEvalImgs, numDets: int):
+        """
+        Keep the results of numDets detections numbered 1..numDets. They are renumbered after the
+        detections so far, as loadRes of all the results in update() order would.
+        """
+        # new arrays, merge() passes results that share them with the caller's state
+        packed.dt_ids = packed.dt_ids + self._numDets
+        packed.gt_matches = np.where(packed.gt_matches > 0, packed.gt_matches + self._numDets, 0)
+        self._numDets += numDets
+        self._parts.append(packed)
+        if len(self._parts) >= CHUNK_IMAGES:
+            self._chunks.append(PackedEvalImgs.concatenate(self._parts))
+            self._parts = []
+
+    def _packed(self) -> PackedEvalImgs:
+        """The results of all the images updated or merged so far, in one PackedEvalImgs."""
+        packed = PackedEvalImgs.concatenate(
+            self._chunks + self._parts, len(self._paramsEval.iouThrs)
+        )
+        self._chunks, self._parts = [packed], []
+        return packed
+
+    def state(self) -> EvalState:
+        """The results of the images updated and merged so far, see COCOeval.state()."""
+        self._start()
+        p = self._paramsEval
+        return EvalState.from_packed(
+            _stateParams(p), self._packed(), p.imgIds, sorted(self._updated)
+        )
+
+    def merge(self, state: EvalState):
+        """
+        Add the results of the state() of another evaluator (or COCOeval), with the same params
+        and none of the images updated here
+        :return: None
+        """
+        self._start()
+        p = self._paramsEval
+        if state.fingerprint != EvalState(_stateParams(p), [], state.evalImgs).fingerprint:
+            raise ValueError("Cannot merge the results of an evaluation with other params")
+        imgIds = set(state.imgIds.tolist())
+        if not imgIds.isdisjoint(self._updated):
+            raise ValueError("Cannot merge the results of images that were already evaluated")
+        packed = state.packed(p.imgIds)
+        # the state numbers its detections from 1 (those past maxDets are not in the results)
+        numDets = int(packed.dt_ids.max()) if len(packed.dt_ids) else 0
+        self._addResults(packed, numDets)
+        self._updated |= imgIds
+
+    def compute(self):
+        """
+        accumulate() and summarize() the results of all the updated and merged images. The
+        images of params.imgIds that were never updated count as images without detections.
+        :return: self.stats_dict
+        """
+        self._start()
+        p = self.params
+        parts = [self._packed()]
+        missing = [imgId for imgId in p.imgIds if imgId not in self._updated]
+        if missing:
+            # only their ground truth, the evaluator can take more updates afterwards
+            self.cocoDt = self._results.reset()
+            self._gts = self._prepareGts(missing)
+            self._dts = defaultdict(list)
+            parts.append(self._evaluateImages(missing)[1])
+            self._gts, self.ious = defaultdict(list), {}
+        self._setEvalImgsPacked(PackedEvalImgs.concatenate(parts).sorted())
+        self.accumulate()
+        self.summarize()
+        return self.stats_dict
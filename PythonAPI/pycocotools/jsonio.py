@@ -0,0 +1,80 @@
+"""
+Selectable JSON backends for reading annotation files.
+
+    json      - the standard library
+    simdjson  - pysimdjson, if it is installed
+    gason     - the bundled gason parser (common/gason.cpp), built as pycocotools._gason. Parses
+                in C++ with the GIL released; for COCO(columnar=True) it also fills the annotation
+                columns directly, without building a dict per annotation.
+
+The default backend is simdjson if available and json otherwise, same as before backends were
+selectable. gason produces the same values and int / float types as json, but accepts a few
+malformed documents json rejects and doesn't support NaN / Infinity literals.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    from . import _gason
+except ImportError:
+    _gason = None
+
+from .columnar import AnnotationColumns, AnnotationSequence
+
+__all__ = ["BACKENDS", "available_backends", "default_backend", "load", "load_columnar"]
+
+BACKENDS = ("json", "simdjson", "gason")
+
+
+def available_backends() -> List[str]:
+    modules = {"json": json, "simdjson": simdjson, "gason": _gason}
+    return [name for name in BACKENDS if modules[name] is not None]
+
+
+def default_backend() -> str:
+    return "simdjson" if simdjson is not None else "json"
+
+
+def _check(backend: Optional[str]) -> str:
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend '{backend}', expected one of {BACKENDS}")
+    if backend not in available_backends():
+        raise ImportError(f"JSON backend '{backend}' is not available")
+    return backend
+
+
+def load(path: Union[str, Path], backend: Optional[str] = None) -> Any:
+    """
+    Parse a JSON file.
+
+    :param backend: one of BACKENDS, default_backend() if None
+    """
+    backend = _check(backend)
+    if backend == "gason":
+        return _gason.load(str(path))
+    if backend == "simdjson":
+        with open(path, "rb") as f:
+            return simdjson.load(f)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_columnar(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Parse a COCO annotation file with gason, storing the annotations in AnnotationColumns filled
+    in C++. dataset["annotations"] is an AnnotationSequence over them, which COCO(columnar=True)
+    indexes as is.
+    """
+    _check("gason")
+    dataset, columns = _gason.load_columnar(str(path))
+    if columns is not None:
+        dataset["annotations"] = AnnotationSequence(AnnotationColumns(**columns))
+    return dataset
@@ -1,5 +1,10 @@
 __author__ = 'tsungyi'
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
 import pycocotools._mask as _mask
 
 # Interface for manipulating masks stored in RLE format.
@@ -27,34 +32,89 @@ import pycocotools._mask as _mask
 # of the object. Computing these operations on the original mask is O(n).
 # Thus, using the RLE can result in substantial computational savings.
 #
+# The RLEs are either dicts with the compressed counts string, the format of
+# the annotation files, or RLEMask objects holding the counts array in C. All
+# functions accept both. Functions that create RLEs return dicts, or RLEMask
+# objects with rleMask=True. Repeated operations on RLEMask objects skip the
+# parsing of the counts string, so convert once (RLEMask(R) / dict(R)) when
+# the same masks are used many times.
+#
 # The following API functions are defined:
 #  encode         - Encode binary masks using RLE.
 #  decode         - Decode binary masks encoded via RLE.
 #  merge          - Compute union or intersection of encoded masks.
 #  iou            - Compute intersection over union between masks.
+#  RLEMask        - Encoded mask with the counts in C, converts from / to dict.
+#  iouBatch       - Compute iou for many groups of masks in a single call.
+#  frPyObjectsBatch, decodeBatch - frPyObjects and decode of many objects.
+#  decodeInto     - Decode encoded masks into a preallocated array or label map.
+#  nms            - Non-maximum suppression of boxes or encoded masks.
+#  batchedNms     - Non-maximum suppression of every class separately.
 #  area           - Compute area of encoded masks.
 #  toBbox         - Get bounding boxes surrounding encoded masks.
 #  frPyObjects    - Convert polygon, bbox, and uncompressed RLE to encoded RLE mask.
+#  xor, difference - Compute xor or difference of encoded masks.
+#  translate, crop, pad, resize - Geometric transforms of encoded masks.
+#  moments, centroid, projections - Statistics of encoded masks.
+#  toPolygons     - Get the boundaries of an encoded mask as polygons.
 #
 # Usage:
-#  Rs     = encode( masks )
+#  Rs     = encode( masks, rleMask=False )
 #  masks  = decode( Rs )
-#  R      = merge( Rs, intersect=false )
+#  R      = merge( Rs, intersect=false, rleMask=False )
 #  o      = iou( dt, gt, iscrowd )
 #  a      = area( Rs )
 #  bbs    = toBbox( Rs )
-#  Rs     = frPyObjects( [pyObjects], h, w )
+#  Rs     = frPyObjects( [pyObjects], h, w, rleMask=False )
+#  R      = RLEMask( R ), R = dict( R )
+#  os     = iouBatch( dt, gt, iscrowd, dtSplits, gtSplits, num_threads=1 )
+#  Rss    = frPyObjectsBatch( [pyObjects], h, w, num_threads=1 )
+#  maskss = decodeBatch( [Rs], num_threads=1 )
+#  out    = decodeInto( Rs, out, boxes=None, labels=None, num_threads=1 )
+#  inds   = nms( dt, thr, scores=None )
+#  inds   = batchedNms( dt, thr, scores, classes )
+#  R      = xor( Rs, rleMask=False ), R = difference( Rs, rleMask=False )
+#  Rs     = translate( Rs, dx, dy, rleMask=False )
+#  Rs     = crop( Rs, bbox, rleMask=False )
+#  Rs     = pad( Rs, left, top, right, bottom, rleMask=False )
+#  Rs     = resize( Rs, h, w, rleMask=False )
+#  mos    = moments( Rs ), cts = centroid( Rs )
+#  prs    = projections( Rs )
+#  polys  = toPolygons( R, holes=False )
 #
 # In the API the following formats are used:
-#  Rs      - [dict] Run-length encoding of binary masks
-#  R       - dict Run-length encoding of binary mask
+#  Rs      - [dict] or [RLEMask] Run-length encoding of binary masks
+#  R       - dict or RLEMask Run-length encoding of binary mask
 #  masks   - [hxwxn] Binary mask(s) (must have type np.ndarray(dtype=uint8) in column-major order)
 #  iscrowd - [nx1] list of np.ndarray. 1 indicates corresponding gt image has crowd region to ignore
 #  bbs     - [nx4] Bounding box(es) stored as [x y w h]
 #  poly    - Polygon stored as [[x1 y1 x2 y2...],[x1 y1 ...],...] (2D list)
 #  dt,gt   - May be either bounding boxes or encoded masks
+#  dtSplits,gtSplits - [B+1] Offsets of B groups in dt and gt,
+#            group b is dt[dtSplits[b]:dtSplits[b+1]]
+#  num_threads - Number of threads of the batch functions, 0 for one per CPU
+#  scores  - [n] Detection scores, nms keeps the highest scoring of overlapping detections
+#  inds    - [k] Indices of the kept detections, by decreasing score
+#  bbox    - [x y w h] Crop window, may extend outside the masks (padding with zeros)
+#  mos     - [nx6] Moments m00 m10 m01 m20 m11 m02 (x: column, y: row), m00 is the area
+#  cts     - [nx2] Centroids [x y], the mean column and row of the pixels, nan for empty masks
+#  prs     - [n] (rows, cols) Number of pixels in each of the h rows and w columns
+#  polys   - [poly] Pixel edge boundaries (vertex on pixel corners, frPyObjects(polys) == R)
+#  out     - [nxHxW] Masks, mask i in out[i], or [HxW] label map with mask i set to labels[i]
+#            (default i+1), C-contiguous of any 1, 2 or 4 byte integer type. Each mask is sampled
+#            (nearest pixel) on the HxW grid from its box boxes[i] = [x y w h] if given, else from
+#            the whole mask: boxes=toBbox(Rs) crops masks to their bounding boxes, and H, W
+#            smaller than the image size downsample.
 # Both poly and bbs are 0-indexed (bbox=[0 0 1 1] encloses first pixel).
 #
+# The functions above from xor on work on the RLE directly, in time linear in
+# its length (plus the mask width), and never decode the mask. Resizing and
+# the crops of decodeInto sample the nearest pixel.
+#
+# The C code runs with the GIL released, so the batch functions (and
+# any of the functions above called from several threads) scale across
+# cores, apart from the conversion of the Python objects.
+#
 # Finally, a note about the intersection over union (iou) computation.
 # The standard iou of a ground truth (gt) and detected (dt) object is
 #  iou(gt,dt) = area(intersect(gt,dt)) / area(union(gt,dt))
@@ -73,16 +133,17 @@ import pycocotools._mask as _mask
 # Code written by Piotr Dollar and Tsung-Yi Lin, 2015.
 # Licensed under the Simplified BSD License [see coco/license.txt]
 
+RLEMask     = _mask.RLEMask
 iou         = _mask.iou
 merge       = _mask.merge
 frPyObjects = _mask.frPyObjects
 
-def encode(bimask):
+def encode(bimask, rleMask=False):
     if len(bimask.shape) == 3:
-        return _mask.encode(bimask)
+        return _mask.encode(bimask, rleMask)
     elif len(bimask.shape) == 2:
         h, w = bimask.shape
-        return _mask.encode(bimask.reshape((h, w, 1), order='F'))[0]
+        return _mask.encode(bimask.reshape((h, w, 1), order='F'), rleMask)[0]
 
 def decode(rleObjs):
     if type(rleObjs) == list:
@@ -100,4 +161,139 @@ def toBbox(rleObjs):
     if type(rleObjs) == list:
         return _mask.toBbox(rleObjs)
     else:
-        return _mask.toBbox([rleObjs])[0]
\ No newline at end of file
+        return _mask.toBbox([rleObjs])[0]
+
+def _single(fn, rleObjs, *args):
+    # fn of a list of RLEs, or of a single RLE
+    if type(rleObjs) == list:
+        return fn(rleObjs, *args)
+    else:
+        return fn([rleObjs], *args)[0]
+
+def xor(rleObjs, rleMask=False):
+    # pixels set in an odd number of the masks
+    return _mask.merge(rleObjs, 2, rleMask)
+
+def difference(rleObjs, rleMask=False):
+    # pixels of the first mask not set in any of the others
+    return _mask.merge(rleObjs, 3, rleMask)
+
+def translate(rleObjs, dx, dy, rleMask=False):
+    return _single(lambda Rs: _mask.shift(Rs, dx, dy, rleMask=rleMask), rleObjs)
+
+def crop(rleObjs, bbox, rleMask=False):
+    x, y, w, h = (int(v) for v in bbox)
+    return _single(lambda Rs: _mask.shift(Rs, -x, -y, h, w, rleMask=rleMask), rleObjs)
+
+def pad(rleObjs, left, top, right, bottom, rleMask=False):
+    # negative padding crops
+    return _single(lambda Rs: _mask.shift(Rs, left, top, dh=top + bottom, dw=left + right,
+                                          rleMask=rleMask), rleObjs)
+
+def resize(rleObjs, h, w, rleMask=False):
+    return _single(lambda Rs: _mask.resize(Rs, h, w, rleMask), rleObjs)
+
+def moments(rleObjs):
+    return _single(_mask.moments, rleObjs)
+
+def centroid(rleObjs):
+    mo = np.atleast_2d(moments(rleObjs))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cts = mo[:, 1:3] / mo[:, :1]
+    return cts if type(rleObjs) == list else cts[0]
+
+def projections(rleObjs):
+    return _single(_mask.projections, rleObjs)
+
+def toPolygons(rleObj, holes=False):
+    # outer boundaries as COCO polygons [x1,y1,x2,y2,...], and with holes=True
+    # (outer, holes) with the holes' boundaries too
+    outer, inner = [], []
+    for xy in _mask.toPoly([rleObj])[0]:
+        x, y = xy[:, 0], xy[:, 1]
+        area = np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)
+        (outer if area > 0 else inner).append(xy.ravel().tolist())
+    return (outer, inner) if holes else outer
+
+def _threadMap(fn, n, num_threads, cost=None):
+    # fn(i0, i1) over contiguous ranges of range(n) on num_threads threads, concatenated.
+    # A few ranges per thread, of about the same total cost, even out items of different cost.
+    num_threads = min(num_threads if num_threads > 0 else os.cpu_count() or 1, n)
+    if num_threads <= 1:
+        return fn(0, n)
+    cost = np.cumsum(np.ones(n) if cost is None else np.asarray(cost, dtype=np.double) + 1)
+    bounds = np.searchsorted(cost, cost[-1] * np.arange(1, 4 * num_threads) / (4 * num_threads))
+    bounds = np.unique(np.concatenate([[0], bounds, [n]]))
+    with ThreadPoolExecutor(num_threads) as pool:
+        results = pool.map(fn, bounds[:-1], bounds[1:])
+        return [o for result in results for o in result]
+
+def iouBatch(dt, gt, iscrowd, dtSplits, gtSplits, num_threads=1):
+    # iou of every group, [] for the groups without a dt or a gt (same as iou)
+    dtSplits = np.asarray(dtSplits, dtype=np.int64)
+    gtSplits = np.asarray(gtSplits, dtype=np.int64)
+    iscrowd = np.asarray(iscrowd, dtype=np.uint8)
+    m, n = np.diff(dtSplits), np.diff(gtSplits)
+    def _iouBatch(b0, b1):
+        d0, d1, g0, g1 = dtSplits[b0], dtSplits[b1], gtSplits[b0], gtSplits[b1]
+        ious, offsets = _mask.iouBatch(dt[d0:d1], gt[g0:g1], iscrowd[g0:g1],
+                                       dtSplits[b0:b1+1] - d0, gtSplits[b0:b1+1] - g0)
+        # python ints, indexing with numpy scalars is slow for many small groups
+        offsets, ms, ns = offsets.tolist(), m[b0:b1].tolist(), n[b0:b1].tolist()
+        return [ious[offsets[b]:offsets[b+1]].reshape((ms[b], ns[b]), order='F')
+                if ms[b] and ns[b] else [] for b in range(b1 - b0)]
+    return _threadMap(_iouBatch, len(m), num_threads, m * n)
+
+def frPyObjectsBatch(pyobjs, h, w, num_threads=1, rleMask=False):
+    # frPyObjects(pyobjs[i], h[i], w[i]) of every object, h and w may also be the same for all
+    hs = np.broadcast_to(h, (len(pyobjs),))
+    ws = np.broadcast_to(w, (len(pyobjs),))
+    def _frPyObjects(i0, i1):
+        return [frPyObjects(pyobjs[i], int(hs[i]), int(ws[i]), rleMask) for i in range(i0, i1)]
+    return _threadMap(_frPyObjects, len(pyobjs), num_threads)
+
+def decodeBatch(rleObjs, num_threads=1):
+    # decode(rleObjs[i]) of every RLE or list of RLEs
+    def _decode(i0, i1):
+        return [decode(rleObjs[i]) for i in range(i0, i1)]
+    return _threadMap(_decode, len(rleObjs), num_threads)
+
+def decodeInto(rleObjs, out, boxes=None, labels=None, num_threads=1):
+    # decode into out, which is fully overwritten and returned. A single RLE gives a
+    # label map or [1xHxW] masks.
+    if type(rleObjs) != list:
+        rleObjs = [rleObjs]
+    if out.ndim == 2 or num_threads == 1:
+        return _mask.decodeInto(rleObjs, out, boxes, labels)
+    boxes = None if boxes is None else np.asarray(boxes, dtype=np.double).reshape((-1, 4))
+    labels = None if labels is None else np.asarray(labels, dtype=np.uint32).reshape(-1)
+    def _decodeInto(i0, i1):
+        _mask.decodeInto(rleObjs[i0:i1], out[i0:i1], None if boxes is None else boxes[i0:i1],
+                         None if labels is None else labels[i0:i1])
+        return []
+    _threadMap(_decodeInto, len(rleObjs), num_threads)
+    return out
+
+def _take(dt, inds):
+    if type(dt) == list and len(dt) > 0 and isinstance(dt[0], (dict, RLEMask)):
+        return [dt[i] for i in inds]
+    return np.asarray(dt, dtype=np.double).reshape((-1, 4))[inds]
+
+def nms(dt, thr, scores=None):
+    # greedy nms: a detection is dropped if its iou with a kept higher scoring one is > thr.
+    # Without scores dt is taken to be sorted by decreasing score.
+    if scores is None:
+        return np.flatnonzero(_mask.nms(dt, thr))
+    order = np.argsort(-np.asarray(scores, dtype=np.double), kind='mergesort')
+    return order[_mask.nms(_take(dt, order), thr)]
+
+def batchedNms(dt, thr, scores, classes):
+    # nms of the detections of every class separately, detections of different classes
+    # don't suppress each other
+    order = np.argsort(-np.asarray(scores, dtype=np.double), kind='mergesort')
+    classes = np.asarray(classes)[order]
+    keep = np.zeros(len(order), dtype=bool)
+    for c in np.unique(classes):
+        inds = np.flatnonzero(classes == c)
+        keep[inds[_mask.nms(_take(dt, order[inds]), thr)]] = True
+    return order[keep]
@@ -0,0 +1,276 @@
+"""
+Vectorized getAnnIds / getImgIds query engine.
+
+AnnotationQuery keeps a few flat arrays per annotation (id, image_id, category_id, area, iscrowd)
+and precomputes sorted, CSR-style groupings over them:
+
+    image    -> annotation rows    (img_keys, img_offsets, img_rows)
+    category -> annotation rows    (cat_keys, cat_offsets, cat_rows)
+    category -> distinct image ids (cat_keys, cat_img_offsets, cat_img_ids)
+    ann id   -> row                (sorted_ids, id_order)
+
+so that every filter combination accepted by COCO.getAnnIds and COCO.getImgIds can be answered
+with searchsorted / isin / counting over those arrays instead of Python comprehensions. Results
+are in the same order the original list comprehensions produce.
+"""
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+__all__ = ["AnnotationQuery", "group_rows"]
+
+
+def group_rows(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Group row indices by key.
+
+    :return: (uniq, first, order, offsets) where uniq are the sorted distinct keys, first is the
+        first row each key appears in, order lists the rows grouped by key (stable, so rows keep
+        their dataset order inside a group) and offsets[j]:offsets[j+1] is the slice of order that
+        belongs to uniq[j].
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    if len(sorted_keys):
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    else:
+        starts = np.zeros((0,), dtype=np.int64)
+    uniq = sorted_keys[starts]
+    first = order[starts]
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return uniq, first, order, offsets
+
+
+def _expand(order: np.ndarray, starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+    """Concatenate order[s:s+n] for every (s, n) without a python loop."""
+    total = int(lens.sum())
+    if total == 0:
+        return np.zeros((0,), dtype=order.dtype)
+    shift = np.repeat(starts - np.cumsum(np.r_[0, lens[:-1]]), lens)
+    return order[np.arange(total) + shift]
+
+
+def _lookup(keys: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+    """Positions in the sorted keys array of those wanted values that are present."""
+    if len(keys) == 0 or len(wanted) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return pos[keys[pos] == wanted]
+
+
+def _as_ids(ids) -> np.ndarray:
+    return np.asarray(ids, dtype=np.int64).reshape(-1)
+
+
+class AnnotationQuery:
+    """
+    Sorted index arrays over a set of annotations, plus the filters of COCO.getAnnIds and
+    COCO.getImgIds implemented on top of them.
+    """
+
+    # precomputed arrays, see index_arrays()
+    INDEX_ARRAYS = (
+        "id_order",
+        "sorted_ids",
+        "img_keys",
+        "img_rows",
+        "img_offsets",
+        "img_key_order",
+        "cat_keys",
+        "cat_rows",
+        "cat_offsets",
+        "cat_key_order",
+        "cat_img_ids",
+        "cat_img_offsets",
+    )
+
+    def __init__(
+        self,
+        ann_id: np.ndarray,
+        image_id: np.ndarray,
+        category_id: np.ndarray,
+        area: np.ndarray,
+        iscrowd: np.ndarray,
+        index_arrays: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        """
+        :param index_arrays: the output of index_arrays() of a previous AnnotationQuery over the
+            same annotations (e.g. loaded from a snapshot), to skip the sorting.
+        """
+        self.ann_id = ann_id
+        self.image_id = image_id
+        self.category_id = category_id
+        self.area = area
+        self.iscrowd = iscrowd
+        if index_arrays is not None:
+            for name in self.INDEX_ARRAYS:
+                setattr(self, name, index_arrays[name])
+            return
+
+        # id -> row lookup. The sort is stable, so for duplicated ids the right-most match is the
+        # last annotation, same as the dict index where later annotations overwrite earlier ones.
+        self.id_order = np.argsort(ann_id, kind="stable")
+        self.sorted_ids = ann_id[self.id_order]
+
+        self.img_keys, img_first, self.img_rows, self.img_offsets = group_rows(image_id)
+        # keys in order of first appearance, which is the key order of the dict based index
+        self.img_key_order = self.img_keys[np.argsort(img_first, kind="stable")]
+        self.cat_keys, cat_first, self.cat_rows, self.cat_offsets = group_rows(category_id)
+        self.cat_key_order = self.cat_keys[np.argsort(cat_first, kind="stable")]
+
+        # category -> sorted distinct image ids
+        pairs = np.lexsort((image_id, category_id))
+        pair_cat, pair_img = category_id[pairs], image_id[pairs]
+        if len(pairs):
+            keep = np.r_[True, (pair_cat[1:] != pair_cat[:-1]) | (pair_img[1:] != pair_img[:-1])]
+        else:
+            keep = np.zeros((0,), dtype=bool)
+        self.cat_img_ids = pair_img[keep]
+        self.cat_img_offsets = np.searchsorted(pair_cat[keep], self.cat_keys).astype(np.int64)
+        self.cat_img_offsets = np.append(self.cat_img_offsets, len(self.cat_img_ids))
+
+    def index_arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.INDEX_ARRAYS}
+
+    @classmethod
+    def from_annotations(cls, anns: Iterable[Dict[str, Any]]) -> "AnnotationQuery":
+        """
+        Build the index arrays from annotation dicts. Raises TypeError / ValueError / KeyError if
+        the annotations can't be represented (e.g. non integer ids), so the caller can fall back
+        to the dict based code path.
+        """
+        anns = list(anns)
+        n = len(anns)
+        return cls(
+            np.fromiter((ann["id"] for ann in anns), dtype=np.int64, count=n),
+            np.fromiter((ann["image_id"] for ann in anns), dtype=np.int64, count=n),
+            np.fromiter((ann.get("category_id", -1) for ann in anns), dtype=np.int64, count=n),
+            np.fromiter((ann.get("area", np.nan) for ann in anns), dtype=np.float64, count=n),
+            np.fromiter((ann.get("iscrowd", 0) for ann in anns), dtype=np.uint8, count=n),
+        )
+
+    def __len__(self) -> int:
+        return len(self.ann_id)
+
+    # ------------------------------------------------------------------------------------------
+    # id lookups
+    # ------------------------------------------------------------------------------------------
+    def rows(self, ids) -> np.ndarray:
+        """
+        Vectorized annotation id -> row lookup.
+
+        :param ids (int array): annotation ids
+        :return: rows (int64 array)
+        :raises KeyError: if any id is not indexed
+        """
+        ids = _as_ids(ids)
+        if len(ids) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        if len(self.sorted_ids) == 0:
+            raise KeyError(int(ids[0]))
+        pos = np.searchsorted(self.sorted_ids, ids, side="right") - 1
+        bad = (pos < 0) | (self.sorted_ids[np.maximum(pos, 0)] != ids)
+        if bad.any():
+            raise KeyError(int(ids[np.flatnonzero(bad)[0]]))
+        return self.id_order[pos]
+
+    def has_id(self, ann_id) -> bool:
+        try:
+            pos = np.searchsorted(self.sorted_ids, ann_id, side="left")
+        except TypeError:
+            return False
+        return bool(pos < len(self.sorted_ids) and self.sorted_ids[pos] == ann_id)
+
+    # ------------------------------------------------------------------------------------------
+    # groupings
+    # ------------------------------------------------------------------------------------------
+    def rows_for_images(self, img_ids) -> np.ndarray:
+        """Rows of the annotations of the given images, image by image in the given order."""
+        pos = _lookup(self.img_keys, _as_ids(img_ids))
+        starts = self.img_offsets[pos]
+        return _expand(self.img_rows, starts, self.img_offsets[pos + 1] - starts)
+
+    def rows_for_categories(self, cat_ids) -> np.ndarray:
+        """Rows of the annotations of the given categories, in dataset order."""
+        pos = _lookup(self.cat_keys, np.unique(_as_ids(cat_ids)))
+        starts = self.cat_offsets[pos]
+        return np.sort(_expand(self.cat_rows, starts, self.cat_offsets[pos + 1] - starts))
+
+    def images_for_category(self, cat_id) -> np.ndarray:
+        """Sorted distinct ids of the images that have annotations of the given category."""
+        pos = _lookup(self.cat_keys, _as_ids([cat_id]))
+        if len(pos) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        return self.cat_img_ids[self.cat_img_offsets[pos[0]] : self.cat_img_offsets[pos[0] + 1]]
+
+    # ------------------------------------------------------------------------------------------
+    # getAnnIds / getImgIds
+    # ------------------------------------------------------------------------------------------
+    def select(
+        self,
+        imgIds=(),
+        catIds=(),
+        areaRng=(),
+        iscrowd: Optional[bool] = None,
+        annIds: Optional[Iterable[int]] = None,
+    ) -> np.ndarray:
+        """
+        Rows of the annotations that pass the COCO.getAnnIds filters, in the order getAnnIds lists
+        them.
+        """
+        cat_filter = len(catIds) > 0
+        if len(imgIds):
+            rows = self.rows_for_images(imgIds)
+        elif cat_filter:
+            # only touch the annotations of the requested categories
+            rows = self.rows_for_categories(catIds)
+            cat_filter = False
+        else:
+            rows = np.arange(len(self), dtype=np.int64)
+        mask = None
+        if cat_filter:
+            mask = np.isin(self.category_id[rows], _as_ids(catIds))
+        if len(areaRng):
+            area = self.area[rows]
+            m = (area > areaRng[0]) & (area < areaRng[1])
+            mask = m if mask is None else mask & m
+        if annIds is not None:
+            m = np.isin(self.ann_id[rows], np.fromiter(annIds, dtype=np.int64))
+            mask = m if mask is None else mask & m
+        if iscrowd is not None:
+            m = self.iscrowd[rows] == iscrowd
+            mask = m if mask is None else mask & m
+        return rows if mask is None else rows[mask]
+
+    def ann_ids(self, **filters) -> list:
+        return self.ann_id[self.select(**filters)].tolist()
+
+    def img_ids(
+        self, imgIds=(), catIds=(), refImgIds: Optional[Iterable[int]] = None
+    ) -> np.ndarray:
+        """
+        Sorted ids of the images that pass the COCO.getImgIds filters (imgIds restricts the
+        result, each of catIds has to be present in the image, refImgIds intersects with the
+        images of the given refs). At least one filter has to be given.
+        """
+        ids = np.unique(_as_ids(imgIds)) if len(imgIds) else None
+        cat_ids = np.unique(_as_ids(catIds))
+        if len(cat_ids):
+            pos = _lookup(self.cat_keys, cat_ids)
+            if len(pos) < len(cat_ids):
+                # an unknown category has no images, so the intersection is empty
+                cand = np.zeros((0,), dtype=np.int64)
+            else:
+                starts = self.cat_img_offsets[pos]
+                lens = self.cat_img_offsets[pos + 1] - starts
+                # images that show up in every one of the (distinct) category lists
+                cand, counts = np.unique(
+                    _expand(self.cat_img_ids, starts, lens), return_counts=True
+                )
+                cand = cand[counts == len(cat_ids)]
+            ids = cand if ids is None else np.intersect1d(ids, cand, assume_unique=True)
+        if refImgIds is not None:
+            ref_imgs = np.unique(np.fromiter(refImgIds, dtype=np.int64))
+            ids = ref_imgs if ids is None or len(ids) == 0 else np.intersect1d(ids, ref_imgs)
+        return np.zeros((0,), dtype=np.int64) if ids is None else ids
@@ -313,17 +313,19 @@ class REFER:
         # return mask, area and mask-center
         ann = self.refToAnn[ref["ref_id"]]
         image = self.Imgs[ref["image_id"]]
-        if type(ann["segmentation"][0]) == list:  # polygon
-            rle = mask.frPyObjects(ann["segmentation"], image["height"], image["width"])
+        segm = ann["segmentation"]
+        if type(segm) == list:  # polygon
+            rles = mask.frPyObjects(segm, image["height"], image["width"])
+        elif type(segm["counts"]) == list:  # uncompressed RLE
+            rles = [mask.frPyObjects(segm, image["height"], image["width"])]
         else:
-            rle = ann["segmentation"]
+            rles = [segm]
+        # sometimes there are multiple binary map (corresponding to multiple segs),
+        # merge (union) them before decoding
+        rle = mask.merge(rles)
         m = mask.decode(rle)
-        m = np.sum(
-            m, axis=2
-        )  # sometimes there are multiple binary map (corresponding to multiple segs)
-        m = m.astype(np.uint8)  # convert to np.uint8
         # compute area
-        area = sum(mask.area(rle))  # should be close to ann['area']
+        area = float(mask.area(rle))  # should be close to ann['area']
         return {"mask": m, "area": area}
         # # position
         # position_x = np.mean(np.where(m==1)[1]) # [1] means columns (matlab style) -> x (c style)
@@ -0,0 +1,203 @@
+"""
+Memoized annotation -> RLE conversion for COCO.annToRLE.
+
+Converting a polygon annotation to RLE (frPyObjects + merge) costs far more than any operation on
+the RLE afterwards, and segm evaluation, mask loading in data loaders etc. convert the same
+annotations over and over. COCO keeps the converted masks (mask.RLEMask) in an RLECache keyed by
+annotation id:
+
+    * bounded by the size of the RLE counts it holds, least recently used masks are evicted first
+    * filled lazily by annToRLE, or in bulk (and in parallel) by COCO.precompute_rles
+    * persisted next to the annotation file (instances.json -> instances.rles.npz) by
+      COCO.save_rles and loaded by COCO(annotation_file) while the annotation file is unchanged.
+      Loaded masks are only materialized when they are first used.
+"""
+
+import json
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+from .mask import RLEMask
+
+__all__ = ["DEFAULT_MAX_BYTES", "RLECache", "file_stamp", "sidecar_path", "write_rles"]
+
+DEFAULT_MAX_BYTES = 1 << 30
+RLE_CACHE_VERSION = 1
+# bytes accounted per cached mask on top of its counts (object, dict entry)
+_ENTRY_OVERHEAD = 128
+
+PathLike = Union[str, Path]
+
+
+def sidecar_path(annotation_file: PathLike) -> Path:
+    """The file COCO.save_rles writes the masks of annotation_file to."""
+    path = Path(annotation_file)
+    return path.with_name(path.stem + ".rles.npz")
+
+
+def file_stamp(annotation_file: PathLike) -> Dict[str, Any]:
+    """Size and mtime of annotation_file, a persisted cache is only loaded while they match."""
+    st = os.stat(annotation_file)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def write_rles(
+    path: PathLike, entries: Iterable[Tuple[Any, RLEMask]], stamp: Optional[Dict[str, Any]] = None
+) -> Path:
+    """
+    Write (ann_id, mask) entries to path (an .npz file) for RLECache.load. Entries without an
+    integer id are skipped.
+
+    :param stamp: file_stamp() of the annotation file, checked by RLECache.load
+    """
+    entries = sorted(
+        ((int(ann_id), rle) for ann_id, rle in entries if isinstance(ann_id, (int, np.integer))),
+        key=lambda entry: entry[0],
+    )
+    counts = [np.asarray(rle) for _, rle in entries]
+    offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in counts], out=offsets[1:])
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            ids=np.array([ann_id for ann_id, _ in entries], dtype=np.int64),
+            sizes=np.array([rle.size for _, rle in entries], dtype=np.int64).reshape(-1, 2),
+            offsets=offsets,
+            counts=np.concatenate(counts) if counts else np.zeros(0, np.uint32),
+            meta=np.array(json.dumps({"version": RLE_CACHE_VERSION, "stamp": stamp})),
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def _nbytes(rle: RLEMask) -> int:
+    return memoryview(rle).nbytes + _ENTRY_OVERHEAD
+
+
+class RLECache:
+    """
+    Thread-safe LRU cache of annotation id -> RLEMask, bounded by max_bytes (None for unbounded,
+    0 disables caching). Masks loaded from a persisted cache stay packed in arrays until they are
+    first used and don't count towards max_bytes.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._rles: "OrderedDict[Any, RLEMask]" = OrderedDict()
+        self._nbytes = 0
+        # persisted masks: sorted ids, [N, 2] sizes, [N+1] offsets into counts
+        self._packed: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rles)
+
+    def __contains__(self, ann_id) -> bool:
+        return ann_id in self._rles or self._packed_row(ann_id) is not None
+
+    @property
+    def nbytes(self) -> int:
+        """Accounted size of the cached masks, without the persisted ones not used yet."""
+        return self._nbytes
+
+    def get(self, ann_id) -> Optional[RLEMask]:
+        with self._lock:
+            rle = self._rles.get(ann_id)
+            if rle is not None:
+                self._rles.move_to_end(ann_id)
+                return rle
+        row = self._packed_row(ann_id)
+        if row is None:
+            return None
+        rle = self._unpack(row)
+        self.put(ann_id, rle)
+        return rle
+
+    def put(self, ann_id, rle: RLEMask) -> None:
+        nbytes = _nbytes(rle)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._rles.pop(ann_id, None)
+            if old is not None:
+                self._nbytes -= _nbytes(old)
+            self._rles[ann_id] = rle
+            self._nbytes += nbytes
+            while self.max_bytes is not None and self._nbytes > self.max_bytes:
+                _, evicted = self._rles.popitem(last=False)
+                self._nbytes -= _nbytes(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rles.clear()
+            self._nbytes = 0
+            self._packed = None
+
+    def _packed_row(self, ann_id) -> Optional[int]:
+        if self._packed is None or not isinstance(ann_id, (int, np.integer)):
+            return None
+        ids = self._packed[0]
+        row = int(np.searchsorted(ids, ann_id))
+        return row if row < len(ids) and ids[row] == ann_id else None
+
+    def _unpack(self, row: int) -> RLEMask:
+        _, sizes, offsets, counts = self._packed
+        return RLEMask(
+            {"size": sizes[row].tolist(), "counts": counts[offsets[row] : offsets[row + 1]]}
+        )
+
+    def items(self) -> Iterable[Tuple[Any, RLEMask]]:
+        """(ann_id, mask) of every cached and persisted mask, materializing the persisted ones."""
+        with self._lock:
+            cached = list(self._rles.items())
+        seen = {ann_id for ann_id, _ in cached}
+        yield from cached
+        if self._packed is not None:
+            for row, ann_id in enumerate(self._packed[0].tolist()):
+                if ann_id not in seen:
+                    yield ann_id, self._unpack(row)
+
+    def save(self, path: PathLike, stamp: Optional[Dict[str, Any]] = None) -> Path:
+        """
+        Write every cached and persisted mask with an integer id to path (see write_rles).
+        """
+        return write_rles(path, self.items(), stamp)
+
+    def load(self, path: PathLike, stamp: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Add the masks persisted in path. Nothing is loaded if the file is missing, unreadable, or
+        was saved with a different stamp.
+
+        :return: whether the masks were loaded
+        """
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                meta = json.loads(str(f["meta"]))
+                if meta.get("version") != RLE_CACHE_VERSION or meta.get("stamp") != stamp:
+                    return False
+                packed = (f["ids"], f["sizes"], f["offsets"], f["counts"])
+        except FileNotFoundError:
+            return False
+        except Exception as ex:  # a corrupt file is just a cache miss
+            warnings.warn(f"Ignoring unreadable RLE cache '{path}': {ex}")
+            return False
+        with self._lock:
+            self._packed = packed
+        return True
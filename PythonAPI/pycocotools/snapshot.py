@@ -0,0 +1,328 @@
+"""
+Binary snapshot cache for parsed annotation files.
+
+Parsing a large annotation JSON and building the COCO index dominates the start up time of every
+training / evaluation process. The first time COCO loads a file it writes a snapshot of the
+parsed dataset and index into a cache directory; later loads of the same, unchanged file read the
+snapshot instead of the JSON.
+
+Snapshots are keyed by the resolved file path, its size, its mtime and a hash of its content.
+Each snapshot is a directory holding:
+
+    manifest.json       - the key fields and the snapshot format
+    meta.json           - the dataset without its "annotations" list
+    annotations.pkl     - (dict backend) the annotations list
+    columns/*.npy       - (columnar backend) AnnotationColumns arrays, memory-mappable
+    index/*.npy         - (columnar backend) AnnotationQuery index arrays, memory-mappable
+    images/*.npy        - (shared backend) ImageColumns arrays, memory-mappable
+
+The shared backend (COCO(shared=True)) is the columnar one with the images packed into arrays as
+well, so that a COCO object attached to it holds almost nothing but memory-mapped arrays.
+
+The cache directory defaults to $PYCOCOTOOLS_CACHE_DIR, or ~/.cache/pycocotools. It is created
+with mode 0700, and snapshots are only written to and read from a cache directory (and snapshot
+directories) owned by the current user and not writable by anyone else: annotations.pkl is a
+pickle. COCO only uses snapshots with cache=True (or shared=True); PYCOCOTOOLS_CACHE=0 disables
+them globally.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from .columnar import AnnotationColumns, AnnotationSequence, ImageColumns, ImageSequence
+
+__all__ = [
+    "cache_enabled",
+    "default_cache_dir",
+    "file_fingerprint",
+    "snapshot_path",
+    "load_snapshot",
+    "save_snapshot",
+    "attach",
+    "invalidate",
+    "clear",
+]
+
+SNAPSHOT_VERSION = 4
+BACKENDS = ("dict", "columnar", "shared")
+_HASH_CHUNK = 1 << 22
+
+PathLike = Union[str, Path]
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("PYCOCOTOOLS_CACHE", "1").lower() not in ("0", "false", "no", "off")
+
+
+def default_cache_dir() -> Path:
+    env = os.environ.get("PYCOCOTOOLS_CACHE_DIR")
+    if env:
+        return Path(env)
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "pycocotools"
+
+
+def _is_private(folder: Path) -> bool:
+    """Whether folder is owned by the current user and not writable by group or others."""
+    if not hasattr(os, "getuid"):
+        # no POSIX ownership (Windows), the ACLs of the user profile apply
+        return True
+    st = folder.stat()
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def _check_private(*folders: Path) -> None:
+    for folder in folders:
+        if not _is_private(folder):
+            raise PermissionError(
+                f"'{folder}' is not a directory of the current user that only it can write to"
+            )
+
+
+def _make_cache_dir(cache_dir: Path) -> None:
+    """Create cache_dir with mode 0700, refuse an existing one that others can write to."""
+    cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    _check_private(cache_dir)
+
+
+def _json_default(obj):
+    # NumPy scalars and arrays of parsers that produce them
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _path_digest(path: Path) -> str:
+    return hashlib.blake2b(str(path).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def file_fingerprint(path: PathLike) -> Dict[str, Any]:
+    """
+    The fields snapshots are keyed by: resolved path, size, mtime and a blake2b hash of the
+    content.
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "content_hash": h.hexdigest(),
+    }
+
+
+def _backend(columnar: bool, shared: bool) -> str:
+    return "shared" if shared else "columnar" if columnar else "dict"
+
+
+def snapshot_path(
+    fingerprint: Dict[str, Any],
+    columnar: bool,
+    cache_dir: Optional[PathLike] = None,
+    shared: bool = False,
+) -> Path:
+    """Directory of the snapshot for the given file fingerprint and backend."""
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+    key = hashlib.blake2b(
+        json.dumps(fingerprint, sort_keys=True).encode("utf-8"), digest_size=16
+    ).hexdigest()
+    stem = Path(fingerprint["path"]).stem
+    backend = _backend(columnar, shared)
+    return cache_dir / f"{stem}.{_path_digest(Path(fingerprint['path']))}.{key}.{backend}"
+
+
+def _load_arrays(folder: Path, mmap: bool) -> Dict[str, np.ndarray]:
+    # plain (read-only) ndarray views of the mappings: np.memmap has a noticeable per-access cost
+    # that adds up when annotation dicts are built element by element
+    return {
+        f.stem: np.asarray(np.load(f, mmap_mode="r" if mmap else None, allow_pickle=False))
+        for f in folder.glob("*.npy")
+    }
+
+
+def load_snapshot(
+    annotation_file: PathLike,
+    columnar: bool = False,
+    cache_dir: Optional[PathLike] = None,
+    mmap: bool = True,
+    fingerprint: Optional[Dict[str, Any]] = None,
+    shared: bool = False,
+) -> Optional[Tuple[Dict[str, Any], Optional[AnnotationColumns]]]:
+    """
+    Load the snapshot of annotation_file, if there is a valid one.
+
+    :param columnar: load the columnar snapshot instead of the dict one
+    :param mmap: memory-map the columnar arrays instead of reading them into memory
+    :param shared: load the shared snapshot (columnar, with images packed as well)
+    :return: (dataset, columns) or None on a cache miss. For columnar snapshots
+        dataset["annotations"] is an AnnotationSequence over columns (and for shared ones
+        dataset["images"] an ImageSequence); for dict snapshots columns is None.
+    """
+    if fingerprint is None:
+        fingerprint = file_fingerprint(annotation_file)
+    folder = snapshot_path(fingerprint, columnar, cache_dir, shared)
+    try:
+        with open(folder / "manifest.json", "r") as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("version") != SNAPSHOT_VERSION
+            or manifest.get("fingerprint") != fingerprint
+        ):
+            return None
+        return _read(folder, manifest["backend"], mmap)
+    except FileNotFoundError:
+        return None
+    except Exception as ex:  # a corrupt snapshot is just a cache miss
+        warnings.warn(f"Ignoring unreadable COCO snapshot '{folder}': {ex}")
+        return None
+
+
+def attach(
+    folder: PathLike, mmap: bool = True
+) -> Tuple[Dict[str, Any], Optional[AnnotationColumns]]:
+    """
+    Load the snapshot in the given directory without checking it against its annotation file.
+    Used to re-attach a COCO object to its shared snapshot in another process.
+
+    :return: (dataset, columns), see load_snapshot
+    """
+    folder = Path(folder)
+    with open(folder / "manifest.json", "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported COCO snapshot version in '{folder}'")
+    return _read(folder, manifest["backend"], mmap)
+
+
+def _read(folder: Path, backend: str, mmap: bool):
+    # a snapshot that someone else could have written is never unpickled
+    _check_private(folder.parent, folder)
+    with open(folder / "meta.json", "r") as f:
+        dataset = json.load(f)
+    if backend == "dict":
+        if (folder / "annotations.pkl").exists():
+            with open(folder / "annotations.pkl", "rb") as f:
+                dataset["annotations"] = pickle.load(f)
+        return dataset, None
+    if backend == "shared" and (folder / "images").exists():
+        dataset["images"] = ImageSequence(ImageColumns(**_load_arrays(folder / "images", mmap)))
+    if not (folder / "columns").exists():
+        return dataset, None
+    columns = AnnotationColumns(
+        index_arrays=_load_arrays(folder / "index", mmap),
+        **_load_arrays(folder / "columns", mmap),
+    )
+    dataset["annotations"] = AnnotationSequence(columns)
+    return dataset, columns
+
+
+def save_snapshot(
+    annotation_file: PathLike,
+    dataset: Dict[str, Any],
+    columns: Optional[AnnotationColumns] = None,
+    cache_dir: Optional[PathLike] = None,
+    fingerprint: Optional[Dict[str, Any]] = None,
+    images: Optional[ImageColumns] = None,
+) -> Path:
+    """
+    Write the snapshot of annotation_file. Older snapshots of the same file are removed.
+
+    :param dataset: the parsed dataset. Its "annotations" entry is only stored if columns is None.
+    :param columns: the columnar annotation store; written instead of dataset["annotations"].
+    :param images: the packed images; written instead of dataset["images"]. Makes this a shared
+        snapshot, which requires columns.
+    :return: the snapshot directory
+    """
+    if fingerprint is None:
+        fingerprint = file_fingerprint(annotation_file)
+    columnar = columns is not None
+    shared = images is not None
+    assert columnar or not shared, "shared snapshots need the annotation columns"
+    backend = _backend(columnar, shared)
+    folder = snapshot_path(fingerprint, columnar, cache_dir, shared)
+    _make_cache_dir(folder.parent)
+    # (mkdtemp creates it with mode 0700)
+    tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=folder.parent))
+    try:
+        skip = ("annotations", "images") if shared else ("annotations",)
+        meta = {k: v for k, v in dataset.items() if k not in skip}
+        with open(tmp / "meta.json", "w") as f:
+            json.dump(meta, f, default=_json_default)
+        if columnar:
+            _save_arrays(tmp / "columns", columns.arrays())
+            _save_arrays(tmp / "index", columns.index.index_arrays())
+        elif "annotations" in dataset:
+            with open(tmp / "annotations.pkl", "wb") as f:
+                pickle.dump(dataset["annotations"], f, protocol=pickle.HIGHEST_PROTOCOL)
+        if shared:
+            _save_arrays(tmp / "images", images.arrays())
+        # manifest goes last: a snapshot without one is never read
+        with open(tmp / "manifest.json", "w") as f:
+            json.dump(
+                {"version": SNAPSHOT_VERSION, "backend": backend, "fingerprint": fingerprint}, f
+            )
+        _remove(Path(fingerprint["path"]), cache_dir, [backend])
+        try:
+            os.rename(tmp, folder)
+        except OSError:
+            # another process wrote the same snapshot first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return folder
+
+
+def _save_arrays(folder: Path, arrays: Dict[str, np.ndarray]) -> None:
+    folder.mkdir()
+    for name, arr in arrays.items():
+        np.save(folder / f"{name}.npy", np.ascontiguousarray(arr))
+
+
+def invalidate(annotation_file: PathLike, cache_dir: Optional[PathLike] = None) -> int:
+    """
+    Remove the snapshots of annotation_file.
+
+    :return: number of snapshots removed
+    """
+    return _remove(Path(annotation_file).resolve(), cache_dir, BACKENDS)
+
+
+def _remove(path: Path, cache_dir: Optional[PathLike], backends) -> int:
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+    if not cache_dir.is_dir():
+        return 0
+    removed = 0
+    for backend in backends:
+        for folder in cache_dir.glob(f"{path.stem}.{_path_digest(path)}.*.{backend}"):
+            shutil.rmtree(folder, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def clear(cache_dir: Optional[PathLike] = None) -> int:
+    """
+    Remove every snapshot in the cache directory.
+
+    :return: number of snapshots removed
+    """
+    cache_dir = Path(cache_dir) if cache_dir is not None else default_cache_dir()
+    if not cache_dir.is_dir():
+        return 0
+    removed = 0
+    for manifest in cache_dir.glob("*/manifest.json"):
+        shutil.rmtree(manifest.parent, ignore_errors=True)
+        removed += 1
+    return removed
@@ -0,0 +1,189 @@
+"""
+Incremental loader for COCO annotation files.
+
+json.load builds the whole document before COCO gets to index it, so the peak memory of loading
+a file is the complete object tree plus whatever the index adds on top. The loader here reads the
+file in chunks and decodes the items of the top level "images", "categories" and "annotations"
+arrays one at a time, handing each to the index as soon as it is decoded:
+
+    * annotations can go straight into a ColumnarBuilder, so at most one annotation dict exists at
+      any time (columnar=True),
+    * unused annotation fields (e.g. "segmentation" for bbox evaluation) can be dropped before the
+      item is stored (drop_fields),
+    * a progress callback is called with the number of bytes read after every chunk.
+
+Only the top level structure is scanned by hand; each item is decoded with the C accelerated
+json.JSONDecoder.raw_decode.
+"""
+
+import codecs
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from .columnar import AnnotationSequence, ColumnarBuilder
+
+__all__ = ["iter_dataset", "load_dataset"]
+
+STREAMED_KEYS = ("images", "categories", "annotations")
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    """Chunked UTF-8 text buffer with the few primitives the top level scanner needs."""
+
+    def __init__(self, f, chunk_size: int, progress: Optional[Callable[[int, int], None]]):
+        self._f = f
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self._progress = progress
+        try:
+            self.total = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError):
+            self.total = -1
+        self.bytes_read = 0
+        self.eof = False
+        self.buf = ""
+        self.pos = 0
+
+    def _fill(self, size: int) -> None:
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        self.eof = not data
+        # drop what has been consumed already
+        self.buf = self.buf[self.pos :] + self._decoder.decode(data, final=self.eof)
+        self.pos = 0
+        if self._progress is not None:
+            self._progress(self.bytes_read, self.total)
+
+    def peek(self) -> str:
+        """Next non-whitespace character without consuming it ('' at the end of the file)."""
+        while True:
+            buf, pos, n = self.buf, self.pos, len(self.buf)
+            while pos < n and buf[pos] in _WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < n or self.eof:
+                return buf[pos] if pos < n else ""
+            self._fill(self._chunk_size)
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", self.buf, self.pos)
+        self.pos += 1
+        return ch
+
+    def value(self) -> Any:
+        """Decode the next JSON value."""
+        first = self.peek()
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # the value continues past the buffer; read more, faster for large values
+                self._fill(size)
+                size *= 2
+                continue
+            if first not in '{["' and not self.eof:
+                # numbers and literals aren't self delimiting: "12" might continue as "123"
+                rest = self.buf[end:]
+                if not rest.strip(_WHITESPACE):
+                    self._fill(size)
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_dataset(
+    f,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    streamed_keys: Iterable[str] = STREAMED_KEYS,
+) -> Iterator[Tuple[str, Any, bool]]:
+    """
+    Parse a COCO style JSON object from a binary file incrementally.
+
+    Yields (key, value, False) for every top level entry. Entries in streamed_keys that hold an
+    array are yielded as (key, [], False) followed by one (key, item, True) per element instead.
+
+    :param f: file opened in binary mode
+    :param progress: called as progress(bytes_read, total_bytes) after every chunk read
+        (total_bytes is -1 if unknown)
+    """
+    streamed_keys = frozenset(streamed_keys)
+    reader = _Reader(f, chunk_size, progress)
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.expect("}")
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", reader.buf, reader.pos)
+        reader.expect(":")
+        if key in streamed_keys and reader.peek() == "[":
+            reader.expect("[")
+            yield key, [], False
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield key, reader.value(), True
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            yield key, reader.value(), False
+        if reader.expect(",}") == "}":
+            break
+    if reader.peek():
+        raise json.JSONDecodeError("Extra data", reader.buf, reader.pos)
+
+
+def load_dataset(
+    annotation_file: Union[str, Path],
+    columnar: bool = False,
+    drop_fields: Optional[Iterable[str]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """
+    Load a COCO annotation file incrementally (see the module docstring).
+
+    :param columnar: feed the annotations into a ColumnarBuilder while parsing. The returned
+        dataset then holds an AnnotationSequence in "annotations", which COCO(columnar=True)
+        indexes without converting it again.
+    :param drop_fields: annotation fields to discard while parsing, e.g. ("segmentation",)
+    :param progress: called as progress(bytes_read, total_bytes) after every chunk read
+    :return: the dataset dict
+    """
+    drop = tuple(drop_fields or ())
+    dataset: Dict[str, Any] = {}
+    builder = ColumnarBuilder() if columnar else None
+    # json.load shares one str object per distinct key across the document; items decoded one by
+    # one don't, so share the keys of the item dicts here
+    keys: Dict[str, str] = {}
+    with open(annotation_file, "rb") as f:
+        for key, value, is_item in iter_dataset(f, chunk_size, progress):
+            if not is_item:
+                dataset[key] = value
+                continue
+            if isinstance(value, dict):
+                if key == "annotations":
+                    for field in drop:
+                        value.pop(field, None)
+                    if builder is not None:
+                        builder.append(value)
+                        continue
+                value = {keys.setdefault(k, k): v for k, v in value.items()}
+            dataset[key].append(value)
+    if builder is not None and isinstance(dataset.get("annotations"), list):
+        dataset["annotations"] = AnnotationSequence(builder.finish())
+    return dataset
@@ -14,12 +14,18 @@ ext_modules = [
         include_dirs=[np.get_include(), "../common"],
         extra_compile_args=["-Wno-cpp", "-Wno-unused-function", "-std=c99"],
     ),
-    # Pybind11Extension(
-    #     "pycocotools._eval",
-    #     sources=["../fastcocoeval/cocoeval.cpp"],
-    #     include_dirs=[np.get_include(), "../fastcocoeval"],
-    #     # extra_compile_args=["-Wno-cpp", "-Wno-unused-function", "-std=c99"],
-    # )
+    Pybind11Extension(
+        "pycocotools._gason",
+        sources=["../common/gason.cpp", "pycocotools/_gason.cpp"],
+        include_dirs=["../common"],
+        cxx_std=14,
+    ),
+    Pybind11Extension(
+        "pycocotools._eval",
+        sources=["../fastcocoeval/cocoeval.cpp", "pycocotools/_eval.cpp"],
+        include_dirs=["../fastcocoeval"],
+        cxx_std=14,
+    ),
 ]
 
 setup(
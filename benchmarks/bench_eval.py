@@ -0,0 +1,115 @@
+"""
+Wall time of COCOeval.evaluate() and accumulate() on a synthetic dataset.
+
+Usage:
+    python benchmarks/bench_eval.py --annotations 100000 --iou-type segm --n-workers 1 8
+    python benchmarks/bench_eval.py --engine python native
+    python benchmarks/bench_eval.py --engine python --matcher loop vectorized --anns-per-image 300
+    python benchmarks/bench_eval.py --iou-type segm --warm-rles
+    python benchmarks/bench_eval.py --categories 600 --evaluation dense sparse
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import time
+
+import numpy as np
+
+from common import make_dataset, make_results
+
+from pycocotools.coco import COCO
+from pycocotools.cocoeval import MATCHERS, COCOeval, Params, _eval
+
+
+def run(gt: COCO, results: list, iou_type: str, matcher: str, warm: bool, **kwargs) -> dict:
+    times = {}
+    if not warm:
+        # every configuration converts the ground truth polygons itself
+        gt.rle_cache.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        dt = gt.loadRes(copy.deepcopy(results))
+        params = Params(iou_type)
+        params.matcher = matcher
+        E = COCOeval(gt, dt, iou_type, params, **kwargs)
+        tic = time.perf_counter()
+        E.evaluate()
+        times["evaluate"] = time.perf_counter() - tic
+        tic = time.perf_counter()
+        E.accumulate()
+        times["accumulate"] = time.perf_counter() - tic
+    times["precision"] = E.eval["precision"]
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--annotations", type=int, default=50_000)
+    parser.add_argument("--anns-per-image", type=int, default=8)
+    parser.add_argument("--categories", type=int, default=80)
+    parser.add_argument("--iou-type", default="bbox", choices=["bbox", "segm"])
+    parser.add_argument("--n-workers", type=int, nargs="+", default=[1])
+    parser.add_argument("--engine", nargs="+", default=["python", "native"])
+    parser.add_argument(
+        "--matcher", nargs="+", default=["vectorized"], choices=list(MATCHERS), help="python engine"
+    )
+    parser.add_argument(
+        "--evaluation",
+        nargs="+",
+        default=["dense"],
+        choices=["dense", "sparse"],
+        help="every (image, category) pair or only those with ground truth or detections",
+    )
+    parser.add_argument(
+        "--warm-rles", action="store_true", help="ground truth RLEs precomputed (COCO.rle_cache)"
+    )
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.annotations, args.anns_per_image, num_cats=args.categories)
+    results = make_results(dataset)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gt = COCO(cache=False)
+        gt.dataset = dataset
+        gt.createIndex()
+    if args.warm_rles and args.iou_type == "segm":
+        tic = time.perf_counter()
+        gt.precompute_rles()
+        print(f"precompute_rles {time.perf_counter() - tic:.2f}s")
+    print(
+        f"{len(dataset['images'])} images, {args.categories} categories, {args.annotations}"
+        f" annotations, {len(results)} detections, iouType {args.iou_type}"
+    )
+
+    engines = [e for e in args.engine if e != "native" or _eval is not None]
+    configs = [
+        (engine, matcher, evaluation, n_workers)
+        for engine in engines
+        for matcher in (args.matcher if engine == "python" else ["-"])
+        for evaluation in args.evaluation
+        for n_workers in args.n_workers
+    ]
+    reference = None
+    for engine, matcher, evaluation, n_workers in configs:
+        res = run(
+            gt,
+            results,
+            args.iou_type,
+            args.matcher[0] if matcher == "-" else matcher,
+            args.warm_rles,
+            n_workers=n_workers,
+            engine=engine,
+            sparse=evaluation == "sparse",
+        )
+        if reference is None:
+            reference = res["precision"]
+        same = np.array_equal(res["precision"], reference)
+        print(
+            f"{engine:>6} | {matcher:>10} | {evaluation:>6} | n_workers {n_workers:>3}"
+            f" | evaluate {res['evaluate']:7.2f}s | accumulate {res['accumulate']:6.2f}s"
+            f" | same precision: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
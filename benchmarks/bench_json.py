@@ -0,0 +1,68 @@
+"""
+Load time of an annotation file with each JSON backend (see pycocotools.jsonio), both for the
+bare parse and for building the COCO index on top of it.
+
+Usage:
+    python benchmarks/bench_json.py --annotations 500000
+    python benchmarks/bench_json.py --ann-file instances_train2017.json
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import tempfile
+import time
+from pathlib import Path
+
+from common import write_dataset
+
+from pycocotools import jsonio
+from pycocotools.coco import COCO
+
+
+def best_of(repeat: int, fn) -> float:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        tic = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - tic)
+        del result
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ann-file", type=Path, default=None, help="default: synthetic dataset")
+    parser.add_argument("--annotations", type=int, default=300_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ann_file = args.ann_file
+        if ann_file is None:
+            ann_file = write_dataset(Path(tmp) / "instances.json", args.annotations)
+        size = ann_file.stat().st_size / 2**20
+        backends = jsonio.available_backends()
+        print(f"{ann_file} ({size:.0f} MB), backends: {', '.join(backends)}")
+
+        runs = {f"parse {b}": (lambda b=b: jsonio.load(ann_file, b)) for b in backends}
+        if "gason" in backends:
+            runs["parse gason columnar"] = lambda: jsonio.load_columnar(ann_file)
+        for backend in backends:
+            for columnar in (False, True):
+                name = f"COCO {backend}{' columnar' if columnar else ''}"
+                runs[name] = lambda b=backend, c=columnar: COCO(
+                    ann_file, cache=False, columnar=c, json_backend=b
+                )
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            results = {name: best_of(args.repeat, fn) for name, fn in runs.items()}
+        del out
+        base = results["parse json"]
+        for name, t in results.items():
+            print(f"{name:>26} | {t:7.3f}s | {base / t:5.2f}x parse json")
+
+
+if __name__ == "__main__":
+    main()
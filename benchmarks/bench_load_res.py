@@ -0,0 +1,87 @@
+"""
+Wall time of COCO.loadRes and COCOeval for the same detections as a list of dicts, as an [N,7]
+array converted to dicts and as an [N,7] array loaded into a columnar result store; and the
+per-checkpoint cost of loading many small result files with loadRes against a reused ResultSet.
+
+Usage:
+    python benchmarks/bench_load_res.py --annotations 200000
+    python benchmarks/bench_load_res.py --checkpoints 50 --checkpoint-dets 500
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import time
+
+import numpy as np
+
+from common import make_dataset, make_results
+
+from pycocotools.coco import COCO, ResultSet
+from pycocotools.cocoeval import COCOeval
+
+
+def timed(fn):
+    tic = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--annotations", type=int, default=100_000)
+    parser.add_argument("--anns-per-image", type=int, default=8)
+    parser.add_argument(
+        "--checkpoints", type=int, default=10, help="result files of the reuse test"
+    )
+    parser.add_argument("--checkpoint-dets", type=int, default=1000, help="detections per file")
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.annotations, args.anns_per_image)
+    results = make_results(dataset)
+    data = np.array(
+        [[r["image_id"], *r["bbox"], r["score"], r["category_id"]] for r in results], np.float64
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        gt = COCO(cache=False)
+        gt.dataset = dataset
+        gt.createIndex()
+    print(f"{len(dataset['images'])} images, {len(results)} detections")
+
+    loaders = {
+        "list of dicts": lambda: gt.loadRes(copy.deepcopy(results)),
+        "array -> dicts": lambda: gt.loadRes(data, columnar=False),
+        "array -> columns": lambda: gt.loadRes(data),
+    }
+    reference = None
+    for name, load in loaders.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            dt, t_load = timed(load)
+            E = COCOeval(gt, dt, "bbox")
+            _, t_prepare = timed(E._prepare)
+            _, t_eval = timed(E.evaluate)
+            E.accumulate()
+        if reference is None:
+            reference = E.eval["precision"]
+        same = np.array_equal(E.eval["precision"], reference)
+        print(
+            f"{name:>16} | loadRes {t_load:6.2f}s | _prepare {t_prepare:6.2f}s"
+            f" | evaluate {t_eval:6.2f}s | same precision: {same}"
+        )
+
+    # many small result files against the same ground truth
+    files = [data[i :: args.checkpoints][: args.checkpoint_dets] for i in range(args.checkpoints)]
+    results = ResultSet(gt)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, t_copy = timed(lambda: [gt.loadRes(f) for f in files])
+        _, t_shared = timed(lambda: [results.load(f) for f in files])
+    print(
+        f"{args.checkpoints} result files of {args.checkpoint_dets} detections"
+        f" | loadRes {t_copy / len(files) * 1000:7.2f}ms"
+        f" | ResultSet.load {t_shared / len(files) * 1000:7.2f}ms per file"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Wall time of the pycocotools.mask batch functions for a number of threads.
+
+Usage:
+    python benchmarks/bench_mask.py --annotations 50000 --num-threads 1 2 4 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from common import make_dataset
+
+from pycocotools import mask as maskUtils
+
+
+def timed(fn):
+    tic = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - tic
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--annotations", type=int, default=20_000)
+    parser.add_argument("--anns-per-image", type=int, default=50)
+    parser.add_argument("--decode", type=int, default=1000, help="masks to decode (300 kB each)")
+    parser.add_argument("--num-threads", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.annotations, args.anns_per_image)
+    anns = sorted(dataset["annotations"], key=lambda ann: ann["image_id"])
+    polys = [ann["segmentation"] for ann in anns]
+    # every image against itself
+    splits = np.searchsorted([ann["image_id"] for ann in anns], range(len(dataset["images"]) + 2))
+    print(f"{len(dataset['images'])} images of 480x640, {len(anns)} polygons")
+
+    reference = None
+    for num_threads in args.num_threads:
+        rles, t_poly = timed(lambda: maskUtils.frPyObjectsBatch(polys, 480, 640, num_threads))
+        rles = [rle[0] for rle in rles]
+        masks, t_decode = timed(lambda: maskUtils.decodeBatch(rles[: args.decode], num_threads))
+        # into a preallocated [n, h, w] buffer, instead of [h, w] arrays to stack
+        out = np.empty((len(masks), 480, 640), np.uint8)
+        _, t_into = timed(
+            lambda: maskUtils.decodeInto(rles[: args.decode], out, None, None, num_threads)
+        )
+        _, t_stack = timed(lambda: np.stack(masks))
+        del masks
+        ious, t_iou = timed(
+            lambda: maskUtils.iouBatch(rles, rles, [0] * len(rles), splits, splits, num_threads)
+        )
+        if reference is None:
+            reference = ious
+        same = all(np.array_equal(a, b) for a, b in zip(ious, reference))
+        print(
+            f"num_threads {num_threads:>3} | frPyObjects {t_poly:6.2f}s | decode {t_decode:6.2f}s"
+            f" + stack {t_stack:6.2f}s | decodeInto {t_into:6.2f}s"
+            f" | iou {t_iou:6.2f}s | same ious: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
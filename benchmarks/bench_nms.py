@@ -0,0 +1,68 @@
+"""
+Wall time of box and mask non-maximum suppression: the O(n^2) loops of maskApi.c (bbNms, rleNms)
+against the sort-and-sweep of mask.nms, on the detections of one image.
+
+Usage:
+    python benchmarks/bench_nms.py --detections 10000 --masks 2000 --thr 0.5 0.7
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from pycocotools import mask as maskUtils
+
+
+def timed(fn):
+    tic = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - tic
+
+
+def make_detections(n: int, height: int, width: int, seed: int = 0):
+    """Clusters of jittered boxes around objects, as from a detector before nms."""
+    rng = np.random.RandomState(seed)
+    num_objects = max(1, n // 20)
+    centers = rng.uniform(0, 1, (num_objects, 2)) * [width, height]
+    sizes = rng.uniform(10, 200, (num_objects, 2))
+    obj = rng.randint(0, num_objects, n)
+    wh = np.maximum(sizes[obj] * rng.uniform(0.8, 1.2, (n, 2)), 1)
+    xy = np.clip(centers[obj] - wh / 2 + rng.randn(n, 2) * wh * 0.1, 0, [width - 1, height - 1])
+    boxes = np.concatenate([xy, wh], 1)
+    return boxes, rng.rand(n), rng.randint(0, 80, n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--detections", type=int, default=10_000)
+    parser.add_argument("--masks", type=int, default=2_000, help="detections of the mask nms")
+    parser.add_argument("--thr", type=float, nargs="+", default=[0.5])
+    args = parser.parse_args()
+
+    height, width = 1024, 1024
+    boxes, scores, classes = make_detections(args.detections, height, width)
+    order = np.argsort(-scores, kind="mergesort")
+    rles = maskUtils.frPyObjects(boxes[order][: args.masks], height, width)
+    print(f"{args.detections} boxes, {len(rles)} masks in a {width}x{height} image")
+
+    for thr in args.thr:
+        ref, t_ref = timed(lambda: maskUtils._mask.nms(boxes[order], thr, sweep=False))
+        inds, t_sweep = timed(lambda: maskUtils.nms(boxes, thr, scores))
+        same = np.array_equal(inds, order[ref])
+        _, t_batched = timed(lambda: maskUtils.batchedNms(boxes, thr, scores, classes))
+        print(
+            f"thr {thr:.2f} | boxes: bbNms {t_ref:7.3f}s | sweep {t_sweep:7.3f}s"
+            f" | {t_ref / t_sweep:6.1f}x | same: {same} | batched 80 classes {t_batched:6.3f}s"
+        )
+        ref, t_ref = timed(lambda: maskUtils._mask.nms(rles, thr, sweep=False))
+        keep, t_sweep = timed(lambda: maskUtils._mask.nms(rles, thr))
+        same = np.array_equal(keep, ref)
+        print(
+            f"thr {thr:.2f} | masks: rleNms {t_ref:7.3f}s | sweep {t_sweep:7.3f}s"
+            f" | {t_ref / t_sweep:6.1f}x | same: {same}"
+        )
+
+
+if __name__ == "__main__":
+    main()
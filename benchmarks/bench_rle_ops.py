@@ -0,0 +1,92 @@
+"""
+Wall time of the RLE-domain mask operations of pycocotools.mask against the same operations on
+decoded masks, for large masks (satellite chips).
+
+Usage:
+    python benchmarks/bench_rle_ops.py --size 4096 --masks 20
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from pycocotools import mask as maskUtils
+
+
+def timed(fn):
+    tic = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - tic
+
+
+def make_masks(n: int, size: int, seed: int = 0):
+    """Random polygons (star shapes) covering a good part of a size x size image."""
+    rng = np.random.RandomState(seed)
+    rles = []
+    for _ in range(n):
+        cx, cy = rng.uniform(0.3, 0.7, 2) * size
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 40))
+        radii = rng.uniform(0.1, 0.3, 40) * size
+        poly = np.stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)], 1)
+        rles.append(maskUtils.frPyObjects([poly.ravel().tolist()], size, size)[0])
+    return rles
+
+
+def dense_ops(rle, other):
+    m = maskUtils.decode(rle)
+    ys, xs = np.nonzero(m)
+    centroid = xs.mean(), ys.mean()
+    projections = m.sum(1), m.sum(0)
+    xor = maskUtils.encode(m ^ maskUtils.decode(other))
+    crop = maskUtils.encode(np.asfortranarray(m[100:1100, 200:1200]))
+    half = maskUtils.encode(np.asfortranarray(m[1::2, 1::2]))
+    return centroid, projections, xor, crop, half
+
+
+def rle_ops(rle, other):
+    centroid = maskUtils.centroid(rle)
+    projections = maskUtils.projections(rle)
+    xor = maskUtils.xor([rle, other])
+    crop = maskUtils.crop(rle, [200, 100, 1000, 1000])
+    h, w = rle["size"]
+    half = maskUtils.resize(rle, h // 2, w // 2)
+    return centroid, projections, xor, crop, half
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--masks", type=int, default=20)
+    args = parser.parse_args()
+
+    rles = make_masks(args.masks, args.size)
+    pairs = list(zip(rles, rles[1:] + rles[:1]))
+    print(f"{len(rles)} masks of {args.size}x{args.size}")
+    dense, t_dense = timed(lambda: [dense_ops(a, b) for a, b in pairs])
+    ops, t_rle = timed(lambda: [rle_ops(a, b) for a, b in pairs])
+    same = all(
+        np.allclose(d[0], r[0])
+        and all(np.array_equal(x, y) for x, y in zip(d[1], r[1]))
+        and d[2:] == r[2:]
+        for d, r in zip(dense, ops)
+    )
+    print(
+        f"centroid, projections, xor, crop, resize | dense {t_dense:6.2f}s | rle {t_rle:6.3f}s"
+        f" | {t_dense / t_rle:6.1f}x | same: {same}"
+    )
+    _, t_decode = timed(lambda: [maskUtils.decode(rle) for rle in rles])
+    polys, t_poly = timed(lambda: [maskUtils.toPolygons(rle, holes=True) for rle in rles])
+    h = w = args.size
+
+    def from_polygons(outer, holes):
+        return maskUtils.difference(
+            [maskUtils.merge(maskUtils.frPyObjects(p, h, w)) for p in (outer, holes) if p]
+        )
+
+    exact = all(from_polygons(*p) == rle for p, rle in zip(polys, rles))
+    print(f"toPolygons {t_poly:6.3f}s (decode alone {t_decode:6.2f}s) | exact: {exact}")
+
+
+if __name__ == "__main__":
+    main()
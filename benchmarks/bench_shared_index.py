@@ -0,0 +1,97 @@
+"""
+Per-worker memory of COCO objects inherited by forked data loader workers.
+
+Every worker walks the whole dataset once (loadImgs, imgToAnns, loadAnns, annToRLE), like a
+DataLoader epoch does, and then reports its memory from /proc/self/smaps_rollup (Linux only):
+
+    rss      - resident set size, counts shared pages as well
+    private  - pages only this worker has (what actually multiplies with the number of workers)
+
+Usage:
+    python benchmarks/bench_shared_index.py --annotations 500000 --workers 8
+    python benchmarks/bench_shared_index.py --ann-file instances_train2017.json
+"""
+
+import argparse
+import gc
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from common import memory_kb, write_dataset
+
+from pycocotools.coco import COCO
+
+
+def walk(coco: COCO, rle_every: int) -> int:
+    n = 0
+    for img in coco.loadImgs(coco.getImgIds()):
+        anns = coco.imgToAnns[img["id"]]
+        n += len(coco.loadAnns([ann["id"] for ann in anns]))
+        for ann in anns[::rle_every]:
+            coco.annToRLE(ann)
+    return n
+
+
+# set in the parent before forking so that the workers inherit it
+_COCO = None
+
+
+def _worker(args):
+    rle_every, _ = args
+    before = memory_kb()
+    walk(_COCO, rle_every)
+    after = memory_kb()
+    return before, after
+
+
+def run(ann_file: Path, shared: bool, workers: int, rle_every: int, cache_dir: Path) -> None:
+    global _COCO
+    tic = time.time()
+    _COCO = COCO(ann_file, shared=shared, cache=shared, cache_dir=cache_dir)
+    load = time.time() - tic
+    gc.collect()
+    parent = memory_kb()
+    ctx = mp.get_context("fork")
+    tic = time.time()
+    with ctx.Pool(workers) as pool:
+        stats = pool.map(_worker, [(rle_every, i) for i in range(workers)], chunksize=1)
+    epoch = time.time() - tic
+    rss = np.mean([after["rss"] for _, after in stats]) / 1024
+    private = np.mean([after["private"] for _, after in stats]) / 1024
+    mode = "shared" if shared else "dict"
+    print(
+        f"{mode:>8} | load {load:6.2f}s | parent rss {parent['rss'] / 1024:8.1f} MB"
+        f" | worker rss {rss:8.1f} MB | worker private {private:8.1f} MB"
+        f" | total private {private * workers:9.1f} MB | epoch {epoch:6.2f}s"
+    )
+    _COCO = None
+    gc.collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ann-file", type=Path, default=None, help="default: synthetic dataset")
+    parser.add_argument("--annotations", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--rle-every", type=int, default=4, help="annToRLE every nth annotation")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ann_file = args.ann_file
+        if ann_file is None:
+            ann_file = write_dataset(Path(tmp) / "instances.json", args.annotations)
+        cache_dir = Path(tmp) / "cache"
+        # build the shared snapshot once, so both runs measure steady state loads
+        COCO(ann_file, shared=True, cache_dir=cache_dir)
+        print(f"{ann_file} with {args.workers} workers")
+        for shared in (False, True):
+            run(ann_file, shared, args.workers, args.rle_every, cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Peak memory and wall time of COCO(annotation_file) with json.load vs the streaming loader.
+
+Every configuration runs in a fresh interpreter, so the reported peak RSS (VmHWM, Linux only)
+belongs to that load alone.
+
+Usage:
+    python benchmarks/bench_streaming.py --annotations 500000
+    python benchmarks/bench_streaming.py --ann-file instances_train2017.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import status_kb, write_dataset
+
+CONFIGS = {
+    "json.load": {},
+    "json.load columnar": {"columnar": True},
+    "stream": {"stream": True},
+    "stream columnar": {"stream": True, "columnar": True},
+    "stream drop segmentation": {"drop_fields": ["segmentation"]},
+    "stream columnar drop segmentation": {"columnar": True, "drop_fields": ["segmentation"]},
+}
+
+
+def run_one(ann_file: str, config: str) -> None:
+    import contextlib
+    import io
+
+    from pycocotools.coco import COCO
+
+    base = status_kb()["VmRSS"]
+    tic = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco = COCO(ann_file, cache=False, **CONFIGS[config])
+    elapsed = time.time() - tic
+    peak = status_kb()["VmHWM"]
+    print(
+        json.dumps(
+            {"time": elapsed, "peak_mb": peak / 1024, "base_mb": base / 1024, "n": len(coco.anns)}
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ann-file", type=Path, default=None, help="default: synthetic dataset")
+    parser.add_argument("--annotations", type=int, default=300_000)
+    parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run is not None:
+        run_one(str(args.ann_file), args.run)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ann_file = args.ann_file
+        if ann_file is None:
+            ann_file = write_dataset(Path(tmp) / "instances.json", args.annotations)
+        size = ann_file.stat().st_size / 2**20
+        print(f"{ann_file} ({size:.0f} MB)")
+        for config in CONFIGS:
+            out = subprocess.run(
+                [sys.executable, __file__, "--ann-file", str(ann_file), "--run", config],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{config:>34} | {res['time']:6.2f}s | peak rss {res['peak_mb']:8.1f} MB"
+                f" (+{res['peak_mb'] - res['base_mb']:7.1f} MB over interpreter start)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Shared helpers of the benchmark scripts.
+"""
+
+import json
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+
+def make_dataset(num_anns: int, anns_per_image: int = 8, seed: int = 0, num_cats: int = 80) -> dict:
+    rng = np.random.RandomState(seed)
+    num_images = max(1, num_anns // anns_per_image)
+    images = [
+        {"id": i + 1, "file_name": f"{i + 1:012d}.jpg", "height": 480, "width": 640}
+        for i in range(num_images)
+    ]
+    annotations = []
+    xy = rng.uniform(10, 400, (num_anns, 2))
+    wh = rng.uniform(5, 200, (num_anns, 2))
+    for i in range(num_anns):
+        x, y = xy[i]
+        w, h = wh[i]
+        poly = [x, y, x + w, y, x + w, y + h, x, y + h] + rng.uniform(x, x + w, 8).tolist()
+        annotations.append(
+            {
+                "id": i + 1,
+                "image_id": int(rng.randint(1, num_images + 1)),
+                "category_id": int(rng.randint(1, num_cats + 1)),
+                "segmentation": [[round(v, 2) for v in poly]],
+                "area": float(w * h),
+                "bbox": [round(x, 2), round(y, 2), round(w, 2), round(h, 2)],
+                "iscrowd": 0,
+            }
+        )
+    categories = [
+        {"id": c, "name": f"cat{c}", "supercategory": "thing"} for c in range(1, num_cats + 1)
+    ]
+    return {"images": images, "annotations": annotations, "categories": categories}
+
+
+def make_results(
+    dataset: dict, dets_per_ann: float = 1.5, fp_per_image: float = 2.0, seed: int = 1
+):
+    """Detections in results format: jittered copies of the ground truth plus false positives."""
+    rng = np.random.RandomState(seed)
+    num_cats = len(dataset["categories"])
+    results = []
+    for ann in dataset["annotations"]:
+        for _ in range(rng.poisson(dets_per_ann)):
+            x, y, w, h = np.asarray(ann["bbox"]) + rng.randn(4) * 3
+            results.append(
+                {
+                    "image_id": ann["image_id"],
+                    "category_id": ann["category_id"],
+                    "bbox": [float(x), float(y), float(max(w, 1)), float(max(h, 1))],
+                    "score": float(rng.rand()),
+                }
+            )
+    for img in dataset["images"]:
+        for _ in range(rng.poisson(fp_per_image)):
+            x, y = rng.uniform(0, 400, 2)
+            w, h = rng.uniform(5, 200, 2)
+            results.append(
+                {
+                    "image_id": img["id"],
+                    "category_id": int(rng.randint(1, num_cats + 1)),
+                    "bbox": [float(x), float(y), float(w), float(h)],
+                    "score": float(rng.rand()),
+                }
+            )
+    return results
+
+
+def write_dataset(path: Union[str, Path], num_anns: int, seed: int = 0) -> Path:
+    path = Path(path)
+    with open(path, "w") as f:
+        json.dump(make_dataset(num_anns, seed=seed), f)
+    return path
+
+
+def status_kb() -> dict:
+    """The kB fields of /proc/self/status (VmRSS, VmHWM, ...)."""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields
+
+
+def memory_kb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
@@ -1,4 +1,5 @@
 // https://github.com/vivkin/gason - pulled January 10, 2016
+// Modified for pycocotools, see gason.h.
 #include "gason.h"
 #include <stdlib.h>
 
@@ -71,50 +72,54 @@ static inline int char2int(char c) {
     return (c & ~' ') - 'A' + 10;
 }
 
-static double string2double(char *s, char **endptr) {
-    char ch = *s;
-    if (ch == '-')
-        ++s;
-
-    double result = 0;
-    while (isdigit(*s))
-        result = (result * 10) + (*s++ - '0');
+static const double powersOf10[] = {1e0,  1e1,  1e2,  1e3,  1e4,  1e5,  1e6,  1e7,
+                                    1e8,  1e9,  1e10, 1e11, 1e12, 1e13, 1e14, 1e15,
+                                    1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22};
 
+static JsonValue string2number(char *s, char **endptr) {
+    char *start = s;
+    bool negative = *s == '-';
+    if (negative)
+        ++s;
+    uint64_t mantissa = 0;
+    int digits = 0;
+    while (isdigit(*s)) {
+        mantissa = mantissa * 10 + (*s++ - '0');
+        digits += mantissa != 0;
+    }
+    if (*s != '.' && *s != 'e' && *s != 'E') {
+        *endptr = s;
+        return JsonValue(JSON_INTEGER, start);
+    }
+    int exponent = 0;
     if (*s == '.') {
         ++s;
-
-        double fraction = 1;
         while (isdigit(*s)) {
-            fraction *= 0.1;
-            result += (*s++ - '0') * fraction;
+            mantissa = mantissa * 10 + (*s++ - '0');
+            digits += mantissa != 0;
+            --exponent;
         }
     }
-
-    if (*s == 'e' || *s == 'E') {
+    if ((*s == 'e' || *s == 'E') && (isdigit(s[1]) || ((s[1] == '+' || s[1] == '-') && isdigit(s[2])))) {
         ++s;
-
-        double base = 10;
-        if (*s == '+')
-            ++s;
-        else if (*s == '-') {
+        bool negativeExponent = *s == '-';
+        if (*s == '+' || *s == '-')
             ++s;
-            base = 0.1;
-        }
-
-        unsigned int exponent = 0;
-        while (isdigit(*s))
-            exponent = (exponent * 10) + (*s++ - '0');
-
-        double power = 1;
-        for (; exponent; exponent >>= 1, base *= base)
-            if (exponent & 1)
-                power *= base;
-
-        result *= power;
+        int e = 0;
+        while (isdigit(*s) && e < 10000)
+            e = e * 10 + (*s++ - '0');
+        exponent += negativeExponent ? -e : e;
     }
-
-    *endptr = s;
-    return ch == '-' ? -result : result;
+    // Exact fast path (Clinger): the mantissa and the power of ten are both exactly
+    // representable, so one multiplication / division is correctly rounded. Anything else goes
+    // through strtod, which rounds correctly, unlike accumulating the digits by hand.
+    if (digits <= 15 && mantissa <= (1ULL << 53) && exponent >= -22 && exponent <= 22 && !isdigit(*s)) {
+        double value = (double)mantissa;
+        value = exponent < 0 ? value / powersOf10[-exponent] : value * powersOf10[exponent];
+        *endptr = s;
+        return JsonValue(negative ? -value : value);
+    }
+    return JsonValue(strtod(start, endptr));
 }
 
 static inline JsonNode *insertAfter(JsonNode *tail, JsonNode *node) {
@@ -141,6 +146,7 @@ int jsonParse(char *s, char **endptr, JsonValue *value, JsonAllocator &allocator
     JsonValue o;
     int pos = -1;
     bool separator = true;
+    bool closed;
     JsonNode *node;
     *endptr = s;
 
@@ -166,7 +172,7 @@ int jsonParse(char *s, char **endptr, JsonValue *value, JsonAllocator &allocator
         case '7':
         case '8':
         case '9':
-            o = JsonValue(string2double(*endptr, &s));
+            o = string2number(*endptr, &s);
             if (!isdelim(*s)) {
                 *endptr = s;
                 return JSON_BAD_NUMBER;
@@ -174,6 +180,7 @@ int jsonParse(char *s, char **endptr, JsonValue *value, JsonAllocator &allocator
             break;
         case '"':
             o = JsonValue(JSON_STRING, s);
+            closed = false;
             for (char *it = s; *s; ++it, ++s) {
                 int c = *it = *s;
                 if (c == '\\') {
@@ -230,10 +237,11 @@ int jsonParse(char *s, char **endptr, JsonValue *value, JsonAllocator &allocator
                 } else if (c == '"') {
                     *it = 0;
                     ++s;
+                    closed = true;
                     break;
                 }
             }
-            if (!isdelim(*s)) {
+            if (!closed || !isdelim(*s)) {
                 *endptr = s;
                 return JSON_BAD_STRING;
             }
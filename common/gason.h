@@ -1,4 +1,7 @@
 // https://github.com/vivkin/gason - pulled January 10, 2016
+// Modified for pycocotools: integer literals are kept as JSON_INTEGER (pointing at the literal in
+// the source text) and other numbers are parsed with strtod, so that values and int / float types
+// match Python's json module.
 #pragma once
 
 #include <stdint.h>
@@ -12,6 +15,7 @@ enum JsonTag {
     JSON_OBJECT,
     JSON_TRUE,
     JSON_FALSE,
+    JSON_INTEGER,
     JSON_NULL = 0xF
 };
 
@@ -47,6 +51,10 @@ union JsonValue {
         assert(getTag() == JSON_NUMBER);
         return fval;
     }
+    char *toIntegerLiteral() const {
+        assert(getTag() == JSON_INTEGER);
+        return (char *)getPayload();
+    }
     char *toString() const {
         assert(getTag() == JSON_STRING);
         return (char *)getPayload();
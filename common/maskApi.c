@@ -46,12 +46,43 @@ void rleDecode( const RLE *R, byte *M, siz n ) {
       for( k=0; k<R[i].cnts[j]; k++ ) *(M++)=v; v=!v; }}
 }
 
+siz rleSampleRange( double o, double len, siz n, siz N, siz *s, siz *i0 ) {
+  /* s[i]=floor(o+(i+.5)*len/N) for i in [i0,i1), the samples inside [0,n); returns i1 */
+  siz i, i1=0; double t; *i0=N;
+  for( i=0; i<N; i++ ) { t=floor(o+(i+.5)*len/N);
+    if(t<0) continue; if(t>=n) break; if(*i0==N) *i0=i; s[i]=(siz) t; i1=i+1; }
+  if(*i0==N) *i0=i1; return i1;
+}
+
+void rleDecodeBox( const RLE *R, const double *bb, siz H, siz W, void *M, siz k, uint v ) {
+  siz h=R->h, w=R->w, r, r0, r1, c, c0, c1, j=0, e, sj=0, se=0, x, px, t, *ys, *xs;
+  ys=malloc(sizeof(siz)*(H+1)); xs=malloc(sizeof(siz)*(W+1));
+  r1=rleSampleRange(bb?bb[1]:0,bb?bb[3]:h,h,H,ys,&r0);
+  c1=rleSampleRange(bb?bb[0]:0,bb?bb[2]:w,w,W,xs,&c0);
+  e=R->m ? R->cnts[0] : 0; px=w;
+  for( c=c0; c<c1; c++ ) {
+    /* the samples of a column are increasing positions, walk the runs once per column */
+    x=xs[c]; if(x==px) { j=sj; e=se; } else { sj=j; se=e; px=x; }
+    for( r=r0; r<r1; ) {
+      t=x*h+ys[r]; while(t>=e && j+1<R->m) e+=R->cnts[++j];
+      if(t>=e) break; t=e-x*h; /* rows of run j: ys[r]<t */
+      if(!(j&1)) { while(r<r1 && ys[r]<t) r++; continue; }
+      if(k==1) for( ; r<r1 && ys[r]<t; r++ ) ((byte*) M)[r*W+c]=(byte) v;
+      else if(k==2) for( ; r<r1 && ys[r]<t; r++ ) ((unsigned short*) M)[r*W+c]=(unsigned short) v;
+      else for( ; r<r1 && ys[r]<t; r++ ) ((uint*) M)[r*W+c]=v;
+    }
+  }
+  free(ys); free(xs);
+}
+
 void rleMerge( const RLE *R, RLE *M, siz n, int intersect ) {
   uint *cnts, c, ca, cb, cc, ct; int v, va, vb, vp;
   siz i, a, b, h=R[0].h, w=R[0].w, m=R[0].m; RLE A, B;
   if(n==0) { rleInit(M,0,0,0,0); return; }
   if(n==1) { rleInit(M,h,w,m,R[0].cnts); return; }
-  cnts = malloc(sizeof(uint)*(h*w+1));
+  /* the merged counts are at most as many as all the counts together */
+  for( i=1, c=0; i<n; i++ ) c+=R[i].m;
+  cnts = malloc(sizeof(uint)*(m+c+1));
   for( a=0; a<m; a++ ) cnts[a]=R[0].cnts[a];
   for( i=1; i<n; i++ ) {
     B=R[i]; if(B.h!=h||B.w!=w) { h=w=m=0; break; }
@@ -61,7 +92,9 @@ void rleMerge( const RLE *R, RLE *M, siz n, int intersect ) {
       c=umin(ca,cb); cc+=c; ct=0;
       ca-=c; if(!ca && a<A.m) { ca=A.cnts[a++]; va=!va; } ct+=ca;
       cb-=c; if(!cb && b<B.m) { cb=B.cnts[b++]; vb=!vb; } ct+=cb;
-      vp=v; if(intersect) v=va&&vb; else v=va||vb;
+      vp=v; switch(intersect) {
+        case 1: v=va&&vb; break; case 2: v=va!=vb; break;
+        case 3: v=va&&!vb; break; default: v=va||vb; }
       if( v!=vp||ct==0 ) { cnts[m++]=cc; cc=0; }
     }
     rleFree(&A);
@@ -130,6 +163,44 @@ void bbNms( BB dt, siz n, uint *keep, double thr ) {
   }
 }
 
+typedef struct { double x; siz i; } sweepItem;
+int sweepCompare(const void *a, const void *b) {
+  double c=((sweepItem*)a)->x, d=((sweepItem*)b)->x; return (c>d) - (c<d);
+}
+
+void nmsSweep( RLE *R, BB bb, siz n, uint *keep, double thr ) {
+  /* Greedy nms of rleNms (R!=0) or bbNms (R==0) on the boxes bb, comparing each kept box only
+   * with the boxes whose x-start lies in a window around its own (sort-and-sweep). Two boxes
+   * with iou>thr>=0 satisfy |x0-x0'|<(1-thr)*max(w,w'), masks with iou>0 have overlapping
+   * boxes. The ious compared are those of rleNms / bbNms, so the result is the same. */
+  siz i, j, p, lo, hi, mid; double u, f, maxw=0, x0, xlo, xhi; sweepItem *s;
+  if(thr<0) { if(R) rleNms(R,n,keep,thr); else bbNms(bb,n,keep,thr); return; }
+  for( i=0; i<n; i++ ) keep[i]=1;
+  f=R ? 1 : (thr<1 ? 1-thr : 0);
+  s=malloc(sizeof(sweepItem)*n);
+  for( i=0; i<n; i++ ) { s[i].x=bb[4*i]; s[i].i=i; if(bb[4*i+2]>maxw) maxw=bb[4*i+2]; }
+  qsort(s,n,sizeof(sweepItem),sweepCompare);
+  for( i=0; i<n; i++ ) if(keep[i]) {
+    x0=bb[4*i]; xlo=x0-f*maxw-1e-6; xhi=x0+f*fmax(bb[4*i+2],0)+1e-6;
+    lo=0; hi=n; while(lo<hi) { mid=(lo+hi)/2; if(s[mid].x<xlo) lo=mid+1; else hi=mid; }
+    for( p=lo; p<n && s[p].x<=xhi; p++ ) {
+      j=s[p].i; if(j<=i || !keep[j]) continue;
+      if(R) rleIou(R+i,R+j,1,1,0,&u); else bbIou(bb+i*4,bb+j*4,1,1,0,&u);
+      if(u>thr) keep[j]=0;
+    }
+  }
+  free(s);
+}
+
+void rleNmsSweep( RLE *dt, siz n, uint *keep, double thr ) {
+  BB bb=malloc(sizeof(double)*n*4); rleToBbox(dt,bb,n);
+  nmsSweep(dt,bb,n,keep,thr); free(bb);
+}
+
+void bbNmsSweep( BB dt, siz n, uint *keep, double thr ) {
+  nmsSweep(0,dt,n,keep,thr);
+}
+
 void rleToBbox( const RLE *R, BB bb, siz n ) {
   siz i; for( i=0; i<n; i++ ) {
     uint h, w, x, y, xs, ys, xe, ye, xp, cc, t; siz j, m;
@@ -229,3 +300,166 @@ void rleFrString( RLE *R, char *s, siz h, siz w ) {
   }
   rleInit(R,h,w,m,cnts); free(cnts);
 }
+
+/* Growing counts of an RLE being built, cnts[m-1] is the last run (of ones if m-1 is odd). */
+typedef struct { uint *cnts; siz m, k; } RLB;
+
+void rlbInit( RLB *B, siz k ) {
+  B->k=k>1?k:2; B->cnts=malloc(sizeof(uint)*B->k); B->cnts[0]=0; B->m=1;
+}
+
+void rlbPush( RLB *B, int v, siz c ) {
+  /* append c pixels of value v */
+  if(!c) return;
+  if((int)((B->m-1)&1)==v) { B->cnts[B->m-1]+=(uint) c; return; }
+  if(B->m==B->k) { B->k*=2; B->cnts=realloc(B->cnts,sizeof(uint)*B->k); }
+  B->cnts[B->m++]=(uint) c;
+}
+
+void rlbFinish( RLB *B, RLE *R, siz h, siz w ) {
+  R->h=h; R->w=w; R->m=B->m; R->cnts=B->cnts;
+}
+
+/* Forward reader of an RLE, run j ends at pixel e. */
+typedef struct { const RLE *R; siz j, e; } RLR;
+
+void rlrInit( RLR *D, const RLE *R ) {
+  D->R=R; D->j=0; D->e=R->m ? R->cnts[0] : 0;
+}
+
+siz rlrRun( RLR *D, siz a, siz b, int *v ) {
+  /* value v of pixel a and end (at most b) of its run, a may not decrease between calls */
+  while(D->e<=a && D->j+1<D->R->m) D->e+=D->R->cnts[++D->j];
+  if(D->e<=a) { *v=0; return b; }
+  *v=(int)(D->j&1); return D->e<b ? D->e : b;
+}
+
+void rleShift( const RLE *R, RLE *M, long dx, long dy, siz h, siz w ) {
+  siz c, a, b, t, h0=R->h, w0=R->w; long x, y0, y1; int v; RLB B; RLR D;
+  rlbInit(&B,R->m+2*w+2); rlrInit(&D,R);
+  /* rows [y0,y1) of every output column come from rows [y0-dy,y1-dy) of the input */
+  y0=dy<0 ? 0 : dy>(long)h ? (long)h : dy;
+  y1=(long)h0+dy; if(y1>(long)h) y1=(long)h; if(y1<y0) y1=y0;
+  for( c=0; c<w; c++ ) {
+    x=(long)c-dx;
+    if(x<0 || x>=(long)w0) { rlbPush(&B,0,h); continue; }
+    rlbPush(&B,0,(siz)y0); a=(siz)x*h0+(siz)(y0-dy); b=a+(siz)(y1-y0);
+    while(a<b) { t=rlrRun(&D,a,b,&v); rlbPush(&B,v,t-a); a=t; }
+    rlbPush(&B,0,h-(siz)y1);
+  }
+  rlbFinish(&B,M,h,w);
+}
+
+siz rleSampleCount( siz t, siz n0, siz n ) {
+  /* number of the samples floor((i+.5)*n0/n), i<n, below t */
+  siz u=2*t*n; if(u<=n0) return 0;
+  u=(u-n0+2*n0-1)/(2*n0); return u<n ? u : n;
+}
+
+void rleResize( const RLE *R, RLE *M, siz h, siz w ) {
+  siz c, x, px, a, t, o, h0=R->h, w0=R->w; int v; RLB B; RLR D, S;
+  rlbInit(&B,2*(R->m+w)+2); rlrInit(&D,R); S=D; px=w0;
+  if(h0==0 || w0==0) { rlbPush(&B,0,h*w); rlbFinish(&B,M,h,w); return; }
+  for( c=0; c<w; c++ ) {
+    /* nearest input column, read again when upsampling */
+    x=(2*c+1)*w0/(2*w); if(x==px) D=S; else { S=D; px=x; }
+    for( a=0, o=x*h0; a<h0; a=t ) {
+      t=rlrRun(&D,o+a,o+h0,&v)-o;
+      rlbPush(&B,v,rleSampleCount(t,h0,h)-rleSampleCount(a,h0,h));
+    }
+  }
+  rlbFinish(&B,M,h,w);
+}
+
+void rleMoments( const RLE *R, siz n, double *mo ) {
+  siz i, j, p, c, l, x, y, h; double s0, s1, s2, *m;
+  for( i=0; i<n; i++ ) {
+    m=mo+6*i; m[0]=m[1]=m[2]=m[3]=m[4]=m[5]=0; h=R[i].h; p=0;
+    for( j=0; j<R[i].m; j++ ) {
+      c=R[i].cnts[j]; if(!(j&1)) { p+=c; continue; }
+      /* rows [y,y+l) of column x */
+      for( ; c>0; c-=l, p+=l ) {
+        x=p/h; y=p%h; l=h-y<c ? h-y : c;
+        s0=(double) l; s1=(double)(2*y+l-1)*l/2;
+        s2=((double)(y+l-1)*(y+l)*(2*(y+l)-1)-(double)(y>0?y-1:0)*y*(2*y-1))/6;
+        m[0]+=s0; m[1]+=x*s0; m[2]+=s1; m[3]+=(double)x*x*s0; m[4]+=x*s1; m[5]+=s2;
+      }
+    }
+  }
+}
+
+void rleProject( const RLE *R, uint *rows, uint *cols ) {
+  siz j, p=0, c, l, x, y, h=R->h; long *d=calloc(h+1,sizeof(long)), s=0;
+  for( x=0; x<R->w; x++ ) cols[x]=0;
+  for( j=0; j<R->m; j++ ) {
+    c=R->cnts[j]; if(!(j&1)) { p+=c; continue; }
+    for( ; c>0; c-=l, p+=l ) {
+      x=p/h; y=p%h; l=h-y<c ? h-y : c; cols[x]+=(uint) l; d[y]++; d[y+l]--; }
+  }
+  for( y=0; y<h; y++ ) { s+=d[y]; rows[y]=(uint) s; }
+  free(d);
+}
+
+/* Boundary edge between pixel corners, from vertex s to vertex e (x*(h+1)+y) in direction d
+   (0: +x, 1: +y, 2: -x, 3: -y), with the mask on its right. */
+typedef struct { siz s, e; int d; } PolyEdge;
+
+int polyEdgeCompare( const void *a, const void *b ) {
+  siz x=((const PolyEdge*)a)->s, y=((const PolyEdge*)b)->s; return (x>y)-(x<y);
+}
+
+siz rleToPoly( const RLE *R, double **xy, siz **k ) {
+  siz h=R->h, w=R->w, H=h+1, j, p=0, c, l, x, y, y0, y1, n=0, m=0, v=0, i, e, a, b, lo, hi;
+  siz *seg, *col; PolyEdge *E; byte *used; int inL, inR;
+  /* ones of every column as [y0,y1) segments, those of column x are seg[col[x]..col[x+1]) */
+  seg=malloc(sizeof(siz)*2*(R->m+w+1)); col=calloc(w+2,sizeof(siz));
+  for( j=0; j<R->m; j++ ) {
+    c=R->cnts[j]; if(!(j&1)) { p+=c; continue; }
+    for( ; c>0; c-=l, p+=l ) {
+      x=p/h; y=p%h; l=h-y<c ? h-y : c; seg[2*n]=y; seg[2*n+1]=y+l; col[x+1]++; n++; }
+  }
+  for( x=0; x<=w; x++ ) col[x+1]+=col[x];
+  /* top and bottom of the segments, and the sides where neighboring columns differ */
+  E=malloc(sizeof(PolyEdge)*(6*n+1));
+  for( x=0; x<w; x++ ) for( i=col[x]; i<col[x+1]; i++ ) {
+    y0=seg[2*i]; y1=seg[2*i+1];
+    E[m].s=x*H+y0; E[m].e=(x+1)*H+y0; E[m++].d=0;
+    E[m].s=(x+1)*H+y1; E[m].e=x*H+y1; E[m++].d=2;
+  }
+  for( x=0; x<=w; x++ ) {
+    a=x>0 ? 2*col[x-1] : 0; lo=x>0 ? 2*col[x] : 0;
+    b=x<w ? 2*col[x] : 0; hi=x<w ? 2*col[x+1] : 0;
+    inL=inR=0; y0=0;
+    while( a<lo || b<hi ) {
+      y1=a<lo && (b>=hi || seg[a]<=seg[b]) ? seg[a] : seg[b];
+      if(inL!=inR && y1>y0) {
+        if(inR) { E[m].s=x*H+y1; E[m].e=x*H+y0; E[m++].d=3; }
+        else { E[m].s=x*H+y0; E[m].e=x*H+y1; E[m++].d=1; }
+      }
+      if(a<lo && seg[a]==y1) { inL=!inL; a++; }
+      if(b<hi && seg[b]==y1) { inR=!inR; b++; }
+      y0=y1;
+    }
+  }
+  free(seg); free(col);
+  /* follow the edges, at a vertex shared by two loops (diagonal pixels) turn right */
+  qsort(E,m,sizeof(PolyEdge),polyEdgeCompare); used=calloc(m+1,1);
+  *xy=malloc(sizeof(double)*2*(m+1)); *k=malloc(sizeof(siz)*(m+1)); n=0;
+  for( i=0; i<m; i++ ) if(!used[i]) {
+    e=i; (*k)[n]=0;
+    do {
+      used[e]=1; lo=0; hi=m;
+      while(lo<hi) { j=(lo+hi)/2; if(E[j].s<E[e].e) lo=j+1; else hi=j; }
+      j=lo; if(j+1<m && E[j+1].s==E[e].e && E[j+1].d==(E[e].d+1)%4) j++;
+      if(E[j].d!=E[e].d) {
+        (*xy)[2*v]=(double)(E[e].e/H); (*xy)[2*v+1]=(double)(E[e].e%H); v++; (*k)[n]++; }
+      e=j;
+    } while( e!=i );
+    /* start at the top-left corner, the start of edge i, which was added last */
+    x=(siz)(*xy)[2*v-2]; y=(siz)(*xy)[2*v-1];
+    for( j=v-1; j>v-(*k)[n]; j-- ) { (*xy)[2*j]=(*xy)[2*j-2]; (*xy)[2*j+1]=(*xy)[2*j-1]; }
+    (*xy)[2*j]=(double) x; (*xy)[2*j+1]=(double) y;
+    n++;
+  }
+  free(E); free(used); return n;
+}
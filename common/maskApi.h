@@ -26,7 +26,12 @@ void rleEncode( RLE *R, const byte *mask, siz h, siz w, siz n );
 /* Decode binary masks encoded via RLE. */
 void rleDecode( const RLE *R, byte *mask, siz n );
 
-/* Compute union or intersection of encoded masks. */
+/* Decode the window bb=[x y w h] (whole mask if bb is 0) of an encoded mask, sampled on a HxW
+   row-major grid (nearest pixel). Sets the k-byte (1, 2 or 4) elements of set pixels to v. */
+void rleDecodeBox( const RLE *R, const double *bb, siz H, siz W, void *M, siz k, uint v );
+
+/* Compute union (intersect=0), intersection (1), xor (2) or difference (3, R[0] minus the
+   others) of encoded masks. */
 void rleMerge( const RLE *R, RLE *M, siz n, int intersect );
 
 /* Compute area of encoded masks. */
@@ -44,6 +49,10 @@ void bbIou( BB dt, BB gt, siz m, siz n, byte *iscrowd, double *o );
 /* Compute non-maximum suppression between bounding boxes */
 void bbNms( BB dt, siz n, uint *keep, double thr );
 
+/* rleNms and bbNms, comparing each box only with those it may overlap (sort-and-sweep). */
+void rleNmsSweep( RLE *dt, siz n, uint *keep, double thr );
+void bbNmsSweep( BB dt, siz n, uint *keep, double thr );
+
 /* Get bounding boxes surrounding encoded masks. */
 void rleToBbox( const RLE *R, BB bb, siz n );
 
@@ -58,3 +67,21 @@ char* rleToString( const RLE *R );
 
 /* Convert from compressed string representation of encoded mask. */
 void rleFrString( RLE *R, char *s, siz h, siz w );
+
+/* Translate by (dx,dy) into a hxw mask, cropping and padding with zeros. */
+void rleShift( const RLE *R, RLE *M, long dx, long dy, siz h, siz w );
+
+/* Resize to hxw (nearest pixel, as rleDecodeBox). */
+void rleResize( const RLE *R, RLE *M, siz h, siz w );
+
+/* Get the moments m00 m10 m01 m20 m11 m02 (x: column, y: row) of encoded masks, 6 per mask. */
+void rleMoments( const RLE *R, siz n, double *mo );
+
+/* Get the number of pixels in every row (h) and column (w) of an encoded mask. */
+void rleProject( const RLE *R, uint *rows, uint *cols );
+
+/* Get the boundaries of an encoded mask as polygons along the pixel edges, clockwise (outer) or
+   counter-clockwise (holes) in image coordinates, from their top-left corner. Returns the number
+   of polygons; polygon i has (*k)[i] vertices, consecutive in *xy (x,y pairs). The caller frees
+   *xy and *k. */
+siz rleToPoly( const RLE *R, double **xy, siz **k );
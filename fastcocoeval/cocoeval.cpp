@@ -2,6 +2,7 @@
 #include "cocoeval.h"
 #include <time.h>
 #include <algorithm>
+#include <cfloat>
 #include <cstdint>
 #include <numeric>
 
@@ -78,8 +79,8 @@ namespace pycocotools
             const int num_iou_thresholds = iou_thresholds.size();
             const int num_ground_truth = ground_truth_sorted_indices.size();
             const int num_detections = detection_sorted_indices.size();
-            std::vector<uint64_t> ground_truth_matches(
-                num_iou_thresholds * num_ground_truth, 0);
+            std::vector<uint64_t> &ground_truth_matches = results->ground_truth_matches;
+            ground_truth_matches.resize(num_iou_thresholds * num_ground_truth, 0);
             std::vector<uint64_t> &detection_matches = results->detection_matches;
             std::vector<bool> &detection_ignores = results->detection_ignores;
             std::vector<bool> &ground_truth_ignores = results->ground_truth_ignores;
@@ -91,6 +92,9 @@ namespace pycocotools
                 ground_truth_ignores[g] = ignores[ground_truth_sorted_indices[g]];
             }
 
+            // like COCOeval.evaluateImg(), match nothing without ious (e.g. computeOks() with
+            // useCats=0)
+            const int num_matched_ground_truth = ious.empty() ? 0 : num_ground_truth;
             for (auto t = 0; t < num_iou_thresholds; ++t)
             {
                 for (auto d = 0; d < num_detections; ++d)
@@ -98,7 +102,7 @@ namespace pycocotools
                     // information about best match so far (match=-1 -> unmatched)
                     double best_iou = std::min(iou_thresholds[t], 1 - 1e-10);
                     int match = -1;
-                    for (auto g = 0; g < num_ground_truth; ++g)
+                    for (auto g = 0; g < num_matched_ground_truth; ++g)
                     {
                         // if this ground truth instance is already matched and not a
                         // crowd, it cannot be matched to another detection
@@ -147,10 +151,19 @@ namespace pycocotools
 
             // store detection score results
             results->detection_scores.resize(detection_sorted_indices.size());
+            results->detection_ids.resize(detection_sorted_indices.size());
             for (size_t d = 0; d < detection_sorted_indices.size(); ++d)
             {
                 results->detection_scores[d] =
                     detection_instances[detection_sorted_indices[d]].score;
+                results->detection_ids[d] =
+                    detection_instances[detection_sorted_indices[d]].id;
+            }
+            results->ground_truth_ids.resize(num_ground_truth);
+            for (auto g = 0; g < num_ground_truth; ++g)
+            {
+                results->ground_truth_ids[g] =
+                    ground_truth_instances[ground_truth_sorted_indices[g]].id;
             }
         }
 
@@ -171,6 +184,7 @@ namespace pycocotools
             std::vector<uint64_t> detection_sorted_indices;
             std::vector<uint64_t> ground_truth_sorted_indices;
             std::vector<bool> ignores;
+            std::vector<std::vector<bool>> area_range_ignores(num_area_ranges);
             std::vector<ImageEvaluation> results_all(
                 num_images * num_area_ranges * num_categories);
 
@@ -199,6 +213,39 @@ namespace pycocotools
                             ground_truth_instances,
                             &ground_truth_sorted_indices,
                             &ignores);
+                        ImageEvaluation &results =
+                            results_all[c * num_area_ranges * num_images + a * num_images + i];
+
+                        // an area range with the same ground truth ignores as an earlier one
+                        // has the same matches, only the ignores of the unmatched detections
+                        // depend on the area range
+                        size_t same = 0;
+                        while (same < a && area_range_ignores[same] != ignores)
+                        {
+                            ++same;
+                        }
+                        area_range_ignores[a] = ignores;
+                        if (same < a)
+                        {
+                            results = results_all
+                                [c * num_area_ranges * num_images + same * num_images + i];
+                            const size_t num_detections = detection_sorted_indices.size();
+                            for (size_t t = 0; t < iou_thresholds.size(); ++t)
+                            {
+                                for (size_t d = 0; d < num_detections; ++d)
+                                {
+                                    if (results.detection_matches[t * num_detections + d] == 0)
+                                    {
+                                        const InstanceAnnotation &detection =
+                                            detection_instances[detection_sorted_indices[d]];
+                                        results.detection_ignores[t * num_detections + d] =
+                                            detection.area < area_ranges[a][0] ||
+                                            detection.area > area_ranges[a][1];
+                                    }
+                                }
+                            }
+                            continue;
+                        }
 
                         MatchDetectionsToGroundTruth(
                             detection_instances,
@@ -209,8 +256,7 @@ namespace pycocotools
                             image_category_ious[i][c],
                             iou_thresholds,
                             area_ranges[a],
-                            &results_all
-                                [c * num_area_ranges * num_images + a * num_images + i]);
+                            &results);
                     }
                 }
             }
@@ -366,9 +412,10 @@ namespace pycocotools
                 recalls->push_back(recall);
                 const int64_t num_valid_detections =
                     true_positives_sum + false_positives_sum;
-                const double precision = num_valid_detections > 0
-                                             ? static_cast<double>(true_positives_sum) / num_valid_detections
-                                             : 0.0;
+                // same expression as COCOeval.accumulate() (tp / (fp + tp + np.spacing(1))),
+                // so that both produce bit-identical precisions
+                const double precision = static_cast<double>(true_positives_sum) /
+                                         (static_cast<double>(num_valid_detections) + DBL_EPSILON);
                 precisions->push_back(precision);
             }
 
@@ -408,7 +455,9 @@ namespace pycocotools
         }
         py::dict Accumulate(
             const py::object &params,
-            const std::vector<ImageEvaluation> &evaluations)
+            const std::vector<ImageEvaluation> &evaluations,
+            const std::vector<int64_t> &group_starts,
+            const std::vector<int64_t> &group_sizes)
         {
             const std::vector<double> recall_thresholds =
                 list_to_vec<double>(params.attr("recThrs"));
@@ -459,13 +508,18 @@ namespace pycocotools
                         // The COCO PythonAPI assumes evaluations[] (the return value of
                         // COCOeval::EvaluateImages() is one long list storing results for each
                         // combination of category, area range, and image id, with categories in
-                        // the outermost loop and images in the innermost loop.
+                        // the outermost loop and images in the innermost loop. Sparse results
+                        // give the slice of every (category, area range) instead.
+                        const bool grouped = !group_starts.empty();
                         const int64_t evaluations_index =
-                            c * num_area_ranges * num_images + a * num_images;
+                            grouped ? group_starts[c * num_area_ranges + a]
+                                    : c * num_area_ranges * num_images + a * num_images;
+                        const int64_t num_evaluations =
+                            grouped ? group_sizes[c * num_area_ranges + a] : num_images;
                         int num_valid_ground_truth = BuildSortedDetectionList(
                             evaluations,
                             evaluations_index,
-                            num_images,
+                            num_evaluations,
                             max_detections[m],
                             &evaluation_indices,
                             &detection_scores,
@@ -530,18 +584,96 @@ namespace pycocotools
             localtime_r(&rawtime, &local_time);
 #endif
             strftime(
-                buffer.data(), 200, "%Y-%m-%d %H:%num_max_detections:%S", &local_time);
+                buffer.data(), 200, "%Y-%m-%d %H:%M:%S", &local_time);
+            const std::vector<int64_t> counts = {num_iou_thresholds,
+                                                 num_recall_thresholds,
+                                                 num_categories,
+                                                 num_area_ranges,
+                                                 num_max_detections};
+            const std::vector<int64_t> recall_shape = {num_iou_thresholds,
+                                                       num_categories,
+                                                       num_area_ranges,
+                                                       num_max_detections};
             return py::dict(
                 "params"_a = params,
-                "counts"_a = std::vector<int64_t>({num_iou_thresholds,
-                                                   num_recall_thresholds,
-                                                   num_categories,
-                                                   num_area_ranges,
-                                                   num_max_detections}),
-                "date"_a = buffer,
-                "precision"_a = precisions_out,
-                "recall"_a = recalls_out,
-                "scores"_a = scores_out);
+                "counts"_a = counts,
+                "date"_a = std::string(buffer.data()),
+                "precision"_a = py::array_t<double>(counts, precisions_out.data()),
+                "recall"_a = py::array_t<double>(recall_shape, recalls_out.data()),
+                "scores"_a = py::array_t<double>(counts, scores_out.data()));
+        }
+
+        py::dict PackEvaluations(
+            const std::vector<ImageEvaluation> &evaluations,
+            const int num_iou_thresholds)
+        {
+            const int64_t num_evaluations = evaluations.size();
+            py::array_t<int64_t> detection_offsets(num_evaluations + 1);
+            py::array_t<int64_t> ground_truth_offsets(num_evaluations + 1);
+            auto dt_offsets = detection_offsets.mutable_unchecked<1>();
+            auto gt_offsets = ground_truth_offsets.mutable_unchecked<1>();
+            dt_offsets(0) = 0;
+            gt_offsets(0) = 0;
+            for (int64_t e = 0; e < num_evaluations; ++e)
+            {
+                dt_offsets(e + 1) = dt_offsets(e) + evaluations[e].detection_ids.size();
+                gt_offsets(e + 1) = gt_offsets(e) + evaluations[e].ground_truth_ids.size();
+            }
+            const int64_t num_detections = dt_offsets(num_evaluations);
+            const int64_t num_ground_truth = gt_offsets(num_evaluations);
+
+            py::array_t<int64_t> detection_ids(num_detections);
+            py::array_t<double> detection_scores(num_detections);
+            py::array_t<int64_t> detection_matches({(int64_t)num_iou_thresholds, num_detections});
+            py::array_t<bool> detection_ignores({(int64_t)num_iou_thresholds, num_detections});
+            py::array_t<int64_t> ground_truth_ids(num_ground_truth);
+            py::array_t<bool> ground_truth_ignores(num_ground_truth);
+            py::array_t<int64_t> ground_truth_matches(
+                {(int64_t)num_iou_thresholds, num_ground_truth});
+            auto dt_ids = detection_ids.mutable_unchecked<1>();
+            auto dt_scores = detection_scores.mutable_unchecked<1>();
+            auto dt_matches = detection_matches.mutable_unchecked<2>();
+            auto dt_ignore = detection_ignores.mutable_unchecked<2>();
+            auto gt_ids = ground_truth_ids.mutable_unchecked<1>();
+            auto gt_ignore = ground_truth_ignores.mutable_unchecked<1>();
+            auto gt_matches = ground_truth_matches.mutable_unchecked<2>();
+            for (int64_t e = 0; e < num_evaluations; ++e)
+            {
+                // the matches and ignores of an evaluation are [TxD] and [TxG] row major
+                const ImageEvaluation &evaluation = evaluations[e];
+                const int64_t D = evaluation.detection_ids.size();
+                const int64_t G = evaluation.ground_truth_ids.size();
+                for (int64_t d = 0; d < D; ++d)
+                {
+                    dt_ids(dt_offsets(e) + d) = evaluation.detection_ids[d];
+                    dt_scores(dt_offsets(e) + d) = evaluation.detection_scores[d];
+                    for (int t = 0; t < num_iou_thresholds; ++t)
+                    {
+                        dt_matches(t, dt_offsets(e) + d) = evaluation.detection_matches[t * D + d];
+                        dt_ignore(t, dt_offsets(e) + d) = evaluation.detection_ignores[t * D + d];
+                    }
+                }
+                for (int64_t g = 0; g < G; ++g)
+                {
+                    gt_ids(gt_offsets(e) + g) = evaluation.ground_truth_ids[g];
+                    gt_ignore(gt_offsets(e) + g) = evaluation.ground_truth_ignores[g];
+                    for (int t = 0; t < num_iou_thresholds; ++t)
+                    {
+                        gt_matches(t, gt_offsets(e) + g) =
+                            evaluation.ground_truth_matches[t * G + g];
+                    }
+                }
+            }
+            return py::dict(
+                "dt_offsets"_a = detection_offsets,
+                "gt_offsets"_a = ground_truth_offsets,
+                "dt_ids"_a = detection_ids,
+                "dt_scores"_a = detection_scores,
+                "dt_matches"_a = detection_matches,
+                "dt_ignore"_a = detection_ignores,
+                "gt_ids"_a = ground_truth_ids,
+                "gt_ignore"_a = ground_truth_ignores,
+                "gt_matches"_a = ground_truth_matches);
         }
 
     } // namespace COCOeval
@@ -51,6 +51,16 @@ namespace pycocotools
             // Marks whether or not each of D instances was ignored from evaluation (e.g.,
             // because it's outside aRng)
             std::vector<bool> detection_ignores;
+
+            // The ids of the D detected instances, by decreasing score
+            std::vector<uint64_t> detection_ids;
+
+            // The ids of the G ground truth instances, not ignored ones first
+            std::vector<uint64_t> ground_truth_ids;
+
+            // For each of the G ground truth instances, the id of the matched detected
+            // instance, or 0 if unmatched
+            std::vector<uint64_t> ground_truth_matches;
         };
 
         template <class T>
@@ -83,10 +93,22 @@ namespace pycocotools
         // recall curves for each set of category, IOU threshold, detection area range,
         // and max number of detections parameters.  It is assumed that the parameter
         // evaluations is the return value of the function COCOeval::EvaluateImages(),
-        // which was called with the same parameter settings params
+        // which was called with the same parameter settings params. If group_starts is not
+        // empty, the evaluations of category c and area range a are the group_sizes[c * A + a]
+        // ones from evaluations[group_starts[c * A + a]] on (sparse evaluation, images without
+        // ground truth or detections left out) instead of one per image.
         py::dict Accumulate(
             const py::object &params,
-            const std::vector<ImageEvaluation> &evalutations);
+            const std::vector<ImageEvaluation> &evalutations,
+            const std::vector<int64_t> &group_starts,
+            const std::vector<int64_t> &group_sizes);
+
+        // The results of EvaluateImages() in flat arrays (see pycocotools.evalimgs.PackedEvalImgs),
+        // the detections and ground truth of evaluations[e] being those from dt_offsets[e] and
+        // gt_offsets[e] on. The matches and ignores are [T x total] arrays.
+        py::dict PackEvaluations(
+            const std::vector<ImageEvaluation> &evaluations,
+            int num_iou_thresholds);
 
     } // namespace COCOeval
 } // namespace pycocotools
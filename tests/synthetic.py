@@ -0,0 +1,161 @@
+"""
+Small randomly generated COCO datasets for tests that shouldn't depend on downloaded data.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+
+def _rect_counts(h: int, w: int, x0: int, y0: int, x1: int, y1: int) -> List[int]:
+    """Uncompressed (column-major) RLE counts of the rectangle [x0, x1) x [y0, y1)."""
+    m = np.zeros((h, w), dtype=np.uint8)
+    m[y0:y1, x0:x1] = 1
+    flat = m.flatten(order="F")
+    change = np.flatnonzero(np.diff(flat)) + 1
+    bounds = np.concatenate([[0], change, [len(flat)]])
+    counts = np.diff(bounds).tolist()
+    if flat[0] == 1:
+        counts = [0] + counts
+    return counts
+
+
+def make_instances(
+    num_images: int = 12,
+    num_cats: int = 4,
+    max_anns: int = 12,
+    height: int = 64,
+    width: int = 80,
+    keypoints: bool = False,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Build an instances-style dataset with polygon segmentations, a few crowd annotations stored
+    as uncompressed RLE, and (optionally) 17 keypoints per person.
+    """
+    rng = np.random.RandomState(seed)
+    images = [
+        {"id": i + 1, "file_name": f"{i + 1:06d}.jpg", "height": height, "width": width}
+        for i in range(num_images)
+    ]
+    categories = [
+        {"id": c + 1, "name": f"cat {c + 1}", "supercategory": "thing"} for c in range(num_cats)
+    ]
+    if keypoints:
+        for cat in categories:
+            cat["keypoints"] = [f"kp{k}" for k in range(17)]
+            cat["skeleton"] = [[k + 1, k + 2] for k in range(16)]
+    annotations = []
+    ann_id = 1
+    for img in images:
+        for _ in range(rng.randint(0, max_anns + 1)):
+            x0, y0 = rng.randint(0, width - 4), rng.randint(0, height - 4)
+            bw, bh = rng.randint(2, width - x0 + 1), rng.randint(2, height - y0 + 1)
+            iscrowd = int(rng.rand() < 0.1)
+            ann = {
+                "id": ann_id,
+                "image_id": img["id"],
+                "category_id": int(rng.randint(1, num_cats + 1)),
+                "bbox": [float(x0), float(y0), float(bw), float(bh)],
+                "area": float(bw * bh),
+                "iscrowd": iscrowd,
+            }
+            if iscrowd:
+                ann["segmentation"] = {
+                    "size": [height, width],
+                    "counts": _rect_counts(height, width, x0, y0, x0 + bw, y0 + bh),
+                }
+            else:
+                jitter = rng.rand(8) * 0.5
+                x1, y1 = x0 + bw, y0 + bh
+                ann["segmentation"] = [
+                    (np.array([x0, y0, x1, y0, x1, y1, x0, y1], dtype=float) + jitter).tolist()
+                ]
+            if keypoints:
+                kx = rng.uniform(x0, x0 + bw, 17)
+                ky = rng.uniform(y0, y0 + bh, 17)
+                kv = rng.randint(0, 3, 17) * (rng.rand() > 0.15)
+                ann["keypoints"] = np.stack([kx, ky, kv], axis=1).reshape(-1).tolist()
+                ann["num_keypoints"] = int(np.count_nonzero(kv))
+            annotations.append(ann)
+            ann_id += 1
+    return {
+        "info": {"description": "synthetic"},
+        "licenses": [],
+        "images": images,
+        "categories": categories,
+        "annotations": annotations,
+    }
+
+
+def _box_rle(x, y, w, h, img) -> Dict[str, Any]:
+    from pycocotools import mask as maskUtils
+
+    poly = [[x, y, x + w, y, x + w, y + h, x, y + h]]
+    rle = maskUtils.frPyObjects(poly, img["height"], img["width"])[0]
+    rle["counts"] = rle["counts"].decode("ascii")
+    return rle
+
+
+def make_detections(
+    dataset: Dict[str, Any], iou_type: str = "bbox", seed: int = 1, fp_rate: float = 0.5
+) -> List[Dict[str, Any]]:
+    """
+    Jittered copies of the ground truth plus random false positives, in results format.
+    """
+    rng = np.random.RandomState(seed)
+    imgs = {img["id"]: img for img in dataset["images"]}
+    num_cats = len(dataset["categories"])
+    results = []
+    for ann in dataset["annotations"]:
+        img = imgs[ann["image_id"]]
+        for _ in range(rng.randint(0, 3)):
+            x, y, w, h = ann["bbox"]
+            x, y = x + rng.randn() * 2, y + rng.randn() * 2
+            w, h = max(1.0, w + rng.randn() * 2), max(1.0, h + rng.randn() * 2)
+            cat = ann["category_id"] if rng.rand() > 0.1 else int(rng.randint(1, num_cats + 1))
+            det = {
+                "image_id": ann["image_id"],
+                "category_id": cat,
+                "bbox": [x, y, w, h],
+                # quantized so that tied scores show up and exercise the stable sorts
+                "score": float(np.round(rng.rand(), 2)),
+            }
+            if iou_type == "segm":
+                det["segmentation"] = _box_rle(x, y, w, h, img)
+                del det["bbox"]
+            elif iou_type == "keypoints":
+                kp = np.array(ann.get("keypoints", [0] * 51), dtype=float).reshape(17, 3)
+                kp[:, :2] += rng.randn(17, 2) * 2
+                kp[:, 2] = 1
+                det["keypoints"] = kp.reshape(-1).tolist()
+                del det["bbox"]
+            results.append(det)
+    for img in dataset["images"]:
+        while rng.rand() < fp_rate:
+            x, y = rng.uniform(0, img["width"] - 2), rng.uniform(0, img["height"] - 2)
+            w, h = rng.uniform(1, img["width"] - x), rng.uniform(1, img["height"] - y)
+            det = {
+                "image_id": img["id"],
+                "category_id": int(rng.randint(1, num_cats + 1)),
+                "bbox": [x, y, w, h],
+                "score": float(np.round(rng.rand(), 2)),
+            }
+            if iou_type == "segm":
+                det["segmentation"] = _box_rle(x, y, w, h, img)
+                del det["bbox"]
+            elif iou_type == "keypoints":
+                kx, ky = rng.uniform(x, x + w, 17), rng.uniform(y, y + h, 17)
+                det["keypoints"] = np.stack([kx, ky, np.ones(17)], axis=1).reshape(-1).tolist()
+                del det["bbox"]
+            results.append(det)
+    return results
+
+
+def write_json(data: Any, path: Union[str, Path]) -> Path:
+    path = Path(path)
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
@@ -1,7 +1,21 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import pickle
+import tempfile
 import unittest
 from pathlib import Path
 
+import numpy as np
+
+from pycocotools import jsonio, snapshot, streaming
+from pycocotools import mask as maskUtils
+from pycocotools.columnar import AnnotationColumns
+from pycocotools.rlecache import RLECache, sidecar_path
 from pycocotools.coco import COCO
+from synthetic import make_instances, write_json
 
 
 class TestCOCO(unittest.TestCase):
@@ -9,9 +23,7 @@ class TestCOCO(unittest.TestCase):
         pass
 
     def test_coco_json_loading(self):
-        ann_path = (
-            Path("") / "data/annotations/xview_coco_v2_tiny_val_chipped.json"
-        ).resolve()
+        ann_path = (Path("") / "data/annotations/xview_coco_v2_tiny_val_chipped.json").resolve()
         coco = COCO(ann_path)
 
         self.assertEqual(len(coco.imgs), 64)
@@ -19,5 +31,391 @@ class TestCOCO(unittest.TestCase):
         self.assertEqual(len(coco.cats), 35)
 
 
+class TestCOCOColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dataset = make_instances(num_images=20, num_cats=5, keypoints=True)
+        # integer areas have to come back as ints
+        for ann in self.dataset["annotations"][::2]:
+            ann["area"] = int(ann["area"])
+        self.ann_path = write_json(self.dataset, Path(self.tmp.name) / "instances.json")
+        self.coco = COCO(self.ann_path, cache=False)
+        self.coco_col = COCO(self.ann_path, columnar=True, cache=False)
+        # force the dict based filters
+        self.reference = COCO(self.ann_path, cache=False)
+        self.reference._query, self.reference._query_built = None, True
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index_views(self):
+        coco, col = self.coco, self.coco_col
+        self.assertEqual(len(col.anns), len(coco.anns))
+        self.assertEqual(list(col.anns), list(coco.anns))
+        self.assertEqual(list(col.imgToAnns), list(coco.imgToAnns))
+        self.assertEqual(list(col.catToImgs), list(coco.catToImgs))
+        for ann_id in coco.anns:
+            self.assertEqual(col.anns[ann_id], coco.anns[ann_id])
+        for img_id in coco.imgs:
+            self.assertEqual(col.imgToAnns[img_id], coco.imgToAnns[img_id])
+        for cat_id in coco.cats:
+            self.assertEqual(col.catToImgs[cat_id], coco.catToImgs[cat_id])
+        self.assertEqual(col.imgToAnns[-1], [])
+        self.assertNotIn(-1, col.anns)
+        self.assertEqual(list(col.dataset["annotations"]), self.dataset["annotations"])
+
+        # duplicated ids: the dict index keeps the first position and the last annotation
+        dataset = copy.deepcopy(self.dataset)
+        anns = dataset["annotations"]
+        anns[3]["id"] = anns[7]["id"] = anns[0]["id"]
+        coco, col = COCO(cache=False), COCO(columnar=True, cache=False)
+        for c in (coco, col):
+            c.dataset = copy.deepcopy(dataset)
+            c.createIndex()
+        self.assertEqual(len(col.anns), len(coco.anns))
+        self.assertEqual(len(col.anns), len(anns) - 2)
+        self.assertEqual(list(col.anns), list(coco.anns))
+        self.assertEqual(dict(col.anns), coco.anns)
+
+    def test_area_type(self):
+        # == treats 1 and 1.0 alike
+        expected = [type(ann["area"]) for ann in self.dataset["annotations"]]
+        self.assertIn(int, expected)
+        cols = [self.coco_col, COCO(self.ann_path, stream=True, columnar=True, cache=False)]
+        if "gason" in jsonio.available_backends():
+            cols.append(COCO(self.ann_path, columnar=True, cache=False, json_backend="gason"))
+        for col in cols:
+            anns = col.loadAnns(col.getAnnIds())
+            self.assertEqual([type(ann["area"]) for ann in anns], expected)
+
+        columns = AnnotationColumns.from_arrays([1, 1, 2], area=[10, 20, 30])
+        self.assertEqual([ann["area"] for ann in columns.anns(range(3))], [10, 20, 30])
+        self.assertIs(type(columns.ann(0)["area"]), int)
+        columns = AnnotationColumns.from_arrays([1, 1, 2], area=[10.5, 20, 30])
+        self.assertIs(type(columns.ann(1)["area"]), float)
+
+    def test_get_ann_ids(self):
+        coco, col = self.coco, self.coco_col
+        img_ids = sorted(coco.getImgIds())
+        queries = [
+            {},
+            {"imgIds": img_ids[:5]},
+            {"imgIds": img_ids[3]},
+            {"imgIds": [img_ids[4], img_ids[1], img_ids[4], -7]},
+            {"catIds": [2, 3]},
+            {"catIds": 1, "iscrowd": 0},
+            {"areaRng": [0, 32**2]},
+            {"imgIds": img_ids[::2], "catIds": [1, 4], "areaRng": [16, 1e10]},
+            {"iscrowd": 1},
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                ids = self.reference.getAnnIds(**query)
+                self.assertEqual(coco.getAnnIds(**query), ids)
+                self.assertEqual(col.getAnnIds(**query), ids)
+                self.assertEqual(col.loadAnns(ids), coco.loadAnns(ids))
+
+    def test_get_img_ids(self):
+        reference = self.reference
+        img_ids = sorted(reference.getImgIds())
+        queries = [
+            {},
+            {"imgIds": img_ids[:7]},
+            {"catIds": 2},
+            {"catIds": [1, 3]},
+            {"catIds": [1, 2, 3, 4, 5]},
+            {"catIds": [1, 99]},
+            {"imgIds": img_ids[::3], "catIds": [2, 4]},
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                expected = sorted(reference.getImgIds(**query))
+                self.assertEqual(sorted(self.coco.getImgIds(**query)), expected)
+                self.assertEqual(sorted(self.coco_col.getImgIds(**query)), expected)
+                if not query:
+                    continue
+                # getAnnIds takes the same filters (minus refIds)
+                self.assertEqual(self.coco.getAnnIds(**query), reference.getAnnIds(**query))
+
+    def test_ann_to_mask(self):
+        for ann_id in list(self.coco.anns)[:20]:
+            expected = self.coco.annToMask(self.coco.anns[ann_id])
+            actual = self.coco_col.annToMask(self.coco_col.anns[ann_id])
+            self.assertTrue((expected == actual).all())
+
+    def test_in_memory_dataset(self):
+        coco = COCO(columnar=True)
+        coco.dataset = copy.deepcopy(self.dataset)
+        coco.createIndex()
+        self.assertEqual(len(coco.anns), len(self.dataset["annotations"]))
+
+    def test_non_integer_ids(self):
+        backends = ["json"] + (["gason"] if "gason" in jsonio.available_backends() else [])
+        for field, value in (("id", "a2"), ("image_id", 1.5), ("category_id", "1")):
+            dataset = copy.deepcopy(self.dataset)
+            dataset["annotations"][2][field] = value
+            path = write_json(dataset, Path(self.tmp.name) / "non_integer.json")
+            # the dict index takes them
+            self.assertEqual(len(COCO(path, cache=False).anns), len(dataset["annotations"]))
+            for stream, backend in [(True, "json")] + [(False, b) for b in backends]:
+                with self.subTest(field=field, stream=stream, backend=backend):
+                    message = f"non integer .*{field} of annotation 2"
+                    with self.assertRaisesRegex(ValueError, message):
+                        COCO(path, columnar=True, stream=stream, json_backend=backend, cache=False)
+
+
+class TestRLECache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp.name) / "cache"
+        self.dataset = make_instances(num_images=10, num_cats=3)
+        self.ann_path = write_json(self.dataset, Path(self.tmp.name) / "instances.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ann_to_rle(self):
+        coco = COCO(cache=False)
+        coco.dataset = copy.deepcopy(self.dataset)
+        coco.createIndex()
+        rles = {ann_id: coco.annToRLE(ann) for ann_id, ann in coco.anns.items()}
+        self.assertEqual(len(coco.rle_cache), len(rles))
+        for ann_id, ann in coco.anns.items():
+            self.assertIs(coco.annToRLE(ann), rles[ann_id])
+        self.assertEqual(coco.dataset, self.dataset)
+        coco.createIndex()
+        self.assertEqual(len(coco.rle_cache), 0)
+
+    def test_eviction(self):
+        rles = maskUtils.encode(np.asfortranarray(np.eye(64, dtype=np.uint8)[:, :, None]), True)
+        rle, nbytes = rles[0], RLECache(None)
+        nbytes.put(0, rle)
+        cache = RLECache(max_bytes=3 * nbytes.nbytes)
+        for ann_id in range(5):
+            cache.put(ann_id, rle)
+            cache.get(0)
+        self.assertEqual(cache.nbytes, 3 * nbytes.nbytes)
+        self.assertEqual([ann_id in cache for ann_id in range(5)], [1, 0, 0, 1, 1])
+        disabled = RLECache(max_bytes=0)
+        disabled.put(0, rle)
+        self.assertIsNone(disabled.get(0))
+        self.assertEqual(pickle.loads(pickle.dumps(cache)).get(4), rle)
+
+    def test_persist(self):
+        coco = COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        num_anns = len(coco.anns)
+        self.assertEqual(coco.precompute_rles(list(coco.anns)[:5], num_threads=2), 5)
+        self.assertEqual(len(coco.rle_cache), 5)
+        self.assertEqual(coco.precompute_rles(num_threads=3), num_anns - 5)
+        self.assertEqual(coco.save_rles(), sidecar_path(self.ann_path))
+
+        loaded = COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        # persisted masks are only materialized on use
+        self.assertEqual(len(loaded.rle_cache), 0)
+        self.assertTrue(all(ann_id in loaded.rle_cache for ann_id in coco.anns))
+        for ann_id, ann in coco.anns.items():
+            self.assertEqual(loaded.annToRLE(ann), coco.annToRLE(ann))
+        self.assertEqual(len(loaded.rle_cache), num_anns)
+        self.assertNotIn(0, COCO(self.ann_path, cache=False).rle_cache)
+
+        # a changed annotation file doesn't use the old masks
+        write_json(dict(self.dataset, annotations=[]), self.ann_path)
+        self.assertNotIn(1, COCO(self.ann_path, cache=True, cache_dir=self.cache_dir).rle_cache)
+        self.assertNotIn(1, COCO(self.ann_path, cache=False).rle_cache)
+
+
+class TestCOCOSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.tmp.name) / "cache"
+        self.dataset = make_instances(num_images=10, num_cats=3, keypoints=True)
+        self.ann_path = write_json(self.dataset, Path(self.tmp.name) / "instances.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _snapshots(self):
+        return sorted(p.name for p in self.cache_dir.glob("*/manifest.json"))
+
+    def test_dict_round_trip(self):
+        COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(len(self._snapshots()), 1)
+        cached = snapshot.load_snapshot(self.ann_path, cache_dir=self.cache_dir)
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached[0], self.dataset)
+        coco = COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(coco.dataset, self.dataset)
+        self.assertEqual(len(coco.anns), len(self.dataset["annotations"]))
+
+    def test_columnar_round_trip(self):
+        first = COCO(self.ann_path, columnar=True, cache=True, cache_dir=self.cache_dir)
+        cached = snapshot.load_snapshot(self.ann_path, columnar=True, cache_dir=self.cache_dir)
+        self.assertIsNotNone(cached)
+        self.assertFalse(cached[1].id.flags.writeable)
+        coco = COCO(self.ann_path, columnar=True, cache=True, cache_dir=self.cache_dir)
+        self.assertFalse(coco.ann_columns.index.sorted_ids.flags.writeable)
+        self.assertEqual(list(coco.dataset["annotations"]), self.dataset["annotations"])
+        self.assertEqual(coco.dataset["images"], self.dataset["images"])
+        self.assertEqual(list(coco.catToImgs), list(first.catToImgs))
+        for cat_id in coco.cats:
+            self.assertEqual(coco.getImgIds(catIds=[cat_id]), first.getImgIds(catIds=[cat_id]))
+            self.assertEqual(coco.getAnnIds(catIds=[cat_id]), first.getAnnIds(catIds=[cat_id]))
+
+    def test_invalidation(self):
+        COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        COCO(self.ann_path, columnar=True, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(len(self._snapshots()), 2)
+
+        # a changed file misses the cache and replaces the old snapshot
+        self.dataset["annotations"] = self.dataset["annotations"][:5]
+        write_json(self.dataset, self.ann_path)
+        coco = COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(len(coco.anns), 5)
+        self.assertEqual(len(self._snapshots()), 2)
+
+        self.assertEqual(COCO.invalidate_cache(self.ann_path, cache_dir=self.cache_dir), 2)
+        self.assertEqual(self._snapshots(), [])
+        COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(snapshot.clear(self.cache_dir), 1)
+
+    def test_opt_in(self):
+        COCO(self.ann_path, cache_dir=self.cache_dir)
+        COCO(self.ann_path, cache=False, cache_dir=self.cache_dir)
+        self.assertEqual(self._snapshots(), [])
+
+    @unittest.skipUnless(hasattr(os, "getuid"), "POSIX permissions")
+    def test_private(self):
+        COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(self.cache_dir.stat().st_mode & 0o777, 0o700)
+        self.assertIsNotNone(snapshot.load_snapshot(self.ann_path, cache_dir=self.cache_dir))
+
+        # snapshots in a directory others can write to are neither read nor written
+        self.cache_dir.chmod(0o777)
+        with self.assertWarns(UserWarning):
+            self.assertIsNone(snapshot.load_snapshot(self.ann_path, cache_dir=self.cache_dir))
+        with self.assertRaises(PermissionError):
+            snapshot.save_snapshot(self.ann_path, self.dataset, cache_dir=self.cache_dir)
+        with contextlib.redirect_stdout(io.StringIO()), self.assertWarns(UserWarning):
+            coco = COCO(self.ann_path, cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(coco.dataset, self.dataset)
+        self.cache_dir.chmod(0o700)
+        (folder,) = [p.parent for p in self.cache_dir.glob("*/manifest.json")]
+        folder.chmod(0o757)
+        with self.assertWarns(UserWarning):
+            self.assertIsNone(snapshot.load_snapshot(self.ann_path, cache_dir=self.cache_dir))
+
+    def test_shared(self):
+        reference = COCO(self.ann_path, cache=False)
+        coco = COCO(self.ann_path, shared=True, cache_dir=self.cache_dir)
+        self.assertFalse(coco.img_columns.id.flags.writeable)
+        # the pickled object only carries the snapshot location
+        attached = pickle.loads(pickle.dumps(coco))
+        self.assertFalse(attached.ann_columns.id.flags.writeable)
+        for other in (coco, attached, COCO(self.ann_path, shared=True, cache_dir=self.cache_dir)):
+            self.assertEqual(list(other.imgs), list(reference.imgs))
+            self.assertEqual(
+                other.loadImgs(reference.getImgIds()), reference.loadImgs(reference.getImgIds())
+            )
+            self.assertEqual(list(other.dataset["images"]), self.dataset["images"])
+            self.assertEqual(other.loadAnns(other.getAnnIds()), reference.dataset["annotations"])
+            for img_id in reference.imgs:
+                self.assertEqual(other.imgToAnns[img_id], reference.imgToAnns[img_id])
+            for ann in reference.dataset["annotations"][:10]:
+                np.testing.assert_array_equal(other.annToMask(ann), reference.annToMask(ann))
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dataset = make_instances(num_images=15, num_cats=3, keypoints=True)
+        self.dataset["info"]["year"] = 2017
+        self.dataset["images"][0]["file_name"] = "caf\u00e9 \u2603.jpg"
+        self.ann_path = write_json(self.dataset, Path(self.tmp.name) / "instances.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_dataset(self):
+        size = self.ann_path.stat().st_size
+        for chunk_size in (1, 7, 1 << 20):
+            with self.subTest(chunk_size=chunk_size):
+                calls = []
+                dataset = streaming.load_dataset(
+                    self.ann_path, progress=lambda *args: calls.append(args), chunk_size=chunk_size
+                )
+                self.assertEqual(dataset, self.dataset)
+                self.assertEqual(calls[-1], (size, size))
+                columnar = streaming.load_dataset(
+                    self.ann_path, columnar=True, chunk_size=chunk_size
+                )
+                self.assertEqual(list(columnar["annotations"]), self.dataset["annotations"])
+
+    def test_malformed(self):
+        for text in (b'{"images": [1, 2}', b'{"a": 1', b'{"a": 1} 2', b"[]"):
+            with self.subTest(text=text):
+                with open(self.ann_path, "wb") as f:
+                    f.write(text)
+                with self.assertRaises(ValueError):
+                    streaming.load_dataset(self.ann_path, chunk_size=2)
+
+    def test_coco(self):
+        reference = COCO(self.ann_path, cache=False)
+        coco = COCO(self.ann_path, stream=True, cache=False)
+        self.assertEqual(coco.dataset, reference.dataset)
+        col = COCO(self.ann_path, stream=True, columnar=True, cache=False)
+        self.assertEqual(col.loadAnns(col.getAnnIds()), reference.dataset["annotations"])
+
+        bbox_only = COCO(self.ann_path, columnar=True, drop_fields=["segmentation", "keypoints"])
+        for ann, ref in zip(bbox_only.dataset["annotations"], reference.dataset["annotations"]):
+            self.assertNotIn("segmentation", ann)
+            self.assertNotIn("keypoints", ann)
+            self.assertEqual(ann["bbox"], ref["bbox"])
+
+
+@unittest.skipUnless("gason" in jsonio.available_backends(), "pycocotools._gason not built")
+class TestJsonBackends(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dataset = make_instances(num_images=6, keypoints=True)
+        self.dataset["info"] = {
+            "description": "caf\u00e9 \U0001f600",
+            "big": 2**70,
+            "x": [1e-300, -0.5],
+        }
+        self.ann_path = write_json(self.dataset, Path(self.tmp.name) / "instances.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSameJson(self, a, b):
+        # == treats 1 and 1.0 alike, the backends must also agree on the types
+        self.assertEqual(a, b)
+        self.assertEqual(json.dumps(a, sort_keys=True), json.dumps(b, sort_keys=True))
+
+    def test_load(self):
+        reference = jsonio.load(self.ann_path, "json")
+        self.assertSameJson(jsonio.load(self.ann_path, "gason"), reference)
+        with self.assertRaises(ValueError):
+            jsonio.load(self.ann_path, "yaml")
+
+    def test_malformed(self):
+        for text in (b'{"images": [1, 2}', b'{"a": 1', b"[1, 2] 3", b'"abc'):
+            with self.subTest(text=text):
+                with open(self.ann_path, "wb") as f:
+                    f.write(text)
+                with self.assertRaises(ValueError):
+                    jsonio.load(self.ann_path, "gason")
+        with self.assertRaises(OSError):
+            jsonio.load(Path(self.tmp.name) / "missing.json", "gason")
+
+    def test_coco(self):
+        reference = COCO(self.ann_path, cache=False)
+        coco = COCO(self.ann_path, cache=False, json_backend="gason")
+        self.assertSameJson(coco.dataset, reference.dataset)
+        col = COCO(self.ann_path, cache=False, columnar=True, json_backend="gason")
+        self.assertSameJson(col.loadAnns(col.getAnnIds()), reference.dataset["annotations"])
+        self.assertEqual(col.getAnnIds(catIds=[1]), reference.getAnnIds(catIds=[1]))
+
+
 if __name__ == "__main__":
     unittest.main()
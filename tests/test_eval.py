@@ -1,8 +1,26 @@
+import contextlib
+import copy
+import io
+import pickle
+import tempfile
 import unittest
 from pathlib import Path
 
-from pycocotools.coco import COCO
-from pycocotools.cocoeval import COCOeval
+import numpy as np
+
+from pycocotools import mask as maskUtils
+from pycocotools.coco import COCO, ResultSet
+from pycocotools.cocoeval import (
+    COCOeval,
+    Params,
+    _eval,
+    batchOks,
+    matchLoop,
+    matchVectorized,
+)
+from pycocotools.evalimgs import EvalState, PackedEvalImgs
+from pycocotools.incremental import IncrementalCOCOeval
+from synthetic import make_detections, make_instances
 
 
 class TestCOCOEval(unittest.TestCase):
@@ -20,5 +38,886 @@ class TestCOCOEval(unittest.TestCase):
         self.assertEqual(len(coco.cats), 35)
 
 
+def run_eval(dataset, results, iou_type, **kwargs):
+    """evaluate() and accumulate() on copies, so that the inputs can be reused."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        gt = COCO(cache=False)
+        gt.dataset = copy.deepcopy(dataset)
+        gt.createIndex()
+        dt = gt.loadRes(copy.deepcopy(results))
+        use_cats = kwargs.pop("use_cats", 1)
+        E = COCOeval(gt, dt, iou_type, **kwargs)
+        E.params.useCats = use_cats
+        E.evaluate()
+        E.accumulate()
+    return E
+
+
+def reference_accumulate(evaluator):
+    """The loops of COCOeval.accumulate() before it was vectorized, on the params of evaluate()."""
+    p = evaluator.params
+    T, R, K = len(p.iouThrs), len(p.recThrs), len(p.catIds) if p.useCats else 1
+    A, M = len(p.areaRng), len(p.maxDets)
+    precision = -np.ones((T, R, K, A, M))
+    recall = -np.ones((T, K, A, M))
+    scores = -np.ones((T, R, K, A, M))
+    k_list, a_list, i_list = range(K), range(A), range(len(p.imgIds))
+    m_list = p.maxDets
+    I0, A0 = len(p.imgIds), A
+    # retrieve E at each category, area range, and max number of detections
+    for k, k0 in enumerate(k_list):
+        Nk = k0 * A0 * I0
+        for a, a0 in enumerate(a_list):
+            Na = a0 * I0
+            for m, maxDet in enumerate(m_list):
+                E = [evaluator.evalImgs[Nk + Na + i] for i in i_list]
+                E = [e for e in E if not e is None]
+                if len(E) == 0:
+                    continue
+                dtScores = np.concatenate([e["dtScores"][0:maxDet] for e in E])
+
+                # different sorting method generates slightly different results.
+                # mergesort is used to be consistent as Matlab implementation.
+                inds = np.argsort(-dtScores, kind="mergesort")
+                dtScoresSorted = dtScores[inds]
+
+                dtm = np.concatenate([e["dtMatches"][:, 0:maxDet] for e in E], axis=1)[:, inds]
+                dtIg = np.concatenate([e["dtIgnore"][:, 0:maxDet] for e in E], axis=1)[:, inds]
+                gtIg = np.concatenate([e["gtIgnore"] for e in E])
+                npig = np.count_nonzero(gtIg == 0)
+                if npig == 0:
+                    continue
+                tps = np.logical_and(dtm, np.logical_not(dtIg))
+                fps = np.logical_and(np.logical_not(dtm), np.logical_not(dtIg))
+
+                tp_sum = np.cumsum(tps, axis=1).astype(dtype=np.float64)
+                fp_sum = np.cumsum(fps, axis=1).astype(dtype=np.float64)
+                for t, (tp, fp) in enumerate(zip(tp_sum, fp_sum)):
+                    tp = np.array(tp)
+                    fp = np.array(fp)
+                    nd = len(tp)
+                    rc = tp / npig
+                    pr = tp / (fp + tp + np.spacing(1))
+                    q = np.zeros((R,))
+                    ss = np.zeros((R,))
+
+                    if nd:
+                        recall[t, k, a, m] = rc[-1]
+                    else:
+                        recall[t, k, a, m] = 0
+
+                    # numpy is slow without cython optimization for accessing elements
+                    # use python array gets significant speed improvement
+                    pr = pr.tolist()
+                    q = q.tolist()
+
+                    for i in range(nd - 1, 0, -1):
+                        if pr[i] > pr[i - 1]:
+                            pr[i - 1] = pr[i]
+
+                    inds = np.searchsorted(rc, p.recThrs, side="left")
+                    try:
+                        for ri, pi in enumerate(inds):
+                            q[ri] = pr[pi]
+                            ss[ri] = dtScoresSorted[pi]
+                    except:
+                        pass
+                    precision[t, :, k, a, m] = np.array(q)
+                    scores[t, :, k, a, m] = np.array(ss)
+    return precision, recall, scores
+
+
+class TestCOCOEvalParallel(unittest.TestCase):
+    def assertSameEval(self, a, b):
+        for key in ("precision", "recall", "scores"):
+            np.testing.assert_array_equal(a.eval[key], b.eval[key])
+        self.assertEqual(a.eval["counts"], b.eval["counts"])
+        self.assertEqual(len(a.evalImgs), len(b.evalImgs))
+        for ea, eb in zip(a.evalImgs, b.evalImgs):
+            self.assertEqual(ea is None, eb is None)
+            if ea is not None:
+                self.assertEqual(ea.keys(), eb.keys())
+                for key, value in ea.items():
+                    if isinstance(value, np.ndarray):
+                        self.assertEqual(value.dtype, eb[key].dtype)
+                        np.testing.assert_array_equal(value, eb[key])
+                    else:
+                        self.assertEqual(value, eb[key])
+        self.assertEqual(list(a.ious), list(b.ious))
+
+    def test_n_workers(self):
+        dataset = make_instances(num_images=13, keypoints=True)
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            for use_cats in (1, 0):
+                with self.subTest(iou_type=iou_type, use_cats=use_cats):
+                    serial = run_eval(dataset, results, iou_type, use_cats=use_cats)
+                    if use_cats:
+                        self.assertGreater(serial.eval["precision"].max(), 0)
+                    for n_workers in (3, 0):
+                        parallel = run_eval(
+                            dataset, results, iou_type, use_cats=use_cats, n_workers=n_workers
+                        )
+                        self.assertSameEval(serial, parallel)
+
+    @unittest.skipUnless(_eval, "pycocotools._eval not built")
+    def test_engines(self):
+        dataset = make_instances(num_images=13, keypoints=True)
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            for use_cats in (1, 0):
+                with self.subTest(iou_type=iou_type, use_cats=use_cats):
+                    python = run_eval(
+                        dataset, results, iou_type, use_cats=use_cats, engine="python"
+                    )
+                    native = run_eval(
+                        dataset, results, iou_type, use_cats=use_cats, engine="native"
+                    )
+                    self.assertIsNotNone(native._evalImgsNative)
+                    self.assertSameEval(python, native)
+                    if iou_type == "keypoints" or not use_cats:
+                        continue
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        python.summarize()
+                        native.summarize()
+                    np.testing.assert_array_equal(python.stats, native.stats)
+                    self.assertEqual(python.stats_dict_per_class, native.stats_dict_per_class)
+        with self.assertRaises(ValueError):
+            COCOeval(engine="cuda")
+
+    def test_auto_subclass(self):
+        # "auto" runs the per image methods a subclass overrides, with the python engine
+        calls = []
+
+        class EvaluateImg(COCOeval):
+            def evaluateImg(self, imgId, catId, aRng, maxDet):
+                calls.append("evaluateImg")
+                return super().evaluateImg(imgId, catId, aRng, maxDet)
+
+        class ComputeIoU(COCOeval):
+            def computeIoU(self, imgId, catId):
+                calls.append("computeIoU")
+                return super().computeIoU(imgId, catId)
+
+        class ComputeOks(COCOeval):
+            def computeOks(self, imgId, catId):
+                calls.append("computeOks")
+                return super().computeOks(imgId, catId)
+
+        dataset = make_instances(num_images=5, keypoints=True)
+        subclasses = [
+            (EvaluateImg, "evaluateImg", "bbox"),
+            (ComputeIoU, "computeIoU", "bbox"),
+            (ComputeOks, "computeOks", "keypoints"),
+        ]
+        for cls, method, iou_type in subclasses:
+            results = make_detections(dataset, iou_type)
+            E = run_eval(dataset, results, iou_type, engine="python")
+            calls.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                gt = COCO(cache=False)
+                gt.dataset = copy.deepcopy(dataset)
+                gt.createIndex()
+                S = cls(gt, gt.loadRes(copy.deepcopy(results)), iou_type)
+                S.evaluate()
+                S.accumulate()
+            with self.subTest(method=method):
+                self.assertFalse(S._useNative())
+                self.assertIn(method, calls)
+                self.assertSameEval(E, S)
+        self.assertEqual(COCOeval(engine="auto")._useNative(), _eval is not None)
+
+    @unittest.skipUnless(_eval, "pycocotools._eval not built")
+    def test_native_accumulate_subset(self):
+        # accumulate() over a subset of the evaluated params falls back to the Python code
+        dataset = make_instances(num_images=13)
+        results = make_detections(dataset)
+        evals = [
+            run_eval(dataset, results, "bbox", engine="python"),
+            run_eval(dataset, results, "bbox", engine="native"),
+        ]
+        for E in evals:
+            E.params.catIds = E.params.catIds[1:3]
+            E.params.maxDets = [10]
+            with contextlib.redirect_stdout(io.StringIO()):
+                E.accumulate()
+            self.assertEqual(E.eval["counts"][2:], [2, 4, 1])
+        self.assertSameEval(*evals)
+
+        from pycocotools.fast_eval_api import COCOeval_opt
+
+        self.assertEqual(COCOeval_opt(iouType="bbox").engine, "native")
+
+    def test_area_ranges(self):
+        # the area ranges evaluated at once match evaluateImg() of each area range
+        class Evaluator(COCOeval):
+            def evaluateImg(self, imgId, catId, aRng, maxDet):
+                return super().evaluateImg(imgId, catId, aRng, maxDet)
+
+        dataset = make_instances(num_images=13, num_cats=6, keypoints=True)
+        for iou_type in ("bbox", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            evals = []
+            runs = [(Evaluator, "python"), (COCOeval, "python")]
+            if _eval:
+                runs.append((COCOeval, "native"))
+            for cls, engine in runs:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    gt = COCO(cache=False)
+                    gt.dataset = copy.deepcopy(dataset)
+                    gt.createIndex()
+                    E = cls(gt, gt.loadRes(copy.deepcopy(results)), iou_type, engine=engine)
+                    E.params.areaRng += [[0, 1e5**2], [64**2, 1e5**2], [0, 0]]
+                    E.params.areaRngLbl += ["all2", "large2", "none"]
+                    E.evaluate()
+                    E.accumulate()
+                evals.append(E)
+            for other in evals[1:]:
+                with self.subTest(iou_type=iou_type, engine=other.engine):
+                    self.assertSameEval(evals[0], other)
+
+
+class TestSparse(unittest.TestCase):
+    def assertSameSparse(self, dense, sparse):
+        for key in ("precision", "recall", "scores"):
+            np.testing.assert_array_equal(dense.eval[key], sparse.eval[key])
+        self.assertIsInstance(sparse.evalImgs, dict)
+        expected = {n: e for n, e in enumerate(dense.evalImgs) if e is not None}
+        K, A, I = sparse.eval["counts"][2], len(sparse.params.areaRng), len(sparse.params.imgIds)
+        self.assertEqual(len(dense.evalImgs), K * A * I)
+        self.assertEqual([k * A * I + a * I + i for k, a, i in sparse.evalImgs], list(expected))
+        for e, s in zip(expected.values(), sparse.evalImgs.values()):
+            self.assertEqual(e.keys(), s.keys())
+            for key, value in e.items():
+                np.testing.assert_array_equal(value, s[key])
+        for key, ious in sparse.ious.items():
+            np.testing.assert_array_equal(ious, dense.ious[key])
+
+    def test_dense(self):
+        # many categories, so that most (image, category) pairs are empty
+        dataset = make_instances(num_images=13, num_cats=40, keypoints=True)
+        engines = ["python", "native"] if _eval else ["python"]
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            for use_cats in (1, 0):
+                dense = run_eval(dataset, results, iou_type, use_cats=use_cats, engine="python")
+                for engine in engines:
+                    for n_workers in (1, 3):
+                        with self.subTest(
+                            iou_type=iou_type, use_cats=use_cats, engine=engine, n_workers=n_workers
+                        ):
+                            sparse = run_eval(
+                                dataset,
+                                results,
+                                iou_type,
+                                use_cats=use_cats,
+                                engine=engine,
+                                n_workers=n_workers,
+                                sparse=True,
+                            )
+                            if use_cats:
+                                self.assertLess(len(sparse.evalImgs), len(dense.evalImgs))
+                            self.assertSameSparse(dense, sparse)
+
+    def test_accumulate_subset(self):
+        dataset = make_instances(num_images=13, num_cats=40)
+        results = make_detections(dataset)
+        evals = [run_eval(dataset, results, "bbox", engine="python")]
+        for engine in ["python", "native"] if _eval else ["python"]:
+            evals.append(run_eval(dataset, results, "bbox", engine=engine, sparse=True))
+        for E in evals:
+            E.params.catIds = E.params.catIds[3:30]
+            E.params.maxDets = [1, 10]
+            with contextlib.redirect_stdout(io.StringIO()):
+                E.accumulate()
+        for E in evals[1:]:
+            for key in ("precision", "recall", "scores"):
+                np.testing.assert_array_equal(evals[0].eval[key], E.eval[key])
+
+
+class TestPackedEvalImgs(unittest.TestCase):
+    def assertSamePacked(self, a, b):
+        for name in PackedEvalImgs.ARRAYS:
+            self.assertEqual(getattr(a, name).dtype, getattr(b, name).dtype, name)
+            np.testing.assert_array_equal(getattr(a, name), getattr(b, name), err_msg=name)
+
+    def test_round_trip(self):
+        dataset = make_instances(num_images=13, num_cats=6, keypoints=True)
+        engines = ["python", "native"] if _eval else ["python"]
+        for iou_type in ("bbox", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            for sparse in (False, True):
+                evals = [
+                    run_eval(dataset, results, iou_type, engine=engine, sparse=sparse)
+                    for engine in engines
+                ]
+                with self.subTest(iou_type=iou_type, sparse=sparse):
+                    E = evals[0]
+                    packed = E.evalImgsPacked
+                    self.assertIsNone(E._evalImgs)
+                    self.assertGreater(len(packed), 0)
+                    self.assertTrue(np.all(packed.keys[:-1, 0] <= packed.keys[1:, 0]))
+                    for other in evals[1:]:
+                        self.assertSamePacked(packed, other.evalImgsPacked)
+                    p = E._paramsEval
+                    repacked = PackedEvalImgs.from_eval_imgs(
+                        E.evalImgs, len(p.areaRng), len(p.imgIds), len(p.iouThrs)
+                    )
+                    self.assertSamePacked(packed, repacked)
+
+                    # any order of the evaluations sorts back, and pieces concatenate back
+                    order = np.random.RandomState(0).permutation(len(packed))
+                    self.assertSamePacked(packed, packed.take(order).sorted())
+                    parts = [
+                        packed.take(np.arange(n, min(n + 7, len(packed))))
+                        for n in range(0, len(packed), 7)
+                    ]
+                    self.assertSamePacked(packed, PackedEvalImgs.concatenate(parts))
+
+    def test_assigned_eval_imgs(self):
+        # accumulate() of evalImgs assigned by the caller, and of a subclass' evaluateImg
+        class Evaluator(COCOeval):
+            def evaluateImg(self, imgId, catId, aRng, maxDet):
+                return super().evaluateImg(imgId, catId, aRng, maxDet)
+
+        dataset = make_instances(num_images=13)
+        results = make_detections(dataset)
+        E = run_eval(dataset, results, "bbox", engine="python")
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            S = Evaluator(gt, gt.loadRes(copy.deepcopy(results)), "bbox", engine="python")
+            S.evaluate()
+            self.assertIsInstance(S._evalImgs, list)
+            S.accumulate()
+            A = copy.copy(E)
+            A.evalImgs = list(E.evalImgs)
+            A.accumulate()
+        for other in (S, A):
+            for key in ("precision", "recall", "scores"):
+                np.testing.assert_array_equal(E.eval[key], other.eval[key])
+
+
+class TestIncremental(unittest.TestCase):
+    def evaluator(self, dataset, iou_type):
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+        return IncrementalCOCOeval(gt, iou_type)
+
+    def test_batch(self):
+        # image by image in the order of the results gives the evaluate() results
+        dataset = make_instances(num_images=13, num_cats=6, keypoints=True)
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            results.sort(key=lambda r: r["image_id"])
+            # no detections at all for the last image
+            skipped = dataset["images"][-1]["id"]
+            results = [r for r in results if r["image_id"] != skipped]
+            E = run_eval(dataset, results, iou_type, engine="python", sparse=True)
+            S = self.evaluator(dataset, iou_type)
+            for img in dataset["images"][:-1]:
+                S.update(img["id"], [r for r in results if r["image_id"] == img["id"]])
+            with contextlib.redirect_stdout(io.StringIO()):
+                S.compute()
+                if iou_type != "keypoints":
+                    E.summarize()
+            with self.subTest(iou_type=iou_type):
+                for name in PackedEvalImgs.ARRAYS:
+                    np.testing.assert_array_equal(
+                        getattr(E.evalImgsPacked, name), getattr(S.evalImgsPacked, name)
+                    )
+                for key in ("precision", "recall", "scores"):
+                    np.testing.assert_array_equal(E.eval[key], S.eval[key])
+                self.assertEqual(E.stats_dict, S.stats_dict)
+
+    def test_merge(self):
+        # evaluators of shuffled shards of the images, merged through pickled states
+        dataset = make_instances(num_images=17, num_cats=6)
+        results = make_detections(dataset, "bbox")
+        E = run_eval(dataset, results, "bbox")
+        with contextlib.redirect_stdout(io.StringIO()):
+            E.summarize()
+        imgIds = np.random.RandomState(0).permutation([img["id"] for img in dataset["images"]])
+        shards = [self.evaluator(dataset, "bbox") for _ in range(3)]
+        for n, imgId in enumerate(imgIds.tolist()):
+            # as arrays, as the output of a model would be
+            dets = [r for r in results if r["image_id"] == imgId]
+            shards[n % 3].update(
+                imgId,
+                {
+                    "bbox": np.array([r["bbox"] for r in dets]).reshape(-1, 4),
+                    "score": np.array([r["score"] for r in dets]),
+                    "category_id": np.array([r["category_id"] for r in dets], dtype=np.int64),
+                },
+            )
+        S = shards[0]
+        for other in shards[1:]:
+            S.merge(pickle.loads(pickle.dumps(other.state())))
+        with contextlib.redirect_stdout(io.StringIO()):
+            S.compute()
+        for key in ("precision", "recall", "scores"):
+            np.testing.assert_array_equal(E.eval[key], S.eval[key])
+        self.assertEqual(E.stats_dict, S.stats_dict)
+
+        with self.assertRaises(ValueError):
+            S.merge(shards[1].state())
+        with self.assertRaises(ValueError):
+            S.update(int(imgIds[0]), [])
+        other = self.evaluator(dataset, "bbox")
+        other.params.maxDets = [1, 10]
+        with self.assertRaises(ValueError):
+            S.merge(other.state())
+
+    def test_merge_then_update(self):
+        # merged detections are numbered like updated ones, later updates continue after them
+        dataset = make_instances(num_images=13, num_cats=6)
+        results = make_detections(dataset, "bbox")
+        results.sort(key=lambda r: r["image_id"])
+        E = run_eval(dataset, results, "bbox", engine="python", sparse=True)
+        imgIds = [img["id"] for img in dataset["images"]]
+        S, other = self.evaluator(dataset, "bbox"), self.evaluator(dataset, "bbox")
+        for imgIds_, evaluator in ((imgIds[:5], S), (imgIds[5:9], other)):
+            for imgId in imgIds_:
+                evaluator.update(imgId, [r for r in results if r["image_id"] == imgId])
+        state = other.state()
+        dt_ids = state.evalImgs.dt_ids.copy()
+        S.merge(state)
+        np.testing.assert_array_equal(state.evalImgs.dt_ids, dt_ids)
+        for imgId in imgIds[9:]:
+            S.update(imgId, [r for r in results if r["image_id"] == imgId])
+        with contextlib.redirect_stdout(io.StringIO()):
+            S.compute()
+        # every detection once in the evaluations of the first area range
+        ids = [
+            dtId
+            for e in S.evalImgs.values()
+            if e["aRng"] == S.params.areaRng[0]
+            for dtId in e["dtIds"]
+        ]
+        self.assertEqual(len(ids), len(set(ids)))
+        for name in PackedEvalImgs.ARRAYS:
+            np.testing.assert_array_equal(
+                getattr(E.evalImgsPacked, name), getattr(S.evalImgsPacked, name)
+            )
+
+
+class TestEvalState(unittest.TestCase):
+    def shard_eval(self, dataset, results, iou_type, imgIds, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            E = COCOeval(gt, gt.loadRes(copy.deepcopy(results)), iou_type, **kwargs)
+            E.params.imgIds = imgIds
+            E.evaluate()
+        return E
+
+    def test_merge(self):
+        # shards evaluated apart, saved, loaded and merged give the results of one evaluation
+        dataset = make_instances(num_images=17, num_cats=6, keypoints=True)
+        imgIds = np.random.RandomState(0).permutation([img["id"] for img in dataset["images"]])
+        engines = ["python", "native"] if _eval else ["python"]
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            E = run_eval(dataset, results, iou_type)
+            states = []
+            with tempfile.TemporaryDirectory() as tmp:
+                for n, shard in enumerate(np.array_split(imgIds, 3)):
+                    S = self.shard_eval(
+                        dataset,
+                        results,
+                        iou_type,
+                        shard.tolist(),
+                        engine=engines[n % len(engines)],
+                        sparse=n == 1,
+                    )
+                    path = Path(tmp) / f"shard{n}.npz"
+                    S.state().save(path)
+                    states.append(EvalState.load(path))
+            state = EvalState.merge(states)
+            M = COCOeval(E.cocoGt, iouType=iou_type)
+            with contextlib.redirect_stdout(io.StringIO()):
+                M.load_state(state)
+                M.accumulate()
+                if iou_type != "keypoints":
+                    E.summarize()
+                    M.summarize()
+            with self.subTest(iou_type=iou_type):
+                self.assertEqual(M.params.imgIds, E.params.imgIds)
+                for key in ("precision", "recall", "scores"):
+                    np.testing.assert_array_equal(E.eval[key], M.eval[key])
+                self.assertEqual(E.stats_dict, M.stats_dict)
+                self.assertEqual(E.stats_dict_per_class, M.stats_dict_per_class)
+                # the same ground truth in the same order
+                np.testing.assert_array_equal(E.evalImgsPacked.gt_ids, M.evalImgsPacked.gt_ids)
+
+        with self.assertRaises(ValueError):
+            EvalState.merge(states[:2] + states[1:2])
+        P = self.shard_eval(dataset, results, "keypoints", imgIds[:2].tolist())
+        P.params.maxDets = [10]
+        with contextlib.redirect_stdout(io.StringIO()):
+            P.evaluate()
+        with self.assertRaisesRegex(ValueError, "maxDets"):
+            EvalState.merge([states[0], P.state()])
+
+    def test_incremental(self):
+        # the state of a COCOeval merges into an IncrementalCOCOeval
+        dataset = make_instances(num_images=13)
+        results = make_detections(dataset)
+        E = run_eval(dataset, results, "bbox")
+        imgIds = [img["id"] for img in dataset["images"]]
+        S = self.shard_eval(dataset, results, "bbox", imgIds[5:])
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            I = IncrementalCOCOeval(gt, "bbox")
+            for imgId in imgIds[:5]:
+                I.update(imgId, [r for r in results if r["image_id"] == imgId])
+            I.merge(S.state())
+            I.compute()
+        for key in ("precision", "recall", "scores"):
+            np.testing.assert_array_equal(E.eval[key], I.eval[key])
+
+
+class TestMatchers(unittest.TestCase):
+    def match(self, matcher, ious, iscrowd, gtIg, T, iouThrs=None):
+        D, G = ious.shape
+        gtm, dtm, dtIg = np.zeros((T, G)), np.zeros((T, D)), np.zeros((T, D))
+        iouThrs = Params("bbox").iouThrs[:T] if iouThrs is None else iouThrs
+        gtIds, dtIds = list(range(101, 101 + G)), list(range(1, 1 + D))
+        matcher(ious, iouThrs, gtIds, dtIds, iscrowd, gtIg, gtm, dtm, dtIg)
+        return gtm, dtm, dtIg
+
+    def test_random(self):
+        rng = np.random.RandomState(0)
+        for i in range(300):
+            D, G = rng.randint(0, 12), rng.randint(1, 12)
+            # few distinct values, so that ties and values exactly at a threshold are common
+            levels = np.array([0.0, 0.25, 0.3, 0.5, 0.55, 0.7, 0.75, 0.9, 1.0])
+            ious = levels[rng.randint(0, len(levels), (D, G))]
+            iscrowd = (rng.rand(G) < 0.2).astype(int).tolist()
+            gtIg = np.sort((rng.rand(G) < 0.3).astype(int))
+            T = rng.choice([1, 10, 15])
+            with self.subTest(i=i):
+                expected = self.match(matchLoop, ious, iscrowd, gtIg, T)
+                actual = self.match(matchVectorized, ious, iscrowd, gtIg, T)
+                for e, a in zip(expected, actual):
+                    np.testing.assert_array_equal(e, a)
+
+    def test_unsorted_thresholds(self):
+        # detections that only reach a threshold after the first one still match
+        ious = np.array([[0.6, 0.2], [0.3, 0.55]])
+        expected = self.match(matchLoop, ious, [0, 0], np.zeros(2), 2, [0.9, 0.5])
+        actual = self.match(matchVectorized, ious, [0, 0], np.zeros(2), 2, [0.9, 0.5])
+        np.testing.assert_array_equal(expected[1], [[0, 0], [101, 102]])
+        for e, a in zip(expected, actual):
+            np.testing.assert_array_equal(e, a)
+
+        rng = np.random.RandomState(2)
+        for i in range(100):
+            D, G = rng.randint(0, 12), rng.randint(1, 12)
+            ious = rng.rand(D, G)
+            iscrowd = (rng.rand(G) < 0.2).astype(int).tolist()
+            gtIg = np.sort((rng.rand(G) < 0.3).astype(int))
+            iouThrs = rng.permutation(Params("bbox").iouThrs)
+            with self.subTest(i=i):
+                expected = self.match(matchLoop, ious, iscrowd, gtIg, len(iouThrs), iouThrs)
+                actual = self.match(matchVectorized, ious, iscrowd, gtIg, len(iouThrs), iouThrs)
+                for e, a in zip(expected, actual):
+                    np.testing.assert_array_equal(e, a)
+
+    def test_crowded(self):
+        rng = np.random.RandomState(1)
+        ious = rng.rand(100, 300) ** 4
+        gtIg = np.sort((rng.rand(300) < 0.1).astype(int))
+        iscrowd = (rng.rand(300) < 0.05).astype(int).tolist()
+        expected = self.match(matchLoop, ious, iscrowd, gtIg, 15)
+        actual = self.match(matchVectorized, ious, iscrowd, gtIg, 15)
+        for e, a in zip(expected, actual):
+            np.testing.assert_array_equal(e, a)
+
+    def test_eval(self):
+        dataset = make_instances(num_images=13, max_anns=30, keypoints=True)
+        for iou_type in ("bbox", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            for unsorted in (False, True):
+                evals = []
+                for matcher in ("loop", "vectorized"):
+                    params = Params(iou_type)
+                    params.matcher = matcher
+                    if unsorted:
+                        params.iouThrs = params.iouThrs[::-1].copy()
+                    E = run_eval(dataset, results, iou_type, cocoParams=params, engine="python")
+                    evals.append(E)
+                with self.subTest(iou_type=iou_type, unsorted=unsorted):
+                    TestCOCOEvalParallel.assertSameEval(self, *evals)
+
+
+class TestAccumulate(unittest.TestCase):
+    def test_reference(self):
+        dataset = make_instances(num_images=13, max_anns=30)
+        for iou_type in ("bbox", "segm"):
+            results = make_detections(dataset, iou_type, fp_rate=0.8)
+            params = Params(iou_type)
+            # maxDets that cut into the detections of some images, and one that cuts none
+            params.maxDets = [1, 3, 7, 1000]
+            with self.subTest(iou_type=iou_type):
+                E = run_eval(dataset, results, iou_type, cocoParams=params, engine="python")
+                precision, recall, scores = reference_accumulate(E)
+                np.testing.assert_array_equal(E.eval["precision"], precision)
+                np.testing.assert_array_equal(E.eval["recall"], recall)
+                np.testing.assert_array_equal(E.eval["scores"], scores)
+                self.assertGreater(np.count_nonzero(precision > 0), 100)
+
+        # a category with only ignored ground truth and one without detections
+        dataset["annotations"] = [
+            dict(ann, iscrowd=1) if ann["category_id"] == 1 else ann
+            for ann in dataset["annotations"]
+        ]
+        results = [r for r in make_detections(dataset) if r["category_id"] != 2]
+        E = run_eval(dataset, results, "bbox", engine="python")
+        precision, recall, scores = reference_accumulate(E)
+        np.testing.assert_array_equal(E.eval["precision"], precision)
+        np.testing.assert_array_equal(E.eval["recall"], recall)
+        np.testing.assert_array_equal(E.eval["scores"], scores)
+
+
+def reference_oks(dts, gts, sigmas):
+    """The loops of COCOeval.computeOks() before batchOks."""
+    ious = np.zeros((len(dts), len(gts)))
+    vars = (sigmas * 2) ** 2
+    k = len(sigmas)
+    for j, gt in enumerate(gts):
+        g = np.array(gt["keypoints"])
+        xg, yg, vg = g[0::3], g[1::3], g[2::3]
+        k1 = np.count_nonzero(vg > 0)
+        bb = gt["bbox"]
+        x0, x1 = bb[0] - bb[2], bb[0] + bb[2] * 2
+        y0, y1 = bb[1] - bb[3], bb[1] + bb[3] * 2
+        for i, dt in enumerate(dts):
+            d = np.array(dt["keypoints"])
+            xd, yd = d[0::3], d[1::3]
+            if k1 > 0:
+                dx, dy = xd - xg, yd - yg
+            else:
+                z = np.zeros((k))
+                dx = np.max((z, x0 - xd), axis=0) + np.max((z, xd - x1), axis=0)
+                dy = np.max((z, y0 - yd), axis=0) + np.max((z, yd - y1), axis=0)
+            e = (dx**2 + dy**2) / vars / (gt["area"] + np.spacing(1)) / 2
+            if k1 > 0:
+                e = e[vg > 0]
+            ious[i, j] = np.sum(np.exp(-e)) / e.shape[0]
+    return ious
+
+
+class TestOks(unittest.TestCase):
+    def test_reference(self):
+        rng = np.random.RandomState(0)
+        sigmas = Params("keypoints").kpt_oks_sigmas
+        for D, G in ((1, 1), (7, 5), (40, 30)):
+            gts = []
+            for j in range(G):
+                kp = np.concatenate([rng.randint(0, 200, (17, 2)), rng.randint(0, 3, (17, 1))], 1)
+                if j % 3 == 0:
+                    kp[:, 2] = 0  # no visible keypoints
+                x, y = rng.randint(0, 150, 2)
+                gts.append(
+                    {
+                        "keypoints": kp.ravel().tolist(),
+                        "bbox": [int(x), int(y), int(rng.randint(1, 60)), int(rng.randint(1, 60))],
+                        "area": float(rng.uniform(10, 3000)),
+                    }
+                )
+            dts = [{"keypoints": (rng.rand(51) * 200).tolist()} for _ in range(D)]
+            with self.subTest(D=D, G=G):
+                ious = batchOks(
+                    np.array([d["keypoints"] for d in dts]).reshape(D, 17, 3),
+                    np.array([g["keypoints"] for g in gts], dtype=float).reshape(G, 17, 3),
+                    np.array([g["bbox"] for g in gts], dtype=float),
+                    np.array([g["area"] for g in gts]),
+                    sigmas,
+                )
+                np.testing.assert_allclose(ious, reference_oks(dts, gts, sigmas), rtol=1e-12)
+
+
+class TestIoUBatch(unittest.TestCase):
+    def test_compute_ious(self):
+        # the batched ious are the same as those of computeIoU for every (image, category)
+        dataset = make_instances(num_images=13)
+        for iou_type in ("bbox", "segm"):
+            results = make_detections(dataset, iou_type)
+            for use_cats in (1, 0):
+                with self.subTest(iou_type=iou_type, use_cats=use_cats):
+                    E = run_eval(dataset, results, iou_type, use_cats=use_cats, engine="python")
+                    E.params.maxDets = [1, 2]
+                    batched = E.computeIoUs(E.params.imgIds)
+                    self.assertEqual(list(batched), list(E.ious))
+                    for (imgId, catId), ious in batched.items():
+                        expected = E.computeIoU(imgId, catId)
+                        if len(expected) == 0:
+                            self.assertEqual(ious, [])
+                        else:
+                            self.assertLessEqual(len(ious), 2)
+                            np.testing.assert_array_equal(ious, expected)
+
+    def test_groups(self):
+        rng = np.random.RandomState(0)
+        sizes = [(3, 2), (0, 4), (5, 0), (1, 1), (0, 0), (6, 7)]
+        dtSplits = np.cumsum([0] + [m for m, _ in sizes])
+        gtSplits = np.cumsum([0] + [n for _, n in sizes])
+        dt = rng.randint(0, 50, (dtSplits[-1], 4)).astype(float)
+        gt = rng.randint(0, 50, (gtSplits[-1], 4)).astype(float)
+        iscrowd = rng.randint(0, 2, gtSplits[-1])
+        for kind in ("bbox", "rle"):
+            with self.subTest(kind=kind):
+                d, g = dt, gt
+                if kind == "rle":
+                    d, g = maskUtils.frPyObjects(dt, 100, 100), maskUtils.frPyObjects(gt, 100, 100)
+                blocks = maskUtils.iouBatch(d, g, iscrowd, dtSplits, gtSplits)
+                self.assertEqual(len(blocks), len(sizes))
+                for b, ious in enumerate(blocks):
+                    expected = maskUtils.iou(
+                        d[dtSplits[b] : dtSplits[b + 1]],
+                        g[gtSplits[b] : gtSplits[b + 1]],
+                        iscrowd[gtSplits[b] : gtSplits[b + 1]],
+                    )
+                    if len(expected) == 0:
+                        self.assertEqual(ious, [])
+                    else:
+                        np.testing.assert_array_equal(ious, expected)
+        with self.assertRaises(Exception):
+            maskUtils.iouBatch(dt, gt, iscrowd, dtSplits[:-1], gtSplits)
+
+
+class TestLoadResArrays(unittest.TestCase):
+    def arrays(self, results, iou_type):
+        arrays = {
+            key: np.array([r[key] for r in results]) for key in ("image_id", "category_id", "score")
+        }
+        if iou_type == "bbox":
+            arrays["bbox"] = np.array([r["bbox"] for r in results])
+        elif iou_type == "segm":
+            arrays["segmentation"] = [r["segmentation"] for r in results]
+        else:
+            arrays["keypoints"] = np.array([r["keypoints"] for r in results])
+        return arrays
+
+    def test_same_results(self):
+        dataset = make_instances(num_images=13, keypoints=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            gt_columnar = COCO(cache=False, columnar=True)
+            gt_columnar.dataset = copy.deepcopy(dataset)
+            gt_columnar.createIndex()
+        for iou_type in ("bbox", "segm", "keypoints"):
+            results = make_detections(dataset, iou_type)
+            with self.subTest(iou_type=iou_type), contextlib.redirect_stdout(io.StringIO()):
+                expected = gt.loadRes(copy.deepcopy(results))
+                dt = gt.loadRes(self.arrays(results, iou_type))
+                self.assertIsNotNone(dt.ann_columns)
+                self.assertEqual(list(dt.anns), list(expected.anns))
+                for ann_id, ann in expected.anns.items():
+                    actual = dt.anns[ann_id]
+                    self.assertEqual(sorted(actual), sorted(ann))
+                    for key, value in ann.items():
+                        if isinstance(value, dict):
+                            self.assertEqual(actual[key], value)
+                        else:
+                            np.testing.assert_allclose(actual[key], value, err_msg=key)
+                stats = []
+                # dicts, result columns, ground truth and result columns
+                for coco, res in ((gt, expected), (gt, dt), (gt_columnar, dt)):
+                    E = COCOeval(coco, res, iou_type)
+                    E.evaluate()
+                    E.accumulate()
+                    stats.append(E.eval["precision"])
+                for precision in stats[1:]:
+                    np.testing.assert_array_equal(precision, stats[0])
+
+    def test_numpy(self):
+        dataset = make_instances(num_images=13)
+        results = make_detections(dataset)
+        data = np.array(
+            [[r["image_id"], *r["bbox"], r["score"], r["category_id"]] for r in results]
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            dicts = gt.loadRes(data, columnar=False)
+            columns = gt.loadRes(data)
+            self.assertIsNone(dicts.ann_columns)
+            self.assertEqual(columns.loadAnns(columns.getAnnIds()), dicts.dataset["annotations"])
+            data[0, 0] = -1
+            with self.assertRaises(AssertionError):
+                gt.loadRes(data)
+
+
+class TestResultSet(unittest.TestCase):
+    def test_reuse(self):
+        dataset = make_instances(num_images=13)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            results = ResultSet(gt)
+            self.assertEqual(len(results.anns), 0)
+            # segm first, so that stale masks of the same annotation ids would show up
+            for iou_type, seed in (("segm", 1), ("bbox", 2), ("segm", 3)):
+                dets = make_detections(dataset, iou_type, seed=seed)
+                res = results.load(copy.deepcopy(dets))
+                self.assertIs(res, results)
+                self.assertIs(res.imgs, gt.imgs)
+                self.assertIs(res.dataset["categories"], gt.dataset["categories"])
+                expected = gt.loadRes(copy.deepcopy(dets))
+                self.assertEqual(list(res.anns), list(expected.anns))
+                stats = []
+                for dt in (expected, res):
+                    E = COCOeval(gt, dt, iou_type)
+                    E.evaluate()
+                    E.accumulate()
+                    stats.append(E.eval["precision"])
+                np.testing.assert_array_equal(*stats)
+            self.assertEqual(gt.dataset, dataset)
+
+            data = np.array([[1, 0, 0, 10, 10, 0.5, 1]], dtype=np.float64)
+            self.assertIsNotNone(ResultSet(gt, data).ann_columns)
+            self.assertIsNone(results.load(data, columnar=False).ann_columns)
+            data[0, 0] = -1
+            with self.assertRaises(AssertionError):
+                results.load(data)
+
+
+class TestSegmAnnotations(unittest.TestCase):
+    def test_unmodified(self):
+        # segm evaluation leaves the annotations as they are and reuses the converted masks
+        dataset = make_instances(num_images=8)
+        results = make_detections(dataset, "segm")
+        with contextlib.redirect_stdout(io.StringIO()):
+            gt = COCO(cache=False)
+            gt.dataset = copy.deepcopy(dataset)
+            gt.createIndex()
+            dt = gt.loadRes(copy.deepcopy(results))
+            # (bbox of segm results is an array)
+            dt_anns = [(sorted(ann), ann["segmentation"].copy()) for ann in dt.anns.values()]
+            stats = []
+            for _ in range(2):
+                E = COCOeval(gt, dt, "segm")
+                E.evaluate()
+                E.accumulate()
+                E.summarize()
+                stats.append(E.stats)
+        self.assertEqual(gt.dataset, dataset)
+        self.assertEqual([(sorted(ann), ann["segmentation"]) for ann in dt.anns.values()], dt_anns)
+        np.testing.assert_array_equal(stats[0], stats[1])
+        self.assertEqual(len(gt.rle_cache), len(gt.anns))
+
+
 if __name__ == "__main__":
     unittest.main()
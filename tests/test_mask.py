@@ -0,0 +1,358 @@
+import copy
+import pickle
+import threading
+import unittest
+
+import numpy as np
+
+from pycocotools import mask as maskUtils
+from pycocotools.coco import COCO
+from synthetic import make_instances
+
+
+class TestMaskBatch(unittest.TestCase):
+    def setUp(self):
+        dataset = make_instances(num_images=10, max_anns=12)
+        imgs = {img["id"]: img for img in dataset["images"]}
+        self.anns = [ann for ann in dataset["annotations"] if isinstance(ann["segmentation"], list)]
+        self.polys = [ann["segmentation"] for ann in self.anns]
+        self.hs = [imgs[ann["image_id"]]["height"] for ann in self.anns]
+        self.ws = [imgs[ann["image_id"]]["width"] for ann in self.anns]
+
+    def test_fr_py_objects(self):
+        expected = [maskUtils.frPyObjects(p, h, w) for p, h, w in zip(self.polys, self.hs, self.ws)]
+        for num_threads in (1, 3, 0):
+            with self.subTest(num_threads=num_threads):
+                rles = maskUtils.frPyObjectsBatch(self.polys, self.hs, self.ws, num_threads)
+                self.assertEqual(rles, expected)
+        boxes = [np.array([ann["bbox"]]) for ann in self.anns]
+        self.assertEqual(
+            maskUtils.frPyObjectsBatch(boxes, 480, 640, num_threads=3),
+            [maskUtils.frPyObjects(b, 480, 640) for b in boxes],
+        )
+
+    def test_decode(self):
+        rles = maskUtils.frPyObjectsBatch(self.polys, self.hs, self.ws)
+        rles = [rle[0] if i % 2 else rle for i, rle in enumerate(rles)]
+        masks = maskUtils.decodeBatch(rles, num_threads=3)
+        self.assertEqual(len(masks), len(rles))
+        for rle, mask in zip(rles, masks):
+            np.testing.assert_array_equal(mask, maskUtils.decode(rle))
+
+    def test_iou(self):
+        rng = np.random.RandomState(0)
+        sizes = rng.randint(0, 6, (40, 2))
+        dtSplits = np.concatenate([[0], np.cumsum(sizes[:, 0])])
+        gtSplits = np.concatenate([[0], np.cumsum(sizes[:, 1])])
+        dt = rng.randint(0, 50, (dtSplits[-1], 4)).astype(float)
+        gt = rng.randint(0, 50, (gtSplits[-1], 4)).astype(float)
+        iscrowd = rng.randint(0, 2, gtSplits[-1])
+        for d, g in (
+            (dt, gt),
+            (maskUtils.frPyObjects(dt, 64, 64), maskUtils.frPyObjects(gt, 64, 64)),
+        ):
+            expected = maskUtils.iouBatch(d, g, iscrowd, dtSplits, gtSplits)
+            for num_threads in (2, 7):
+                blocks = maskUtils.iouBatch(d, g, iscrowd, dtSplits, gtSplits, num_threads)
+                self.assertEqual(len(blocks), len(expected))
+                for ious, ref in zip(blocks, expected):
+                    if len(ref) == 0:
+                        self.assertEqual(ious, [])
+                    else:
+                        np.testing.assert_array_equal(ious, ref)
+
+    def test_threads(self):
+        # the kernels are safe to call from several threads at once
+        rles = [maskUtils.merge(r) for r in maskUtils.frPyObjectsBatch(self.polys, 480, 640)]
+        expected = maskUtils.iou(rles, rles, [0] * len(rles))
+        results = [None] * 4
+
+        def work(i):
+            results[i] = maskUtils.iou(rles, rles, [0] * len(rles))
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(results))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for ious in results:
+            np.testing.assert_array_equal(ious, expected)
+
+
+class TestNms(unittest.TestCase):
+    def boxes(self, n, seed=0):
+        rng = np.random.RandomState(seed)
+        xy = rng.uniform(0, 300, (n, 2))
+        wh = rng.uniform(1, 60, (n, 2))
+        # duplicates and near-duplicates to get ties at the threshold
+        wh[::7] = 20
+        xy[1::7] = xy[::7][: len(xy[1::7])]
+        return np.round(np.concatenate([xy, wh], 1), 1), rng.rand(n)
+
+    def test_sweep(self):
+        # the sort-and-sweep keeps the same detections as the O(n^2) loops of maskApi.c
+        for n in (0, 1, 2, 50, 1000):
+            dt, _ = self.boxes(n)
+            rles = maskUtils.frPyObjects(dt, 400, 400) if n else []
+            for thr in (-0.1, 0.0, 0.3, 0.5, 0.9, 1.0):
+                with self.subTest(n=n, thr=thr):
+                    keep = maskUtils._mask.nms(dt, thr, sweep=False)
+                    np.testing.assert_array_equal(maskUtils._mask.nms(dt, thr), keep)
+                    if n <= 50:
+                        keep = maskUtils._mask.nms(rles, thr, sweep=False)
+                        np.testing.assert_array_equal(maskUtils._mask.nms(rles, thr), keep)
+        twice = np.array([[10, 10, 20, 20], [10, 10, 20, 20]])
+        np.testing.assert_array_equal(maskUtils._mask.nms(twice, 0.5), [True, False])
+
+    def test_scores(self):
+        dt, scores = self.boxes(200)
+        order = np.argsort(-scores, kind="mergesort")
+        expected = order[maskUtils._mask.nms(dt[order], 0.5)]
+        np.testing.assert_array_equal(maskUtils.nms(dt, 0.5, scores), expected)
+        np.testing.assert_array_equal(maskUtils.nms(dt.tolist(), 0.5, scores.tolist()), expected)
+        np.testing.assert_array_equal(
+            maskUtils.nms(dt[order], 0.5), np.sort(np.argsort(order)[expected])
+        )
+        rles = maskUtils.frPyObjects(dt, 400, 400)
+        np.testing.assert_array_equal(maskUtils.nms(rles, 0.5, scores), expected)
+
+    def test_batched(self):
+        dt, scores = self.boxes(300)
+        classes = np.random.RandomState(1).randint(0, 4, len(dt))
+        inds = maskUtils.batchedNms(dt, 0.5, scores, classes)
+        self.assertTrue(np.all(np.diff(scores[inds]) <= 0))
+        expected = []
+        for c in range(4):
+            (members,) = np.nonzero(classes == c)
+            expected.extend(members[maskUtils.nms(dt[members], 0.5, scores[members])])
+        self.assertEqual(sorted(inds), sorted(expected))
+        self.assertLess(len(maskUtils.nms(dt, 0.5, scores)), len(inds))
+
+
+class TestRLEMask(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        masks = np.asfortranarray((rng.rand(30, 40, 5) > 0.6).astype(np.uint8))
+        masks[:, :, 4] = 0
+        self.masks = masks
+        self.dicts = maskUtils.encode(masks)
+        self.rles = [maskUtils.RLEMask(R) for R in self.dicts]
+
+    def test_conversion(self):
+        for R, rle in zip(self.dicts, self.rles):
+            self.assertEqual(dict(rle), R)
+            self.assertEqual(rle["size"], [30, 40])
+            self.assertEqual(rle["counts"], R["counts"])
+            self.assertEqual(sorted(rle), ["counts", "size"])
+            self.assertEqual(rle, maskUtils.RLEMask(rle))
+            self.assertEqual(rle, pickle.loads(pickle.dumps(rle)))
+            self.assertEqual(rle, copy.deepcopy(rle))
+            # uncompressed RLE
+            counts = np.asarray(rle).tolist()
+            self.assertEqual(sum(counts), 30 * 40)
+            self.assertEqual(maskUtils.RLEMask({"size": [30, 40], "counts": counts}), rle)
+        self.assertEqual(maskUtils.encode(self.masks, rleMask=True), self.rles)
+        self.assertNotEqual(self.rles[0], self.rles[1])
+
+    def test_read_only(self):
+        counts = np.asarray(self.rles[0])
+        self.assertEqual(counts.dtype, np.uint32)
+        self.assertFalse(counts.flags.writeable)
+        with self.assertRaises(ValueError):
+            counts[0] = 1
+        self.assertIs(counts.base.obj, self.rles[0])
+        self.assertEqual(len(self.rles[4].counts), 1)
+
+    def test_functions(self):
+        # every function gives the same results for dicts and RLEMask objects
+        d, r = self.dicts, self.rles
+        np.testing.assert_array_equal(maskUtils.decode(r), self.masks)
+        np.testing.assert_array_equal(maskUtils.decode(r[1]), self.masks[:, :, 1])
+        np.testing.assert_array_equal(maskUtils.area(r), maskUtils.area(d))
+        np.testing.assert_array_equal(maskUtils.toBbox(r), maskUtils.toBbox(d))
+        np.testing.assert_array_equal(
+            maskUtils.iou(r, r, [0, 1, 0, 0, 0]), maskUtils.iou(d, d, [0, 1, 0, 0, 0])
+        )
+        np.testing.assert_array_equal(maskUtils.nms(r, 0.3), maskUtils.nms(d, 0.3))
+        for intersect in (0, 1):
+            merged = maskUtils.merge(r, intersect, rleMask=True)
+            self.assertIsInstance(merged, maskUtils.RLEMask)
+            self.assertEqual(dict(merged), maskUtils.merge(d, intersect))
+        poly = [[1, 1, 20, 1, 20, 25, 1, 25]]
+        self.assertEqual(
+            maskUtils.frPyObjects(poly, 30, 40, rleMask=True),
+            [maskUtils.RLEMask(R) for R in maskUtils.frPyObjects(poly, 30, 40)],
+        )
+
+    def test_ann_to_rle(self):
+        dataset = make_instances(num_images=5)
+        coco = COCO(cache=False)
+        coco.dataset = dataset
+        coco.createIndex()
+        for ann in coco.anns.values():
+            rle = coco.annToRLE(ann)
+            self.assertIsInstance(rle, maskUtils.RLEMask)
+            self.assertIs(coco.annToRLE(dict(ann, segmentation=rle)), rle)
+            np.testing.assert_array_equal(coco.annToMask(ann), maskUtils.decode(dict(rle)))
+
+
+class TestDecodeInto(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.masks = np.asfortranarray((rng.rand(37, 53, 6) > 0.5).astype(np.uint8))
+        self.rles = maskUtils.encode(self.masks)
+
+    def sample(self, box, H, W):
+        # nearest pixel sampling of the window box on a HxW grid, zero outside the masks
+        x, y, w, h = box
+        ys = np.floor(y + (np.arange(H) + 0.5) * h / H).astype(int)
+        xs = np.floor(x + (np.arange(W) + 0.5) * w / W).astype(int)
+        inside = (ys >= 0) & (ys < 37), (xs >= 0) & (xs < 53)
+        out = np.zeros((6, H, W), np.uint8)
+        out[:, inside[0][:, None] & inside[1]] = self.masks[
+            np.clip(ys, 0, 36)[:, None], np.clip(xs, 0, 52)
+        ].transpose(2, 0, 1)[:, inside[0][:, None] & inside[1]]
+        return out
+
+    def test_masks(self):
+        out = np.full((6, 37, 53), 7, dtype=np.uint8)
+        self.assertIs(maskUtils.decodeInto(self.rles, out), out)
+        np.testing.assert_array_equal(out, self.masks.transpose(2, 0, 1))
+        # downsampled, on several threads
+        out = maskUtils.decodeInto(self.rles, np.empty((6, 18, 26), np.uint8), num_threads=3)
+        np.testing.assert_array_equal(out, self.sample((0, 0, 53, 37), 18, 26))
+        single = maskUtils.decodeInto(self.rles[2], np.empty((1, 37, 53), np.uint8))
+        np.testing.assert_array_equal(single[0], self.masks[:, :, 2])
+
+    def test_boxes(self):
+        for box in ([-3.5, 5, 20, 40], [10, 10, 8, 4], [40, 30, 30, 30], [60, 0, 5, 5]):
+            with self.subTest(box=box):
+                out = np.empty((6, 28, 28), np.uint8)
+                maskUtils.decodeInto(self.rles, out, [box] * 6, num_threads=2)
+                np.testing.assert_array_equal(out, self.sample(box, 28, 28))
+        boxes = maskUtils.toBbox(self.rles)
+        out = maskUtils.decodeInto(self.rles, np.empty((6, 14, 14), bool), boxes)
+        for i, box in enumerate(boxes):
+            np.testing.assert_array_equal(out[i], self.sample(box, 14, 14)[i])
+
+    def test_label_map(self):
+        expected = np.zeros((37, 53), int)
+        for i in range(6):
+            expected[self.masks[:, :, i] > 0] = i + 1
+        for dtype in (np.uint8, np.uint16, np.int32):
+            out = maskUtils.decodeInto(self.rles, np.full((37, 53), 9, dtype))
+            np.testing.assert_array_equal(out, expected)
+        out = maskUtils.decodeInto(self.rles, np.empty((37, 53), np.int32), labels=[300] * 6)
+        np.testing.assert_array_equal(out, 300 * (expected > 0))
+        for out in (np.empty((5, 37, 53), np.uint8), np.empty((37, 53), np.float32)):
+            with self.assertRaises(ValueError):
+                maskUtils.decodeInto(self.rles, out)
+        with self.assertRaises(ValueError):
+            maskUtils.decodeInto(self.rles, np.empty((6, 53, 37), np.uint8).transpose(0, 2, 1))
+
+    def test_coco(self):
+        coco = COCO(cache=False)
+        coco.dataset = make_instances(num_images=4, max_anns=20)
+        coco.createIndex()
+        for img_id, anns in coco.imgToAnns.items():
+            if anns:
+                expected = np.stack([coco.annToMask(ann) for ann in anns])
+                np.testing.assert_array_equal(coco.anns_to_masks(anns), expected)
+                label_map = coco.anns_to_masks(anns, label_map=True)
+                self.assertEqual(label_map.dtype, np.uint8)
+                np.testing.assert_array_equal(
+                    label_map, np.max(expected * np.arange(1, len(anns) + 1)[:, None, None], 0)
+                )
+
+
+class TestRLEOps(unittest.TestCase):
+    # every operation against the same operation on the decoded masks
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        masks = (rng.rand(23, 31, 4) > 0.5).astype(np.uint8)
+        masks[:, :, 3] = 0
+        masks[4:15, 6:20, 3] = 1
+        masks[8:10, 9:12, 3] = 0
+        self.masks = np.asfortranarray(masks)
+        self.rles = maskUtils.encode(self.masks)
+
+    def shifted(self, dx, dy, h, w):
+        out = np.zeros((h, w, 4), np.uint8)
+        ys, xs = np.mgrid[:h, :w]
+        inside = (ys - dy >= 0) & (ys - dy < 23) & (xs - dx >= 0) & (xs - dx < 31)
+        out[inside] = self.masks[ys[inside] - dy, xs[inside] - dx]
+        return out
+
+    def test_merge(self):
+        m = self.masks
+        np.testing.assert_array_equal(maskUtils.decode(maskUtils.xor(self.rles)), m.sum(2) % 2)
+        np.testing.assert_array_equal(
+            maskUtils.decode(maskUtils.difference(self.rles, rleMask=True)),
+            m[:, :, 0] & ~m[:, :, 1:].any(2),
+        )
+
+    def test_shift(self):
+        for dx, dy, h, w in ((3, -2, 23, 31), (-40, 0, 23, 31), (5, 5, 10, 50), (-3, -4, 30, 12)):
+            with self.subTest(dx=dx, dy=dy, h=h, w=w):
+                rles = maskUtils._mask.shift(self.rles, dx, dy, h, w)
+                np.testing.assert_array_equal(maskUtils.decode(rles), self.shifted(dx, dy, h, w))
+        np.testing.assert_array_equal(
+            maskUtils.decode(maskUtils.translate(self.rles, 2, 3)), self.shifted(2, 3, 23, 31)
+        )
+        np.testing.assert_array_equal(
+            maskUtils.decode(maskUtils.crop(self.rles[1], [4, 5, 10, 40])),
+            self.shifted(-4, -5, 40, 10)[:, :, 1],
+        )
+        padded = maskUtils.pad(self.rles, 1, 2, 3, 4, rleMask=True)
+        self.assertEqual(padded[0].size, [29, 35])
+        np.testing.assert_array_equal(maskUtils.decode(padded), self.shifted(1, 2, 29, 35))
+        self.assertEqual(maskUtils.pad(padded, -1, -2, -3, -4), self.rles)
+
+    def test_resize(self):
+        for h, w in ((23, 31), (11, 15), (46, 62), (7, 100)):
+            with self.subTest(h=h, w=w):
+                ys = np.floor((np.arange(h) + 0.5) * 23 / h).astype(int)
+                xs = np.floor((np.arange(w) + 0.5) * 31 / w).astype(int)
+                resized = maskUtils.decode(maskUtils.resize(self.rles, h, w))
+                np.testing.assert_array_equal(resized, self.masks[ys][:, xs])
+                # same sampling as decodeInto
+                out = maskUtils.decodeInto(self.rles, np.empty((4, h, w), np.uint8))
+                np.testing.assert_array_equal(out, resized.transpose(2, 0, 1))
+
+    def test_moments(self):
+        ys, xs = np.mgrid[:23, :31]
+        for rle, mask in zip(self.rles, self.masks.transpose(2, 0, 1)):
+            expected = [
+                (mask * xs**i * ys**j).sum()
+                for i, j in ((0, 0), (1, 0), (0, 1), (2, 0), (1, 1), (0, 2))
+            ]
+            np.testing.assert_allclose(maskUtils.moments(rle), expected)
+            np.testing.assert_allclose(
+                maskUtils.centroid(rle), [xs[mask > 0].mean(), ys[mask > 0].mean()]
+            )
+            rows, cols = maskUtils.projections(rle)
+            np.testing.assert_array_equal(rows, mask.sum(1))
+            np.testing.assert_array_equal(cols, mask.sum(0))
+        empty = maskUtils.encode(np.zeros((3, 3, 1), np.uint8, order="F"))
+        self.assertTrue(np.all(np.isnan(maskUtils.centroid(empty))))
+
+    def test_polygons(self):
+        for rle, mask in zip(self.rles, self.masks.transpose(2, 0, 1)):
+            outer, holes = maskUtils.toPolygons(rle, holes=True)
+            filled = maskUtils.decode(maskUtils.merge(maskUtils.frPyObjects(outer, 23, 31)))
+            if holes:
+                filled -= maskUtils.decode(maskUtils.merge(maskUtils.frPyObjects(holes, 23, 31)))
+            np.testing.assert_array_equal(filled, mask)
+        outer, holes = maskUtils.toPolygons(self.rles[3], holes=True)
+        self.assertEqual(outer, [[6.0, 4.0, 20.0, 4.0, 20.0, 15.0, 6.0, 15.0]])
+        self.assertEqual(len(holes), 1)
+        self.assertEqual(
+            maskUtils.toPolygons(maskUtils.encode(np.zeros((3, 3), np.uint8, order="F"))), []
+        )
+        # diagonal pixels are separate polygons
+        diagonal = np.asfortranarray(np.eye(3, dtype=np.uint8))
+        self.assertEqual(len(maskUtils.toPolygons(maskUtils.encode(diagonal))), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()